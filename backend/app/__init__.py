@@ -2,13 +2,19 @@ from flask import Flask
 from flask_cors import CORS
 from app.routes import api
 from dotenv import load_dotenv
+from llm.admission import Admission
+from llm.rag import CourseRAG
+from llm.warmup import LazyRAG
 import os
+import time
 
 
-def create_app():
+def create_app(rag=None):
     """
-    Factory function to create and configure the Flask app.
+    Factory function to create and configure the Flask app. CourseRAG is
+    built in the background unless a ready `rag` is passed in.
     """
+    start = time.perf_counter()
     app = Flask(__name__)
     app.register_blueprint(api, url_prefix="/api")
     if not load_dotenv():
@@ -16,6 +22,13 @@ def create_app():
     print("allowed origin:", os.environ["ALLOWED_ORIGIN"])
     app.config["CORS_HEADERS"] = "Content-Type"
 
-    CORS(app, origins=[os.environ["ALLOWED_ORIGIN"]])
+    CORS(app, origins=[os.environ["ALLOWED_ORIGIN"]], expose_headers=["X-Thread-Id", "X-Trace-Id"])
 
+    if rag is None:
+        lazy_rag = LazyRAG(lambda: CourseRAG(model_code="gemini-2.0-flash"))
+    else:
+        lazy_rag = LazyRAG.of(rag)
+    app.extensions["lazy_rag"] = lazy_rag.start()
+    app.extensions["admission"] = Admission()
+    print(f"App created in {time.perf_counter() - start:.2f}s, CourseRAG warming up.")
     return app
@@ -1,25 +1,112 @@
-from flask import Blueprint, request, jsonify, Response
-from langchain_core.messages import AIMessage, HumanMessage
-from llm.rag import CourseRAG
+from flask import Blueprint, current_app, request, jsonify, Response
+from functools import partial
+import json
+from llm.admission import Rejected, Releasing
+from llm.batch import parse_batch
+from llm.metrics import CONTENT_TYPE, REGISTRY, request_trace_id
+from llm.sessions import parse_query
+from llm.streaming import HEADERS, sse_stream
 
 api = Blueprint("api", __name__)
-rag = CourseRAG(model_code="gemini-2.0-flash")
+
+
+def lazy_rag():
+    """The app's LazyRAG, built in the background by create_app."""
+    return current_app.extensions["lazy_rag"]
+
+
+def admission():
+    return current_app.extensions["admission"]
+
+
+def not_ready():
+    return jsonify({"error": "Starting up, try again shortly"}), 503, {"Retry-After": "5"}
 
 
 @api.route("/query", methods=["POST"])
 def query():
-    input_data = request.json
-    if not input_data or "messages" not in input_data:
+    input_data = request.get_json(silent=True)
+    parsed = parse_query(input_data)
+    if parsed is None:
+        return jsonify(
+            {"error": "Invalid input, expected JSON with 'messages' or 'message' field"}
+        ), 400
+
+    rag = lazy_rag().get(timeout=0)
+    if rag is None:
+        return not_ready()
+
+    input_messages, thread_id = parsed
+    trace_id = request_trace_id(request.headers)
+    try:
+        admission().check_rate(
+            admission().client(
+                request.remote_addr, request.headers, input_data.get("thread_id")
+            )
+        )
+        messages = rag.stream_complete(
+            input_messages, thread_id, trace_id, admit=admission().slot
+        )
+        next(messages)  # admitted, unless answered without the LLM
+    except Rejected as e:
+        return jsonify(e.body()), e.status, e.headers()
+
+    headers = dict(HEADERS)
+    if thread_id:
+        headers["X-Thread-Id"] = thread_id
+    if trace_id:
+        headers["X-Trace-Id"] = trace_id
+    return Response(sse_stream(messages), mimetype="text/event-stream", headers=headers)
+
+
+@api.route("/batch", methods=["POST"])
+def batch():
+    parsed = parse_batch(request.get_json(silent=True))
+    if parsed is None:
         return jsonify(
-            {"error": "Invalid input, expected JSON with 'message' field"}
+            {"error": "Invalid input, expected JSON with a 'conversations' list"}
         ), 400
 
-    input_messages = input_data["messages"]
-    response_generator = rag.stream_complete(input_messages)
+    rag = lazy_rag().get(timeout=0)
+    if rag is None:
+        return not_ready()
+
+    conversations, concurrency = parsed
+    slots = admission().batch_slots(len(conversations), concurrency)
+    try:
+        admission().check_rate(admission().client(request.remote_addr, request.headers))
+        admission().acquire(slots)
+    except Rejected as e:
+        return jsonify(e.body()), e.status, e.headers()
 
     def generate():
-        for message in response_generator:
-            # print(message.content)
-            yield message.content
+        for result in rag.batch_complete(conversations, slots):
+            yield json.dumps(result) + "\n"
+
+    return Response(
+        Releasing(generate(), partial(admission().release, slots)),
+        mimetype="application/x-ndjson",
+    )
+
+
+@api.route("/stats", methods=["GET"])
+def stats():
+    rag = lazy_rag().get(timeout=0)
+    if rag is None:
+        return not_ready()
+    return jsonify({**rag.stats(), "admission": admission().stats()})
+
+
+@api.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+@api.route("/healthz", methods=["GET"])
+def healthz():
+    return jsonify({"status": "ok"})
+
 
-    return Response(generate(), mimetype="text/event-stream")
+@api.route("/readyz", methods=["GET"])
+def readyz():
+    return jsonify(lazy_rag().status()), 200 if lazy_rag().ready else 503
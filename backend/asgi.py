@@ -0,0 +1,176 @@
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from llm.admission import Admission, Rejected
+from llm.batch import parse_batch
+from llm.metrics import CONTENT_TYPE, REGISTRY, request_trace_id
+from llm.rag import CourseRAG
+from llm.sessions import make_checkpointer, parse_query
+from llm.streaming import HEADERS, asse_stream
+from llm.warmup import LazyRAG
+import json
+import os
+
+
+def create_asgi_app(rag=None, build=None):
+    """
+    Factory function to create the ASGI app. It serves the same /api/query
+    contract as the Flask app, but streams from the async graph so that one
+    worker can hold many open chat streams.
+
+    CourseRAG is built in the background once the server starts; until it
+    is ready, /api/readyz and the API routes answer 503. `build`, if given,
+    replaces how it is built (e.g. with stubs for testing): it is called
+    with the session checkpointer and returns the CourseRAG.
+    """
+    if not load_dotenv():
+        print("Could not load .env")
+    print("allowed origin:", os.environ["ALLOWED_ORIGIN"])
+    build = build or (
+        lambda checkpointer: CourseRAG(
+            model_code="gemini-2.0-flash", checkpointer=checkpointer
+        )
+    )
+    session_db = os.environ.get("SESSION_DB")
+    # The SQLite saver binds to the running event loop, so the lifespan
+    # handler makes it on the server's loop rather than the build thread.
+    checkpointer = None
+    if rag is None:
+        lazy_rag = LazyRAG(
+            lambda: build(make_checkpointer() if checkpointer is None else checkpointer)
+        )
+    else:
+        lazy_rag = LazyRAG.of(rag)
+    admission = Admission(use_async=True)
+
+    def not_ready():
+        return JSONResponse(
+            {"error": "Starting up, try again shortly"},
+            status_code=503,
+            headers={"Retry-After": "5"},
+        )
+
+    async def query(request):
+        try:
+            input_data = await request.json()
+        except ValueError:
+            input_data = None
+        parsed = parse_query(input_data)
+        if parsed is None:
+            return JSONResponse(
+                {"error": "Invalid input, expected JSON with 'messages' or 'message' field"},
+                status_code=400,
+            )
+
+        rag = lazy_rag.get(timeout=0)
+        if rag is None:
+            return not_ready()
+
+        input_messages, thread_id = parsed
+        trace_id = request_trace_id(request.headers)
+        try:
+            admission.check_rate(client(request, input_data.get("thread_id")))
+            messages = rag.astream_complete(
+                input_messages, thread_id, trace_id, admit=admission.aslot
+            )
+            await anext(messages)  # admitted, unless answered without the LLM
+        except Rejected as e:
+            return JSONResponse(e.body(), status_code=e.status, headers=e.headers())
+
+        headers = dict(HEADERS)
+        if thread_id:
+            headers["X-Thread-Id"] = thread_id
+        if trace_id:
+            headers["X-Trace-Id"] = trace_id
+        return StreamingResponse(
+            asse_stream(messages), media_type="text/event-stream", headers=headers
+        )
+
+    def client(request, thread_id=None):
+        host = request.client.host if request.client else ""
+        return admission.client(host, request.headers, thread_id)
+
+    async def batch(request):
+        try:
+            input_data = await request.json()
+        except ValueError:
+            input_data = None
+        parsed = parse_batch(input_data)
+        if parsed is None:
+            return JSONResponse(
+                {"error": "Invalid input, expected JSON with a 'conversations' list"},
+                status_code=400,
+            )
+
+        rag = lazy_rag.get(timeout=0)
+        if rag is None:
+            return not_ready()
+
+        conversations, concurrency = parsed
+        slots = admission.batch_slots(len(conversations), concurrency)
+        try:
+            admission.check_rate(client(request))
+            await admission.aacquire(slots)
+        except Rejected as e:
+            return JSONResponse(e.body(), status_code=e.status, headers=e.headers())
+
+        async def generate():
+            try:
+                async for result in rag.abatch_complete(conversations, slots):
+                    yield json.dumps(result) + "\n"
+            finally:
+                admission.release(slots)
+
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+    async def stats(request):
+        rag = lazy_rag.get(timeout=0)
+        if rag is None:
+            return not_ready()
+        return JSONResponse({**rag.stats(), "admission": admission.stats()})
+
+    async def metrics(request):
+        return Response(REGISTRY.render(), headers={"Content-Type": CONTENT_TYPE})
+
+    async def healthz(request):
+        return JSONResponse({"status": "ok"})
+
+    async def readyz(request):
+        return JSONResponse(lazy_rag.status(), status_code=200 if lazy_rag.ready else 503)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        nonlocal checkpointer
+        if session_db and not lazy_rag.ready:
+            checkpointer = make_checkpointer(session_db, use_async=True)
+        lazy_rag.start()
+        try:
+            yield
+        finally:
+            if checkpointer is not None:
+                await checkpointer.conn.close()
+
+    return Starlette(
+        routes=[
+            Route("/api/query", query, methods=["POST"]),
+            Route("/api/batch", batch, methods=["POST"]),
+            Route("/api/stats", stats, methods=["GET"]),
+            Route("/api/metrics", metrics, methods=["GET"]),
+            Route("/api/healthz", healthz, methods=["GET"]),
+            Route("/api/readyz", readyz, methods=["GET"]),
+        ],
+        lifespan=lifespan,
+        middleware=[
+            Middleware(
+                CORSMiddleware,
+                allow_origins=[os.environ["ALLOWED_ORIGIN"]],
+                allow_methods=["GET", "POST"],
+                allow_headers=["Content-Type", "X-Trace-Id"],
+                expose_headers=["X-Thread-Id", "X-Trace-Id"],
+            )
+        ],
+    )
@@ -0,0 +1,165 @@
+"""
+Deterministic stand-ins for the hosted LLM and vector store, so the real
+app and graph can be benchmarked offline.
+"""
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.documents import Document
+from llm.retrievers import Retriever
+from typing import Any
+import asyncio
+import json
+import random
+import time
+
+WORDS = (
+    "the course covers linear algebra probability and machine learning with "
+    "weekly problem sets students said lectures were clear but the workload "
+    "was heavy and the exams were fair"
+).split()
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Streams `answer_tokens` words at `tokens_per_second` after
+    `first_token_latency` seconds. Once tools are bound, it answers the
+    first user turn with a retrieve tool call instead.
+
+    `on_call`, if set, is called with the node the call was made for
+    ("query_or_respond" with tools bound, else "generate") and its seconds.
+    """
+
+    tokens_per_second: float = 50.0
+    first_token_latency: float = 0.3
+    answer_tokens: int = 100
+    seed: int = 0
+    with_tools: bool = False
+    on_call: Any = None
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.model_copy(update={"with_tools": True})
+
+    def _tool_call(self, messages):
+        if not self.with_tools or messages[-1].type != "human":
+            return None
+        return {
+            "name": "retrieve",
+            "args": {"query": messages[-1].content},
+            "id": f"call-{len(messages)}",
+        }
+
+    def _tool_call_chunk(self, tool_call):
+        return ChatGenerationChunk(
+            message=AIMessageChunk(
+                content="",
+                tool_call_chunks=[
+                    {**tool_call, "args": json.dumps(tool_call["args"]), "index": 0}
+                ],
+            )
+        )
+
+    def _record(self, start):
+        if self.on_call is not None:
+            node = "query_or_respond" if self.with_tools else "generate"
+            self.on_call(node, time.perf_counter() - start)
+
+    def _tokens(self, messages):
+        rng = random.Random(f"{self.seed}-{messages[-1].content}")
+        return [rng.choice(WORDS) + " " for _ in range(self.answer_tokens)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        start = time.perf_counter()
+        time.sleep(self.first_token_latency)
+        tool_call = self._tool_call(messages)
+        if tool_call is not None:
+            message = AIMessage(content="", tool_calls=[tool_call])
+        else:
+            tokens = self._tokens(messages)
+            time.sleep((len(tokens) - 1) / self.tokens_per_second)
+            message = AIMessage(content="".join(tokens))
+        self._record(start)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        start = time.perf_counter()
+        time.sleep(self.first_token_latency)
+        tool_call = self._tool_call(messages)
+        if tool_call is not None:
+            yield self._tool_call_chunk(tool_call)
+        else:
+            for i, token in enumerate(self._tokens(messages)):
+                if i:
+                    time.sleep(1 / self.tokens_per_second)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        self._record(start)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        start = time.perf_counter()
+        await asyncio.sleep(self.first_token_latency)
+        tool_call = self._tool_call(messages)
+        if tool_call is not None:
+            yield self._tool_call_chunk(tool_call)
+        else:
+            for i, token in enumerate(self._tokens(messages)):
+                if i:
+                    await asyncio.sleep(1 / self.tokens_per_second)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        self._record(start)
+
+
+class FakeRetriever(Retriever):
+    """Returns `k` made-up TQFR documents after `latency` seconds."""
+
+    def __init__(self, latency=0.05, docs=200):
+        super().__init__()
+        self.latency = latency
+        self.docs = docs
+
+    def _documents(self, query, k):
+        rng = random.Random(query)
+        return [
+            Document(
+                page_content="",
+                metadata={
+                    "doc_id": f"doc-{i}",
+                    "source": f"TQFR for BEN {i}",
+                    "url": f"https://example.com/{i}",
+                    "_id": f"point-{i}",
+                    "_collection_name": "fake",
+                    "_score": 1 / (rank + 1),
+                },
+            )
+            for rank, i in enumerate(rng.sample(range(self.docs), k))
+        ]
+
+    def _search(self, query, k, mode):
+        time.sleep(self.latency)
+        return self._documents(query, k)
+
+    async def _asearch(self, query, k, mode):
+        await asyncio.sleep(self.latency)
+        return self._documents(query, k)
+
+    def _search_batch(self, queries, k, mode):
+        time.sleep(self.latency)
+        return [self._documents(query, k) for query in queries]
+
+    def version(self):
+        return "fake"
+
+
+class FakeDocStore:
+    def __init__(self, body_tokens=1500):
+        self.body = " ".join(random.Random(0).choice(WORDS) for _ in range(body_tokens))
+
+    def get_many(self, doc_ids):
+        return {doc_id: f"{doc_id}\n\n{self.body}" for doc_id in doc_ids}
+
+    async def aget_many(self, doc_ids):
+        return self.get_many(doc_ids)
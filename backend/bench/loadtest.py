@@ -0,0 +1,271 @@
+"""
+Load-test the /api/query pipeline offline: the real Flask (or ASGI) app and
+graph, with the LLM and the vector store replaced by the deterministic fakes
+in fakes.py. Run from the backend directory, e.g.
+
+    python bench/loadtest.py --concurrency 1 8 32 --requests 32
+    python bench/loadtest.py --out bench/baselines/flask.json
+    python bench/loadtest.py --baseline bench/baselines/flask.json
+
+Reports time to first token, total latency percentiles, streamed tokens per
+second and the time spent per graph node, and compares against a baseline
+results file if given.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from contextlib import redirect_stdout
+import argparse
+import functools
+import http.client
+import io
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("ALLOWED_ORIGIN", "http://localhost")
+# Every client is 127.0.0.1, and the point is to load the pipeline.
+os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+os.environ.setdefault("MAX_LLM_STREAMS", "1024")
+
+from fakes import FakeChatModel, FakeDocStore, FakeRetriever  # noqa: E402
+from llm.rag import CourseRAG  # noqa: E402
+from llm.router import Router  # noqa: E402
+
+# Half of the questions name a course and take the router's fast path, the
+# rest go through the tool-calling LLM first.
+QUESTIONS = [
+    "What do students think about CS {n}?",
+    "Is Ma {n}a hard?",
+    "Who teaches Ph {n}b?",
+    "How heavy is the workload of Bi {n}?",
+    "Which humanities are good for a first year student number {n}?",
+    "I like philosophizing about time travel, anything for me {n}?",
+    "What should I take to prepare for machine learning {n}?",
+    "Anything fun and light to fill out term {n}?",
+]
+
+
+class NodeTimer:
+    """Adds up seconds spent per node across threads and event loops."""
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, node, seconds):
+        with self._lock:
+            self.seconds[node] += seconds
+            self.calls[node] += 1
+
+    def wrap(self, node, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(node, time.perf_counter() - start)
+
+        return timed
+
+    def wrap_async(self, node, fn):
+        @functools.wraps(fn)
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                self.add(node, time.perf_counter() - start)
+
+        return timed
+
+    def mean_ms(self):
+        return {
+            node: self.seconds[node] * 1000 / self.calls[node] for node in self.seconds
+        }
+
+
+def build_rag(args, timer):
+    llm = FakeChatModel(
+        tokens_per_second=args.tokens_per_second,
+        first_token_latency=args.first_token_latency,
+        answer_tokens=args.answer_tokens,
+        on_call=timer.add,
+    )
+    rag = CourseRAG(
+        llm=llm,
+        retriever=FakeRetriever(latency=args.retrieval_latency),
+        docstore=FakeDocStore(),
+        retrieval_cache_size=1024 if args.caches else 0,
+        answer_cache_size=512 if args.caches else 0,
+        router=Router() if args.router else False,
+    )
+    # The retrieve tool calls these, so they time the tools node (including
+    # speculative retrievals, which overlap the query_or_respond node).
+    rag.fetch_documents = timer.wrap("tools", rag.fetch_documents)
+    rag.afetch_documents = timer.wrap_async("tools", rag.afetch_documents)
+    return rag
+
+
+def serve(args, rag):
+    """Start the app on a free port in a background thread; returns the port."""
+    if args.server == "flask":
+        from werkzeug.serving import make_server
+        from app import create_app
+
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        server = make_server("127.0.0.1", 0, create_app(rag), threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server.server_port
+
+    import socket
+    import uvicorn
+    from asgi import create_asgi_app
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    config = uvicorn.Config(create_asgi_app(rag), log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return sock.getsockname()[1]
+
+
+def request(port, question):
+    """POST one question and read the stream; returns timings in seconds."""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    start = time.perf_counter()
+    body = json.dumps({"messages": [{"role": "user", "content": question}]})
+    connection.request(
+        "POST", "/api/query", body=body, headers={"Content-Type": "application/json"}
+    )
+    response = connection.getresponse()
+    if response.status != 200:
+        raise RuntimeError(f"HTTP {response.status}: {response.read()[:200]}")
+    first, buffer, text = None, b"", []
+    while True:
+        chunk = response.read1(65536)
+        if not chunk:
+            break
+        buffer += chunk
+        *frames, buffer = buffer.split(b"\n\n")
+        for frame in frames:
+            lines = frame.decode().split("\n")
+            if lines[0].startswith("event: error"):
+                raise RuntimeError(f"stream failed: {frame[:200]}")
+            if not lines[0].startswith("data: "):
+                continue  # heartbeat or the done event
+            text.append(json.loads(lines[0][len("data: ") :])["text"])
+            if first is None:
+                first = time.perf_counter() - start
+    total = time.perf_counter() - start
+    connection.close()
+    tokens = len("".join(text).split())
+    stream = total - (first or total)
+    return {
+        "ttft": first or total,
+        "latency": total,
+        "tokens": tokens,
+        "tokens_per_second": tokens / stream if stream > 0 else 0.0,
+    }
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def summarize(results, seconds):
+    summary = {"requests": len(results), "throughput_rps": len(results) / seconds}
+    for metric in ("ttft", "latency"):
+        values = [r[metric] * 1000 for r in results]
+        for p in (50, 90, 99):
+            summary[f"{metric}_p{p}_ms"] = percentile(values, p)
+    summary["tokens_per_second"] = sum(r["tokens_per_second"] for r in results) / len(
+        results
+    )
+    return summary
+
+
+def run(args):
+    rows = {}
+    for concurrency in args.concurrency:
+        timer = NodeTimer()
+        rag = build_rag(args, timer)
+        port = serve(args, rag)
+        rng = random.Random(args.seed)
+        questions = [
+            rng.choice(QUESTIONS).format(n=i % 10 if args.caches else i)
+            for i in range(args.requests)
+        ]
+        # Keep the app's per-request prints out of the report.
+        with redirect_stdout(io.StringIO() if args.quiet else sys.stdout):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                results = list(pool.map(functools.partial(request, port), questions))
+            seconds = time.perf_counter() - start
+        row = summarize(results, seconds)
+        row["node_ms"] = timer.mean_ms()
+        rows[str(concurrency)] = row
+        print(f"\n--- concurrency {concurrency} ---")
+        for key, value in row.items():
+            if key == "node_ms":
+                print("  node_ms: " + ", ".join(f"{k} {v:.1f}" for k, v in value.items()))
+            else:
+                print(f"  {key}: {value:.1f}")
+    return rows
+
+
+def compare(rows, baseline):
+    print("\n--- change vs baseline ---")
+    for concurrency, row in rows.items():
+        base = baseline.get("results", {}).get(concurrency)
+        if base is None:
+            continue
+        changes = []
+        for key in (
+            "ttft_p50_ms",
+            "ttft_p99_ms",
+            "latency_p50_ms",
+            "latency_p99_ms",
+            "throughput_rps",
+        ):
+            if base.get(key):
+                changes.append(f"{key} {100 * (row[key] - base[key]) / base[key]:+.1f}%")
+        print(f"  concurrency {concurrency}: " + ", ".join(changes))
+
+
+parser = argparse.ArgumentParser(
+    description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+)
+parser.add_argument("--server", choices=["flask", "asgi"], default="flask")
+parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+parser.add_argument("--requests", type=int, default=32)
+parser.add_argument("--tokens-per-second", type=float, default=50.0)
+parser.add_argument("--first-token-latency", type=float, default=0.3)
+parser.add_argument("--answer-tokens", type=int, default=100)
+parser.add_argument("--retrieval-latency", type=float, default=0.05)
+parser.add_argument("--caches", action="store_true", help="keep retrieval/answer caches on")
+parser.add_argument("--no-router", dest="router", action="store_false")
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--verbose", dest="quiet", action="store_false")
+parser.add_argument("--out", help="write results to this JSON file")
+parser.add_argument("--baseline", help="compare against this results file")
+args = parser.parse_args()
+
+rows = run(args)
+if args.baseline:
+    with open(args.baseline) as f:
+        compare(rows, json.load(f))
+if args.out:
+    with open(args.out, "w") as f:
+        json.dump({"config": vars(args), "results": rows}, f, indent=2)
+    print(f"\nWrote {args.out}")
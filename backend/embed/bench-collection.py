@@ -0,0 +1,257 @@
+"""
+Measure the memory and search latency of a collection before and after the
+collection profile (see llm/collection.py) is applied, against a local Qdrant
+server, e.g.
+
+    docker run -p 6333:6333 qdrant/qdrant
+    python embed/bench-collection.py --points 100000
+    python embed/bench-collection.py --snapshot snapshot --out collection.json
+
+A scratch collection is created with the bare settings the embed scripts used
+to create, filled with the snapshot's points (or random ones) and searched
+without and with payload filters. It is then migrated in place to the profile
+and searched again. Recall is measured against exact search, so it shows what
+quantization costs after rescoring.
+"""
+
+from qdrant_client import QdrantClient, models
+from tqdm import tqdm
+import argparse
+import httpx
+import itertools
+import json
+import numpy as np
+import ingest
+import random
+import time
+
+# ingest puts the backend package on sys.path.
+from llm import collection  # noqa: E402
+from llm.snapshot import iter_points, load_snapshot  # noqa: E402
+
+DEPARTMENTS = ("cs", "ma", "ph", "ch", "bi", "ee")
+COURSES = [f"{department} {n}" for department in DEPARTMENTS for n in range(1, 160)]
+TERMS = [f"{year} {term}" for year in range(2015, 2025) for term in ("FA", "WI", "SP")]
+
+
+def random_points(n, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    for start in range(0, n, 1024):
+        vectors = rng.standard_normal((min(1024, n - start), dim), dtype=np.float32)
+        for i, vector in enumerate(vectors, start=start):
+            course = COURSES[i % len(COURSES)]
+            yield i, vector, None, None, {
+                "metadata": {
+                    "doc_id": f"bench-{i // 4}",
+                    "source": f"TQFR for {course}",
+                    "course": [course],
+                    "term": TERMS[i % len(TERMS)],
+                    "corpus": "tqfr",
+                    "chunk_id": f"bench-{i // 2}",
+                }
+            }
+
+
+def match(key, value):
+    return models.Filter(
+        must=[models.FieldCondition(key=key, match=models.MatchValue(value=value))]
+    )
+
+
+def point_structs(points):
+    structs = []
+    for point_id, dense, indices, values, payload in points:
+        vector = {"dense_vector": dense.tolist()}
+        if indices is not None:
+            vector["sparse_vector"] = {
+                "indices": indices.tolist(),
+                "values": values.tolist(),
+            }
+        structs.append(models.PointStruct(id=point_id, vector=vector, payload=payload))
+    return structs
+
+
+def create_bare(client, name, dim):
+    """The collection as the embed scripts created it before the profile."""
+    if client.collection_exists(name):
+        client.delete_collection(name)
+    client.create_collection(
+        collection_name=name,
+        vectors_config={
+            "dense_vector": models.VectorParams(
+                size=dim, distance=models.Distance.COSINE
+            )
+        },
+        sparse_vectors_config={"sparse_vector": models.SparseVectorParams()},
+    )
+
+
+def wait_until_green(client, name):
+    while client.get_collection(name).status != models.CollectionStatus.GREEN:
+        time.sleep(1)
+
+
+def resident_bytes(args):
+    """Qdrant's resident memory from its /metrics endpoint, if it has one."""
+    if args.url == ":memory:":
+        return None
+    headers = {"api-key": args.api_key} if args.api_key else {}
+    try:
+        text = httpx.get(f"{args.url.rstrip('/')}/metrics", headers=headers).text
+    except httpx.HTTPError:
+        return None
+    for line in text.splitlines():
+        if line.startswith("memory_resident_bytes "):
+            return float(line.split()[1])
+    return None
+
+
+def vector_ram_bytes(client, name, dim):
+    """Estimated RAM held by the dense vectors, from the collection config."""
+    info = client.get_collection(name)
+    n = info.points_count
+    dense = info.config.params.vectors["dense_vector"]
+    ram = 0 if dense.on_disk else n * dim * 4
+    if info.config.quantization_config is not None:
+        ram += n * dim
+    return ram
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def run_queries(client, name, queries, k, params):
+    latencies, results = [], []
+    for vector, query_filter in queries:
+        start = time.perf_counter()
+        response = client.query_points(
+            collection_name=name,
+            query=vector,
+            using="dense_vector",
+            query_filter=query_filter,
+            search_params=params,
+            limit=k,
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append([point.id for point in response.points])
+    return latencies, results
+
+
+def measure(client, name, queries, exact, k, args, dim):
+    wait_until_green(client, name)
+    row = {
+        "resident_mb": (resident_bytes(args) or float("nan")) / 2**20,
+        "vector_ram_mb": vector_ram_bytes(client, name, dim) / 2**20,
+    }
+    params = collection.SEARCH_PARAMS
+    for kind, batch in queries.items():
+        run_queries(client, name, batch[:10], k, params)  # warm up
+        latencies, results = run_queries(client, name, batch, k, params)
+        recall = [
+            len(set(got) & set(want)) / max(1, len(want))
+            for got, want in zip(results, exact[kind])
+        ]
+        row[kind] = {
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "recall": sum(recall) / len(recall),
+        }
+    return row
+
+
+def print_row(phase, row):
+    print(
+        f"{phase:7} resident {row['resident_mb']:8.1f} MB, "
+        f"dense vectors in RAM {row['vector_ram_mb']:8.1f} MB"
+    )
+    for kind in ("unfiltered", "doc_id", "course"):
+        stats = row[kind]
+        print(
+            f"        {kind:10} p50 {stats['p50_ms']:6.2f} ms  "
+            f"p95 {stats['p95_ms']:6.2f} ms  recall {stats['recall']:.3f}"
+        )
+
+
+parser = argparse.ArgumentParser(
+    description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+)
+parser.add_argument("--url", default="http://localhost:6333", help="Qdrant server URL")
+parser.add_argument("--api-key")
+parser.add_argument("--snapshot", help="load points from this snapshot")
+parser.add_argument("--points", type=int, default=50000, help="points to load")
+parser.add_argument("--queries", type=int, default=200, help="queries per kind")
+parser.add_argument("--k", type=int, default=8)
+parser.add_argument("--collection", default="coursebot_bench_profile")
+parser.add_argument("--batch-size", type=int, default=512)
+parser.add_argument("--out", help="write results to this JSON file")
+args = parser.parse_args()
+
+client = QdrantClient(location=args.url, api_key=args.api_key)
+if collection.is_local(client):
+    print("Local mode ignores quantization, HNSW and indexes; use a Qdrant server.")
+
+if args.snapshot:
+    snapshot = load_snapshot(args.snapshot)
+    dim = snapshot.dense.shape[1]
+    points = iter_points(snapshot, 0, min(args.points, len(snapshot)))
+else:
+    dim = collection.DENSE_SIZE
+    points = random_points(args.points, dim)
+
+create_bare(client, args.collection, dim)
+progress = tqdm(total=args.points, desc="Points", unit="point")
+sample = []
+for batch in itertools.batched(points, args.batch_size):
+    client.upsert(args.collection, point_structs(batch), wait=True)
+    sample += random.sample(batch, min(len(batch), 4))
+    progress.update(len(batch))
+progress.close()
+
+# Queries are stored vectors plus noise, filtered by the doc or course of
+# another stored point.
+rng = np.random.default_rng(1)
+queries = {"unfiltered": [], "doc_id": [], "course": []}
+for i in range(args.queries):
+    dense = sample[i % len(sample)][1]
+    vector = (dense + rng.standard_normal(dim, dtype=np.float32) * dense.std()).tolist()
+    meta = random.choice(sample)[4]["metadata"]
+    course = (meta.get("course") or [None])[0]
+    queries["unfiltered"].append((vector, None))
+    queries["doc_id"].append((vector, match("metadata.doc_id", meta["doc_id"])))
+    if course:
+        queries["course"].append((vector, match("metadata.course", course)))
+    else:  # points embedded before course was set
+        queries["course"].append((vector, match("metadata.source", meta["source"])))
+exact_params = models.SearchParams(exact=True)
+exact = {
+    kind: run_queries(client, args.collection, batch, args.k, exact_params)[1]
+    for kind, batch in queries.items()
+}
+
+results = {}
+results["before"] = measure(client, args.collection, queries, exact, args.k, args, dim)
+print_row("before", results["before"])
+
+start = time.perf_counter()
+changed = collection.migrate(client, args.collection)
+wait_until_green(client, args.collection)
+results["migration"] = {"changed": changed, "seconds": time.perf_counter() - start}
+print(
+    f"Migrated in {results['migration']['seconds']:.1f}s: "
+    + (", ".join(changed) or "nothing")
+)
+
+results["after"] = measure(client, args.collection, queries, exact, args.k, args, dim)
+print_row("after", results["after"])
+
+client.delete_collection(args.collection)
+if args.out:
+    with open(args.out, "w") as f:
+        json.dump(
+            {"config": vars(args), "profile": collection.PROFILE_VERSION, **results},
+            f,
+            indent=2,
+        )
+    print(f"Wrote {args.out}")
@@ -0,0 +1,101 @@
+"""
+Measure ingestion throughput against an in-memory Qdrant and a fake dense
+embedder that sleeps like a remote embedding call, e.g.
+
+    python embed/bench-ingest.py --chunks 5000 --workers 1 2 4 8
+"""
+
+from fastembed import SparseTextEmbedding
+from qdrant_client import QdrantClient
+from ingest import Chunk
+import argparse
+import ingest
+import random
+import threading
+import time
+
+
+class FakeDenseEmbeddings:
+    """Returns random 768-dim vectors after `latency` seconds per call."""
+
+    def __init__(self, latency=0.2, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+
+    def embed(self, texts):
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise ConnectionError("simulated embedding failure")
+        return [[random.random() for _ in range(768)] for _ in texts]
+
+
+class LockedClient:
+    """The local Qdrant client isn't thread-safe, so serialize calls to it."""
+
+    def __init__(self, client):
+        self._client = client
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def locked(*args, **kwargs):
+            with self._lock:
+                return attr(*args, **kwargs)
+
+        locked.__name__ = name
+        return locked
+
+
+def fake_chunks(n):
+    words = "course students homework lectures exam workload professor units".split()
+    for i in range(n):
+        content = " ".join(random.choices(words, k=200))
+        yield Chunk(
+            id=f"bench-{i}",
+            summary=f"Student feedback for BEN {i}",
+            content=content,
+            meta={"url": "", "source": f"BEN {i}", "doc_id": f"ben-{i}"},
+            body=content,
+        )
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("--chunks", type=int, default=2000)
+parser.add_argument("--batch-size", type=int, default=64)
+parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+parser.add_argument("--sparse-parallel", type=int, default=None)
+parser.add_argument("--latency", type=float, default=0.2)
+parser.add_argument("--failure-rate", type=float, default=0.0)
+args = parser.parse_args()
+
+sparse_embed = SparseTextEmbedding(ingest.SPARSE_MODEL)
+results = []
+for workers in args.workers:
+    print(f"\n--- {workers} workers ---")
+    client = LockedClient(QdrantClient(":memory:"))
+    result = ingest.run(
+        fake_chunks(args.chunks),
+        "bench",
+        client=client,
+        batch_size=args.batch_size,
+        workers=workers,
+        sparse_parallel=args.sparse_parallel,
+        dense_embed=FakeDenseEmbeddings(args.latency, args.failure_rate),
+        sparse_embed=sparse_embed,
+    )
+    results.append((workers, result))
+
+print(f"\n{'workers':>8} {'chunks/s':>10} " + " ".join(
+    f"{stage:>8}" for stage in ("chunk", "sparse", "dense", "upsert", "docs")
+))
+for workers, result in results:
+    print(
+        f"{workers:>8} {args.chunks / result['seconds']:>10.1f} "
+        + " ".join(
+            f"{result['stages'].get(stage, 0.0):>7.1f}s"
+            for stage in ("chunk", "sparse", "dense", "upsert", "docs")
+        )
+    )
@@ -0,0 +1,134 @@
+"""
+Compare dense search latency and per-query memory of the in-process snapshot
+retriever (RETRIEVER_BACKEND=local) with the remote Qdrant path, e.g.
+
+    python embed/bench-snapshot.py --points 100000
+    python embed/bench-snapshot.py --snapshot snapshot --url http://localhost:6333
+
+Without --snapshot, random float32 and int8 snapshots of --points vectors are
+written to a temporary directory. The local rows time scoring and top-k only
+(the query embedding is the same call for both backends); "int8 upcast" is the
+old scoring of an int8 snapshot, which cast the whole matrix to float32 per
+query. With --url, the same queries are sent to the collection the snapshot
+was imported into (see import-snapshot.py), with the collection profile's
+search parameters.
+"""
+
+from qdrant_client import QdrantClient
+from tempfile import TemporaryDirectory
+import argparse
+import json
+import numpy as np
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm import collection  # noqa: E402
+from llm.retrievers import LocalRetriever  # noqa: E402
+from llm.snapshot import write_snapshot  # noqa: E402
+
+
+def random_points(n, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    for i in range(n):
+        yield i, rng.standard_normal(dim, dtype=np.float32), [], [], {"metadata": {}}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def time_queries(search, queries):
+    """p50/p95 latency of `search(vector)` and the peak memory it allocated."""
+    search(queries[0])  # warm up
+    latencies = []
+    tracemalloc.start()
+    for vector in queries:
+        start = time.perf_counter()
+        search(vector)
+        latencies.append((time.perf_counter() - start) * 1000)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "peak_mb": peak / 2**20,
+    }
+
+
+def upcast_scores(retriever, vector):
+    """Dense scores as computed before int8 snapshots were scored in blocks."""
+    vector = np.asarray(vector, dtype=np.float32)
+    vector /= np.linalg.norm(vector) or 1
+    return (retriever.snapshot.dense @ vector) * retriever.snapshot.dense_scale
+
+
+def local_rows(path, queries, k):
+    retriever = LocalRetriever(path, None, None, mode="dense")
+    rows = {}
+    label = "int8" if retriever.snapshot.dense_scale is not None else "float32"
+    rows[f"local {label}"] = time_queries(
+        lambda v: retriever.top_k(retriever.dense_scores(v), k, "dense"), queries
+    )
+    if label == "int8":
+        rows["local int8 upcast"] = time_queries(
+            lambda v: retriever.top_k(upcast_scores(retriever, v), k, "dense"), queries
+        )
+    return rows
+
+
+def remote_row(args, queries):
+    client = QdrantClient(url=args.url, api_key=args.api_key, port=None)
+    return time_queries(
+        lambda v: client.query_points(
+            collection_name=args.collection,
+            query=list(map(float, v)),
+            using="dense_vector",
+            search_params=collection.SEARCH_PARAMS,
+            limit=args.k,
+        ),
+        queries,
+    )
+
+
+parser = argparse.ArgumentParser(
+    description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+)
+parser.add_argument("--snapshot", help="snapshot directory (default: random ones)")
+parser.add_argument("--points", type=int, default=100000)
+parser.add_argument("--dim", type=int, default=collection.DENSE_SIZE)
+parser.add_argument("--queries", type=int, default=100)
+parser.add_argument("--k", type=int, default=8)
+parser.add_argument("--url", help="also query this Qdrant server")
+parser.add_argument("--api-key")
+parser.add_argument("--collection", default="coursebot_hybrid")
+parser.add_argument("--out", help="write results to this JSON file")
+args = parser.parse_args()
+
+rng = np.random.default_rng(1)
+queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+results = {}
+if args.snapshot:
+    results.update(local_rows(args.snapshot, queries, args.k))
+else:
+    with TemporaryDirectory() as tmp:
+        for int8 in (False, True):
+            path = os.path.join(tmp, "int8" if int8 else "float32")
+            manifest = {"collection": "bench"}
+            write_snapshot(path, random_points(args.points, args.dim), manifest, int8)
+            results.update(local_rows(path, queries, args.k))
+if args.url:
+    results["qdrant"] = remote_row(args, queries)
+
+for name, row in results.items():
+    print(
+        f"{name:18} p50 {row['p50_ms']:7.2f} ms  p95 {row['p95_ms']:7.2f} ms  "
+        f"peak {row['peak_mb']:7.1f} MB"
+    )
+if args.out:
+    with open(args.out, "w") as f:
+        json.dump({"config": vars(args), "results": results}, f, indent=2)
+    print(f"Wrote {args.out}")
@@ -1,45 +1,11 @@
-import itertools
-from fastembed import SparseTextEmbedding
-from langchain_google_vertexai import VertexAIEmbeddings
-from qdrant_client import QdrantClient
-from qdrant_client.models import (
-    Distance,
-    PointStruct,
-    SparseVectorParams,
-    VectorParams,
-)
-from dotenv import load_dotenv
-from tqdm import tqdm
+from ingest import Chunk
+import ingest
 import json
 import os
 import uuid
 
-if not load_dotenv():
-    print("Unable to get environment variables via pydotenv.")
-
-vector_db = QdrantClient(
-    url=os.environ["QDRANT_URL"], api_key=os.environ["QDRANT_API_KEY"], port=None
-)
-dense_model = "text-embedding-004"
-sparse_model = "Qdrant/bm25"
-dense_embed = VertexAIEmbeddings(model=dense_model, project="coursebot-453309")
-sparse_embed = SparseTextEmbedding(sparse_model)
-
-collection_name = "coursebot_hybrid"
-if not vector_db.collection_exists(collection_name):
-    vector_db.create_collection(
-        collection_name=collection_name,
-        vectors_config={
-            "dense_vector": VectorParams(
-                size=768, distance=Distance.COSINE
-            )  # 768 is dim for google embedding model
-        },
-        sparse_vectors_config={"sparse_vector": SparseVectorParams()},
-    )
-
-
-with open("json/tqfr.json", "r") as f:
-    data = json.load(f)
+# ingest puts the backend package on sys.path.
+from llm.tqfr import report_rows, write_stats  # noqa: E402
 
 
 def score2text(score, avg):
@@ -97,148 +63,123 @@ def process_score(question, data, instructor=None):
     )
 
 
-with open("json/tqfr.json", "r") as f:
-    data = json.load(f)
+def tqfr_chunks(data):
+    for key in data:
+        for term in data[key]:
+            report = data[key][term]
+            course_id, name = report["course_id"], report["name"]
 
-print("Creating chunks for TQFRs...")
-ids = []
-metas = []
-summaries = []
-contents = []
-for key in tqdm(data):
-    for term in data[key]:
-        report = data[key][term]
-        course_id, name = report["course_id"], report["name"]
-
-        course_qas = []
-        for question, response_data in report["course"].items():
-            if "score" in response_data:
-                course_qas.append(process_score(question, response_data))
-            else:
-                course_qas.append(process_table(question, response_data))
-
-        report_id = f"{key}-{term.lower().replace('-', '_').replace(' ', '-')}-tqfr"
-        source = f"TQFR {term} for {report['course_id']}: {name}"
-        course_chunk_id = f"{report_id}-course"
-        course_chunk_content = (
-            f"Course-related feedback during {term} for {course_id}: {name}:\n"
-            + f"Response rate was {report['response_rate']}\n"
-            + "\n".join(course_qas)
-        )
-        ids.append(str(uuid.uuid5(uuid.NAMESPACE_DNS, course_chunk_id)))
-        metas.append(
-            {
-                "url": report["url"],
-                "source": source,
-                "text": report["raw_text"],
-                "dense_model": dense_model,
-                "sparse_model": sparse_model,
-                "doc_id": report_id,
-            }
-        )
-        summaries.append(
-            f"Student feedback for {course_id}: {name} during the {term} term"
-        )
-        contents.append(course_chunk_content)
-
-        if "instructor" in report:
-            for instructor, inst_data in report["instructor"].items():
-                inst_qas = []
-                for question, response_data in inst_data.items():
-                    if question == "type":
-                        continue
-                    if "score" in response_data:
-                        inst_qas.append(
-                            process_score(question, response_data, instructor)
-                        )
-                    else:
-                        inst_qas.append(
-                            process_table(question, response_data, instructor)
-                        )
-
-                chunk_id = f"{report_id}-{"-".join([name.lower() for name in instructor.split()])}"
-                chunk_content = (
-                    f"{inst_data['type']} feedback for {instructor} during {term} for {course_id}: {name}:\n"
-                    + f"Response rate was {report['response_rate']}\n"
-                    + "\n".join(inst_qas)
-                )
-                ids.append(str(uuid.uuid5(uuid.NAMESPACE_DNS, chunk_id)))
-                metas.append(
-                    {
-                        "url": report["url"],
-                        "source": source,
-                        "text": report["raw_text"],
-                        "dense_model": dense_model,
-                        "sparse_model": sparse_model,
-                        "doc_id": report_id,
-                    }
-                )
-                summaries.append(
-                    f"Student feedback for {instructor} teaching {course_id}: {name} during the {term} term"
-                )
-                contents.append(chunk_content)
-
-        comment_chunk_id = f"{report_id}-comments"
-        comment_chunk_content = (
-            f"Comments/advice from students who took {course_id}: {name} during {term}:\n"
-            + "\n".join(report["comments"])
-        )
-        ids.append(str(uuid.uuid5(uuid.NAMESPACE_DNS, comment_chunk_id)))
-        metas.append(
-            {
+            course_qas = []
+            for question, response_data in report["course"].items():
+                if "score" in response_data:
+                    course_qas.append(process_score(question, response_data))
+                else:
+                    course_qas.append(process_table(question, response_data))
+
+            report_id = f"{key}-{term.lower().replace('-', '_').replace(' ', '-')}-tqfr"
+            source = f"TQFR {term} for {report['course_id']}: {name}"
+            meta = {
                 "url": report["url"],
                 "source": source,
-                "text": report["raw_text"],
-                "dense_model": dense_model,
-                "sparse_model": sparse_model,
                 "doc_id": report_id,
+                "course": ingest.course_codes(course_id),
+                "term": term,
             }
-        )
-        summaries.append(
-            f"Comments/advice from students who took {course_id}: {name} during {term}"
-        )
-        contents.append(comment_chunk_content)
-
-
-print("Embedding document chunks...")
-dense_summaries = dense_embed.embed(summaries)
-sparse_summmaries = sparse_embed.embed(summaries)
-dense_contents = dense_embed.embed(contents)
-sparse_contents = sparse_embed.embed(contents)
-
-
-def id2uuid(id):
-    return str(uuid.uuid5(uuid.NAMESPACE_DNS, id))
-
-
-print("Creating points...")
-points = []
-for id, ds, ss, dc, sc, meta in tqdm(
-    zip(ids, dense_summaries, sparse_summmaries, dense_contents, sparse_contents, metas)
-):
-    points.append(
-        PointStruct(
-            id=id2uuid(f"{id}-summary"),
-            vector={
-                "dense_vector": ds,
-                "sparse_vector": vars(ss),
-            },
-            payload={"metadata": meta},
-        )
-    )
-    points.append(
-        PointStruct(
-            id=id2uuid(f"{id}-content"),
-            vector={
-                "dense_vector": dc,
-                "sparse_vector": vars(sc),
-            },
-            payload={"metadata": meta},
-        )
-    )
+            keys = ingest.lookup_keys(
+                course_ids=[course_id], instructors=report.get("instructor", {}).keys()
+            )
+
+            course_chunk_id = f"{report_id}-course"
+            course_chunk_content = (
+                f"Course-related feedback during {term} for {course_id}: {name}:\n"
+                + f"Response rate was {report['response_rate']}\n"
+                + "\n".join(course_qas)
+            )
+            yield Chunk(
+                id=str(uuid.uuid5(uuid.NAMESPACE_DNS, course_chunk_id)),
+                summary=f"Student feedback for {course_id}: {name} during the {term} term",
+                content=course_chunk_content,
+                meta=dict(meta),
+                body=report["raw_text"],
+                keys=keys,
+            )
+
+            if "instructor" in report:
+                for instructor, inst_data in report["instructor"].items():
+                    inst_qas = []
+                    for question, response_data in inst_data.items():
+                        if question == "type":
+                            continue
+                        if "score" in response_data:
+                            inst_qas.append(
+                                process_score(question, response_data, instructor)
+                            )
+                        else:
+                            inst_qas.append(
+                                process_table(question, response_data, instructor)
+                            )
+
+                    chunk_id = f"{report_id}-{"-".join([name.lower() for name in instructor.split()])}"
+                    chunk_content = (
+                        f"{inst_data['type']} feedback for {instructor} during {term} for {course_id}: {name}:\n"
+                        + f"Response rate was {report['response_rate']}\n"
+                        + "\n".join(inst_qas)
+                    )
+                    yield Chunk(
+                        id=str(uuid.uuid5(uuid.NAMESPACE_DNS, chunk_id)),
+                        summary=f"Student feedback for {instructor} teaching {course_id}: {name} during the {term} term",
+                        content=chunk_content,
+                        meta=dict(meta),
+                        body=report["raw_text"],
+                        keys=keys,
+                    )
+
+            comment_chunk_id = f"{report_id}-comments"
+            comment_chunk_content = (
+                f"Comments/advice from students who took {course_id}: {name} during {term}:\n"
+                + "\n".join(report["comments"])
+            )
+            yield Chunk(
+                id=str(uuid.uuid5(uuid.NAMESPACE_DNS, comment_chunk_id)),
+                summary=f"Comments/advice from students who took {course_id}: {name} during {term}",
+                content=comment_chunk_content,
+                meta=dict(meta),
+                body=report["raw_text"],
+                keys=keys,
+            )
+
+
+def tqfr_rows(data):
+    """The numeric answers of every report, for the TQFR stats store."""
+    for key in data:
+        for term in data[key]:
+            report = data[key][term]
+            report_id = f"{key}-{term.lower().replace('-', '_').replace(' ', '-')}-tqfr"
+            section = (
+                report["course_id"],
+                report["name"],
+                term,
+                report_id,
+                report["url"],
+                report["response_rate"],
+            )
+            yield from report_rows(*section, report["course"])
+            for instructor, inst_data in report.get("instructor", {}).items():
+                yield from report_rows(*section, inst_data, instructor)
+
+
+args = ingest.parse_args("Embed TQFRs into Qdrant.")
+with open("json/tqfr.json", "r") as f:
+    data = json.load(f)
 
-print("Uploading to Qdrant...")
-for batch in itertools.batched(points, 512):
-    vector_db.upsert(collection_name=collection_name, points=list(batch))
+ingest.run(
+    tqfr_chunks(data),
+    "tqfr",
+    batch_size=args.batch_size,
+    full=args.full,
+    workers=args.workers,
+    sparse_parallel=args.sparse_parallel,
+)
 
-print(f"Uploaded {len(points)} points to Qdrant.")
+stats_path = os.environ.get("TQFR_STATS_PATH", "tqfr_stats.npz")
+print(f"Wrote {write_stats(stats_path, tqfr_rows(data))} TQFR scores to {stats_path}")
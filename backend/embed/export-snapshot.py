@@ -0,0 +1,93 @@
+"""
+Export the Qdrant collection to a snapshot directory that CourseRAG can
+search in process with RETRIEVER_BACKEND=local, or that
+embed/import-snapshot.py loads into another Qdrant instance without any
+embedding calls.
+"""
+
+from tqdm import tqdm
+import argparse
+import ingest
+
+# ingest puts the backend package on sys.path.
+from llm.snapshot import write_snapshot  # noqa: E402
+
+
+def scroll_points(client, collection_name):
+    offset = None
+    progress = tqdm(
+        total=client.count(collection_name).count, desc="Exporting", unit="point"
+    )
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            limit=1024,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        for point in points:
+            sparse = point.vector["sparse_vector"]
+            yield (
+                point.id,
+                point.vector["dense_vector"],
+                sparse.indices,
+                sparse.values,
+                point.payload,
+            )
+        progress.update(len(points))
+        if offset is None:
+            progress.close()
+            return
+
+
+def collection_config(client, collection_name):
+    """The vector config of a collection, to recreate it on import."""
+    params = client.get_collection(collection_name).config.params
+    return {
+        "vectors": params.model_dump(mode="json", exclude_none=True)["vectors"],
+        "sparse_vectors": {
+            name: config.model_dump(mode="json", exclude_none=True)
+            for name, config in (params.sparse_vectors or {}).items()
+        },
+    }
+
+
+def scroll_docs(client):
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=ingest.DOCS_COLLECTION,
+            limit=1024,
+            offset=offset,
+            with_payload=True,
+            with_vectors=False,
+        )
+        for point in points:
+            yield point.payload
+        if offset is None:
+            return
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument("--out", default="snapshot", help="snapshot directory")
+parser.add_argument(
+    "--int8", action="store_true", help="store dense vectors quantized to int8"
+)
+args = parser.parse_args()
+
+client = ingest.connect()
+manifest = write_snapshot(
+    args.out,
+    scroll_points(client, ingest.COLLECTION_NAME),
+    {
+        "collection": ingest.COLLECTION_NAME,
+        "dense_model": ingest.DENSE_MODEL,
+        "sparse_model": ingest.SPARSE_MODEL,
+        "collection_config": collection_config(client, ingest.COLLECTION_NAME),
+        "collection_profile": ingest.collection.PROFILE_VERSION,
+    },
+    int8=args.int8,
+    docs=scroll_docs(client) if client.collection_exists(ingest.DOCS_COLLECTION) else None,
+)
+print(f"Exported {manifest['points']} points to {args.out}.")
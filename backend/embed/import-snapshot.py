@@ -0,0 +1,143 @@
+"""
+Load a snapshot written by embed/export-snapshot.py into a Qdrant instance,
+without any embedding calls, e.g.
+
+    python embed/import-snapshot.py snapshot                  # QDRANT_URL
+    python embed/import-snapshot.py snapshot --path qdrant-data  # local, on disk
+    python embed/import-snapshot.py snapshot --url http://localhost:6333 --recreate
+
+Points and documents are upserted in batches from several threads.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from qdrant_client import QdrantClient
+from qdrant_client.models import PointStruct
+from tqdm import tqdm
+import argparse
+import itertools
+import ingest
+import time
+
+# ingest puts the backend package on sys.path.
+from llm import collection  # noqa: E402
+from llm.snapshot import iter_docs, iter_points, load_snapshot  # noqa: E402
+
+
+def create_collections(client, manifest, collection_name, recreate):
+    """
+    Create the collections with the current profile (see llm/collection.py),
+    whichever one the snapshot was exported with.
+    """
+    for name in (collection_name, ingest.DOCS_COLLECTION):
+        if recreate and client.collection_exists(name):
+            client.delete_collection(name)
+    # Snapshots from before the manifest kept the config have 768-dim vectors.
+    config = manifest.get("collection_config") or {}
+    dense = config.get("vectors", {}).get("dense_vector", {})
+    collection.ensure(
+        client,
+        collection_name,
+        ingest.DOCS_COLLECTION,
+        dense_size=dense.get("size", collection.DENSE_SIZE),
+    )
+
+
+def point_structs(points):
+    return [
+        PointStruct(
+            id=point_id,
+            vector={
+                "dense_vector": dense.tolist(),
+                "sparse_vector": {
+                    "indices": indices.tolist(),
+                    "values": values.tolist(),
+                },
+            },
+            payload=payload,
+        )
+        for point_id, dense, indices, values, payload in points
+    ]
+
+
+def doc_structs(docs):
+    return [
+        PointStruct(id=ingest.doc_point_id(doc["doc_id"]), vector={}, payload=doc)
+        for doc in docs
+    ]
+
+
+def upload(client, collection_name, batches, workers, progress):
+    def write(points):
+        ingest.retry(
+            client.upsert, collection_name=collection_name, points=points, wait=True
+        )
+        progress.update(len(points))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for points in batches:
+            if len(in_flight) >= 2 * workers:
+                in_flight.popleft().result()
+            in_flight.append(pool.submit(write, points))
+        for future in in_flight:
+            future.result()
+
+
+parser = argparse.ArgumentParser(
+    description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+)
+parser.add_argument("snapshot", help="snapshot directory")
+parser.add_argument("--url", help="Qdrant URL (default QDRANT_URL)")
+parser.add_argument("--api-key", help="Qdrant API key (default QDRANT_API_KEY)")
+parser.add_argument("--path", help="load into a local on-disk Qdrant at this path")
+parser.add_argument("--collection", help="collection name (default from the manifest)")
+parser.add_argument(
+    "--recreate", action="store_true", help="drop the collections first if they exist"
+)
+parser.add_argument("--batch-size", type=int, default=512)
+parser.add_argument("--workers", type=int, default=4)
+args = parser.parse_args()
+
+if args.path:
+    client = QdrantClient(path=args.path)
+    args.workers = 1  # the local client isn't thread-safe
+elif args.url:
+    client = QdrantClient(url=args.url, api_key=args.api_key, port=None)
+else:
+    client = ingest.connect()
+
+start = time.perf_counter()
+snapshot = load_snapshot(args.snapshot)
+manifest = snapshot.manifest
+collection_name = args.collection or manifest["collection"]
+if manifest["dense_dtype"] == "int8":
+    print("Dense vectors were exported as int8, so imported ones are approximate.")
+create_collections(client, manifest, collection_name, args.recreate)
+
+progress = tqdm(total=len(snapshot), desc="Points", unit="point")
+upload(
+    client,
+    collection_name,
+    map(point_structs, itertools.batched(iter_points(snapshot), args.batch_size)),
+    args.workers,
+    progress,
+)
+progress.close()
+
+docs_progress = tqdm(desc="Documents", unit="doc")
+upload(
+    client,
+    ingest.DOCS_COLLECTION,
+    map(doc_structs, itertools.batched(iter_docs(args.snapshot), args.batch_size)),
+    args.workers,
+    docs_progress,
+)
+docs_progress.close()
+collection.bump_data_version(client, collection_name)
+
+print(
+    f"Imported {len(snapshot)} points and {docs_progress.n} documents into "
+    f"{collection_name} in {time.perf_counter() - start:.1f}s "
+    f"(dense {manifest.get('dense_model')}, sparse {manifest.get('sparse_model')})."
+)
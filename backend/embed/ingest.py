@@ -0,0 +1,448 @@
+"""
+Streaming ingestion pipeline shared by the embed scripts.
+
+Each embed script is a generator of `Chunk`s fed to `run`, which embeds and
+upserts them in fixed-size batches so that memory stays flat no matter how
+large the corpus grows. Sparse embedding streams through fastembed (across a
+process pool with `sparse_parallel`), while dense embedding and upserts of
+each batch run on a bounded thread pool and are retried with backoff.
+
+Every point carries its corpus ("catalog", "courses" or "tqfr"), the id of
+the chunk it was built from and a hash of the chunk's content and embedding
+models. On re-runs, chunks whose hash is unchanged are skipped, and points of
+chunks that no longer exist are deleted.
+
+Document bodies are not part of the points' payload. They are written once
+per doc_id to the document store collection (see llm/docstore.py), which is
+kept in sync the same way.
+
+Both collections are created with the settings of llm/collection.py. The
+indexed `PAYLOAD_ONLY` metadata fields are left out of the hash: when only
+they change, the stored points' payload is updated without re-embedding.
+"""
+
+from fastembed import SparseTextEmbedding
+from langchain_google_vertexai import VertexAIEmbeddings
+from qdrant_client import QdrantClient
+from qdrant_client.models import (
+    FieldCondition,
+    Filter,
+    MatchValue,
+    PointIdsList,
+    PointStruct,
+    SetPayload,
+    SetPayloadOperation,
+)
+from dotenv import load_dotenv
+from tqdm import tqdm
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+# Let the embed scripts share storage formats with the backend package.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm import collection  # noqa: E402
+from llm.docstore import DOCS_COLLECTION, doc_point_id  # noqa: E402
+from llm.lookup import lookup_keys  # noqa: E402, F401
+from llm.router import course_codes  # noqa: E402, F401
+
+COLLECTION_NAME = "coursebot_hybrid"
+DENSE_MODEL = "text-embedding-004"
+SPARSE_MODEL = "Qdrant/bm25"
+# Filterable metadata that doesn't change what is embedded.
+PAYLOAD_ONLY = ("course", "term")
+
+
+class Chunk:
+    """
+    One unit of retrieval: `summary` and `content` are embedded as two
+    points that share `meta` as their payload metadata. `body` is the text of
+    the document `meta["doc_id"]` that is shown to the LLM when the chunk is
+    retrieved, and `keys` (see `lookup_keys`) let the document be looked up
+    by course code and instructor name.
+    """
+
+    def __init__(self, id, summary, content, meta, body, keys=()):
+        self.id = id
+        self.summary = summary
+        self.content = content
+        self.meta = meta
+        self.body = body
+        self.keys = list(keys)
+
+
+def parse_args(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="re-embed every chunk instead of only new and changed ones",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=256,
+        help="chunks embedded and upserted per batch",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="threads running dense embedding calls and upserts",
+    )
+    parser.add_argument(
+        "--sparse-parallel",
+        type=int,
+        default=None,
+        help="processes for sparse embedding (0 for all cores)",
+    )
+    return parser.parse_args()
+
+
+def connect():
+    if not load_dotenv():
+        print("Unable to get environment variables via pydotenv.")
+    return QdrantClient(
+        url=os.environ["QDRANT_URL"], api_key=os.environ["QDRANT_API_KEY"], port=None
+    )
+
+
+def ensure_collection(client: QdrantClient, collection_name=COLLECTION_NAME):
+    collection.ensure(client, collection_name, DOCS_COLLECTION)
+
+
+def id2uuid(id):
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, id))
+
+
+def payload_only(meta):
+    return {field: meta[field] for field in PAYLOAD_ONLY if field in meta}
+
+
+def content_hash(chunk: Chunk):
+    meta = {k: v for k, v in chunk.meta.items() if k not in PAYLOAD_ONLY}
+    data = json.dumps([chunk.summary, chunk.content, meta], sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class StageTimer:
+    """
+    Accumulates wall-clock seconds spent per pipeline stage across threads.
+    Time spent in a stage nested inside another one on the same thread is
+    only counted towards the inner stage.
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def stage(self, name):
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                self.seconds[name] += elapsed - nested
+
+
+def retry(fn, *args, attempts=5, backoff=1.0, **kwargs):
+    """Call `fn`, retrying failures with exponential backoff."""
+    for attempt in range(attempts):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == attempts - 1:
+                raise
+            delay = backoff * 2**attempt
+            print(f"{getattr(fn, '__name__', fn)} failed ({e}), retrying in {delay:.0f}s")
+            time.sleep(delay)
+
+
+def scroll_corpus(client: QdrantClient, collection_name, corpus, prefix, fields):
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            scroll_filter=Filter(
+                must=[
+                    FieldCondition(key=f"{prefix}corpus", match=MatchValue(value=corpus))
+                ]
+            ),
+            limit=1024,
+            offset=offset,
+            with_payload=[f"{prefix}{field}" for field in fields],
+            with_vectors=False,
+        )
+        yield from points
+        if offset is None:
+            return
+
+
+def existing_chunks(client: QdrantClient, collection_name, corpus):
+    """
+    Map chunk id -> (content hash, point ids, payload-only fields) for every
+    point of `corpus` currently in the collection.
+    """
+    chunks = {}
+    for point in scroll_corpus(
+        client,
+        collection_name,
+        corpus,
+        "metadata.",
+        ["chunk_id", "content_hash", *PAYLOAD_ONLY],
+    ):
+        meta = point.payload["metadata"]
+        _, point_ids, _ = chunks.setdefault(
+            meta["chunk_id"], (meta.get("content_hash"), [], payload_only(meta))
+        )
+        point_ids.append(point.id)
+    return chunks
+
+
+def existing_docs(client: QdrantClient, corpus):
+    """Map doc_id -> body hash for every stored document of `corpus`."""
+    return {
+        point.payload["doc_id"]: point.payload.get("content_hash")
+        for point in scroll_corpus(
+            client, DOCS_COLLECTION, corpus, "", ["doc_id", "content_hash"]
+        )
+    }
+
+
+def build_points(batch, dense):
+    n = len(batch)
+    points = []
+    for i, (chunk, sparse_summary, sparse_content) in enumerate(batch):
+        for suffix, dense_vector, sparse_vector in (
+            ("summary", dense[i], sparse_summary),
+            ("content", dense[n + i], sparse_content),
+        ):
+            points.append(
+                PointStruct(
+                    id=id2uuid(f"{chunk.id}-{suffix}"),
+                    vector={
+                        "dense_vector": dense_vector,
+                        "sparse_vector": vars(sparse_vector),
+                    },
+                    payload={"metadata": chunk.meta},
+                )
+            )
+    return points
+
+
+def run(
+    chunks,
+    corpus,
+    client=None,
+    collection_name=COLLECTION_NAME,
+    batch_size=256,
+    full=False,
+    workers=4,
+    sparse_parallel=None,
+    dense_embed=None,
+    sparse_embed=None,
+):
+    """
+    Embed and upsert `chunks` (any iterable of `Chunk`) as `corpus`. With
+    `full`, every chunk is re-embedded regardless of its hash.
+
+    At most `2 * workers` batches of `batch_size` chunks are in flight at a
+    time. Returns the chunk counts and seconds spent per stage.
+    """
+    client = client or connect()
+    ensure_collection(client, collection_name)
+    dense_embed = dense_embed or VertexAIEmbeddings(
+        model=DENSE_MODEL, project="coursebot-453309"
+    )
+    sparse_embed = sparse_embed or SparseTextEmbedding(SPARSE_MODEL)
+
+    timer = StageTimer()
+    start = time.perf_counter()
+    existing = existing_chunks(client, collection_name, corpus)
+    stored_docs = existing_docs(client, corpus)
+    seen_docs = set()
+    doc_points = []
+    retagged = []
+    counts = {"added": 0, "changed": 0, "removed": 0, "skipped": 0, "retagged": 0}
+    doc_counts = {"written": 0, "removed": 0}
+    progress = tqdm(desc=f"Embedding {corpus} chunks", unit="chunk")
+
+    def collect_doc(chunk):
+        """Queue the chunk's document body for writing if it is new or changed."""
+        doc_id = chunk.meta["doc_id"]
+        if doc_id in seen_docs:
+            return
+        seen_docs.add(doc_id)
+        payload = {
+            "doc_id": doc_id,
+            "text": chunk.body,
+            "source": chunk.meta.get("source"),
+            "url": chunk.meta.get("url"),
+            "lookup_keys": chunk.keys,
+            "corpus": corpus,
+        }
+        digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+        if stored_docs.pop(doc_id, None) == digest and not full:
+            return
+        doc_counts["written"] += 1
+        doc_points.append(
+            PointStruct(
+                id=doc_point_id(doc_id),
+                vector={},
+                payload={**payload, "content_hash": digest},
+            )
+        )
+
+    def pending():
+        """Chunks that are new or have changed since the last run."""
+        chunks_iter = iter(chunks)
+        while True:
+            with timer.stage("chunk"):
+                chunk = next(chunks_iter, None)
+                if chunk is None:
+                    return
+                chunk.meta.update(
+                    {"dense_model": DENSE_MODEL, "sparse_model": SPARSE_MODEL}
+                )
+                digest = content_hash(chunk)
+                chunk.meta.update(
+                    {"corpus": corpus, "chunk_id": chunk.id, "content_hash": digest}
+                )
+                collect_doc(chunk)
+                stored = existing.pop(chunk.id, None)
+                if stored is None:
+                    counts["added"] += 1
+                elif full or stored[0] != digest:
+                    counts["changed"] += 1
+                else:
+                    counts["skipped"] += 1
+                    if stored[2] != payload_only(chunk.meta):
+                        counts["retagged"] += 1
+                        retagged.append(
+                            SetPayloadOperation(
+                                set_payload=SetPayload(
+                                    payload={"metadata": chunk.meta}, points=stored[1]
+                                )
+                            )
+                        )
+                    progress.update()
+                    continue
+            yield chunk
+
+    def sparse_embedded():
+        """Pairs each pending chunk with its sparse summary and content vectors."""
+        todo, for_texts = itertools.tee(pending())
+        texts = (text for chunk in for_texts for text in (chunk.summary, chunk.content))
+        vectors = iter(sparse_embed.embed(texts, parallel=sparse_parallel))
+        for chunk in todo:
+            with timer.stage("sparse"):
+                yield chunk, next(vectors), next(vectors)
+
+    def write(batch):
+        texts = [chunk.summary for chunk, _, _ in batch]
+        texts += [chunk.content for chunk, _, _ in batch]
+        with timer.stage("dense"):
+            dense = retry(dense_embed.embed, texts)
+        points = build_points(batch, dense)
+        with timer.stage("upsert"):
+            retry(client.upsert, collection_name=collection_name, points=points)
+        progress.update(len(batch))
+
+    def write_docs(points):
+        with timer.stage("docs"):
+            retry(client.upsert, collection_name=DOCS_COLLECTION, points=points)
+
+    def write_payloads(operations):
+        with timer.stage("payload"):
+            retry(
+                client.batch_update_points,
+                collection_name=collection_name,
+                update_operations=operations,
+            )
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for batch in itertools.batched(sparse_embedded(), batch_size):
+            if len(in_flight) >= 2 * workers:
+                in_flight.popleft().result()
+            in_flight.append(pool.submit(write, batch))
+            if len(doc_points) >= batch_size:
+                in_flight.append(pool.submit(write_docs, doc_points[:]))
+                doc_points.clear()
+            if len(retagged) >= batch_size:
+                in_flight.append(pool.submit(write_payloads, retagged[:]))
+                retagged.clear()
+        if doc_points:
+            in_flight.append(pool.submit(write_docs, doc_points[:]))
+        for operations in itertools.batched(retagged, batch_size):
+            in_flight.append(pool.submit(write_payloads, list(operations)))
+        for future in in_flight:
+            future.result()
+    progress.close()
+
+    stale_points = [
+        point_id for _, point_ids, _ in existing.values() for point_id in point_ids
+    ]
+    with timer.stage("delete"):
+        if stale_points:
+            retry(
+                client.delete,
+                collection_name=collection_name,
+                points_selector=PointIdsList(points=stale_points),
+            )
+        if stored_docs:
+            retry(
+                client.delete,
+                collection_name=DOCS_COLLECTION,
+                points_selector=PointIdsList(
+                    points=[doc_point_id(doc_id) for doc_id in stored_docs]
+                ),
+            )
+    counts["removed"] = len(existing)
+    doc_counts["removed"] = len(stored_docs)
+    if any(counts[key] for key in ("added", "changed", "removed", "retagged")) or any(
+        doc_counts.values()
+    ):
+        # Tells the running app to drop its cached retrievals and answers.
+        collection.bump_data_version(client, collection_name)
+
+    elapsed = time.perf_counter() - start
+    total = counts["added"] + counts["changed"] + counts["skipped"]
+    embedded = counts["added"] + counts["changed"]
+    print(
+        f"{counts['added']} added, {counts['changed']} changed, "
+        f"{counts['removed']} removed, {counts['skipped']} skipped "
+        f"({counts['retagged']} with updated payload only), "
+        f"{doc_counts['written']} documents written, {doc_counts['removed']} removed."
+    )
+    print(
+        f"{total} chunks in {elapsed:.1f}s ({total / elapsed:.1f} chunks/s, "
+        f"{embedded / elapsed:.1f} embedded chunks/s)"
+    )
+    print(
+        "Time per stage: "
+        + ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in timer.seconds.items())
+    )
+    return {
+        "counts": counts,
+        "docs": doc_counts,
+        "seconds": elapsed,
+        "stages": dict(timer.seconds),
+    }
@@ -0,0 +1,69 @@
+"""
+Bring the existing collections up to the current collection profile (see
+llm/collection.py) in place, without re-embedding anything, e.g.
+
+    python embed/migrate-collection.py --dry-run
+    python embed/migrate-collection.py --url http://localhost:6333
+
+Qdrant keeps serving searches while it quantizes and re-indexes; this waits
+until the collection is green again. The course and term payload fields are
+filled in by re-running embed-courses.py and embed-tqfr.py, which only update
+the payload of chunks whose text hasn't changed.
+"""
+
+from qdrant_client import QdrantClient
+from qdrant_client.models import CollectionStatus
+import argparse
+import ingest
+import time
+
+# ingest puts the backend package on sys.path.
+from llm import collection  # noqa: E402
+
+
+def wait_until_green(client, collection_name, poll=2.0):
+    start = time.perf_counter()
+    while True:
+        info = client.get_collection(collection_name)
+        if info.status == CollectionStatus.GREEN:
+            return time.perf_counter() - start
+        print(
+            f"{collection_name} is {info.status.value}, "
+            f"{info.indexed_vectors_count or 0}/{info.points_count} vectors indexed"
+        )
+        time.sleep(poll)
+
+
+parser = argparse.ArgumentParser(
+    description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+)
+parser.add_argument("--url", help="Qdrant URL (default QDRANT_URL)")
+parser.add_argument("--api-key", help="Qdrant API key (default QDRANT_API_KEY)")
+parser.add_argument("--collection", default=ingest.COLLECTION_NAME)
+parser.add_argument(
+    "--dry-run", action="store_true", help="only list the settings that would change"
+)
+args = parser.parse_args()
+
+if args.url:
+    client = QdrantClient(url=args.url, api_key=args.api_key, port=None)
+else:
+    client = ingest.connect()
+
+print(f"Collection profile v{collection.PROFILE_VERSION}")
+for name, indexes in (
+    (args.collection, collection.POINT_INDEXES),
+    (ingest.DOCS_COLLECTION, collection.DOC_INDEXES),
+):
+    if not client.collection_exists(name):
+        print(f"{name} doesn't exist; the embed scripts create it with the profile.")
+        continue
+    missing = collection.outdated(client, name, indexes)
+    if not missing:
+        print(f"{name} is up to date.")
+        continue
+    print(f"{name}: " + ", ".join(missing))
+    if args.dry_run:
+        continue
+    collection.migrate(client, name, indexes)
+    print(f"Migrated {name}, re-indexed in {wait_until_green(client, name):.0f}s.")
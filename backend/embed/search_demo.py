@@ -1,31 +1,178 @@
-from langchain_qdrant import QdrantVectorStore, FastEmbedSparse, RetrievalMode
-from langchain_google_vertexai import VertexAIEmbeddings
+"""
+Search the collection interactively, or benchmark retrieval settings against
+a golden set. Run from the backend directory, e.g.
+
+    python embed/search_demo.py
+    python embed/search_demo.py --golden golden.jsonl --modes sparse dense fused \\
+        --k 4 8 12 --backends qdrant local --out retrieval.json
+
+The golden set has one JSON object per line: {"query": ..., "doc_ids": [...]}
+(or a single "doc_id"), the documents a good retrieval should return. For
+each backend, mode and k this reports recall@k, MRR and p50/p95 search
+latency, and with --target-recall, the fastest setting that reaches it.
+"""
+
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from langchain_qdrant import FastEmbedSparse
 from dotenv import load_dotenv
+import argparse
+import json
 import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-if not load_dotenv():
-    print("Unable to get environment variables via pydotenv.")
-
-embeddings = VertexAIEmbeddings(model="text-embedding-004", project="coursebot-453309")
-sparse_embeddings = FastEmbedSparse(model_name="Qdrant/bm25")
-vector_store = QdrantVectorStore.from_existing_collection(
-    url=os.environ["QDRANT_URL"],
-    api_key=os.environ["QDRANT_API_KEY"],
-    collection_name="coursebot_hybrid",
-    content_payload_key="text",
-    metadata_payload_key="metadata",
-    embedding=embeddings,
-    sparse_embedding=sparse_embeddings,
-    vector_name="dense_vector",
-    sparse_vector_name="sparse_vector",
-    retrieval_mode=RetrievalMode.DENSE,
+from llm.retrievers import (  # noqa: E402
+    LocalRetriever,
+    QdrantRetriever,
+    doc_id_of,
+    unique_docs,
 )
 
+MODES = {"sparse": "sparse", "dense": "dense", "fused": "fused", "hybrid": "fused"}
+
+
+def load_golden(path):
+    golden = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            doc_ids = entry.get("doc_ids") or [entry["doc_id"]]
+            golden.append((entry["query"], set(doc_ids)))
+    return golden
+
+
+def make_retriever(backend, mode, embeddings, sparse_embeddings, args):
+    if backend == "local":
+        return LocalRetriever(
+            args.snapshot,
+            embeddings,
+            sparse_embeddings,
+            mode=mode,
+            latency_budget=args.latency_budget,
+        )
+    return QdrantRetriever(
+        embeddings,
+        sparse_embeddings,
+        collection_name=args.collection,
+        mode=mode,
+        latency_budget=args.latency_budget,
+    )
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def evaluate(retriever, golden, k):
+    recalls, reciprocal_ranks, latencies = [], [], []
+    for query, expected in golden:
+        start = time.perf_counter()
+        docs = retriever.search(query, k=k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        doc_ids = [doc_id_of(doc) for doc in unique_docs(docs)][:k]
+        recalls.append(len(expected.intersection(doc_ids)) / len(expected))
+        rank = next((i for i, d in enumerate(doc_ids, start=1) if d in expected), None)
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+    return {
+        "recall": sum(recalls) / len(recalls),
+        "mrr": sum(reciprocal_ranks) / len(reciprocal_ranks),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+    }
+
+
+def benchmark(args):
+    golden = load_golden(args.golden)
+    modes = [MODES[mode] for mode in args.modes]
+    sparse_embeddings = FastEmbedSparse(model_name="Qdrant/bm25")
+    embeddings = None
+    if any(mode != "sparse" for mode in modes):
+        embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
+
+    rows = []
+    for backend in args.backends:
+        for mode in dict.fromkeys(modes):
+            retriever = make_retriever(
+                backend, mode, embeddings, sparse_embeddings, args
+            )
+            retriever.search(golden[0][0], k=1)  # warm up
+            for k in args.k:
+                row = {"backend": backend, "mode": mode, "k": k}
+                row.update(evaluate(retriever, golden, k))
+                rows.append(row)
+                print_row(row)
+    return rows
+
+
+def print_header():
+    print(
+        f"{'backend':8} {'mode':7} {'k':>3} {'recall':>7} {'mrr':>6} "
+        f"{'p50 ms':>8} {'p95 ms':>8}"
+    )
+
+
+def print_row(row):
+    print(
+        f"{row['backend']:8} {row['mode']:7} {row['k']:>3} {row['recall']:>7.3f} "
+        f"{row['mrr']:>6.3f} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f}"
+    )
+
+
+def interactive(args):
+    sparse_embeddings = FastEmbedSparse(model_name="Qdrant/bm25")
+    embeddings = None
+    mode = MODES[args.modes[0]]
+    if mode != "sparse":
+        embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
+    retriever = make_retriever(
+        args.backends[0], mode, embeddings, sparse_embeddings, args
+    )
+    while True:
+        query = input("Enter query: ")
+        n_results = int(input("Number of results to list: "))
+        for doc in retriever.search(query, k=n_results):
+            print(f"Matched {doc_id_of(doc)} with score {doc.metadata['_score']}")
+
+
+parser = argparse.ArgumentParser(
+    description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+)
+parser.add_argument("--golden", help="golden set (JSONL); omit to search interactively")
+parser.add_argument("--modes", nargs="+", choices=list(MODES), default=["sparse"])
+parser.add_argument("--k", type=int, nargs="+", default=[8])
+parser.add_argument(
+    "--backends", nargs="+", choices=["qdrant", "local"], default=["qdrant"]
+)
+parser.add_argument("--collection", default="coursebot_hybrid")
+parser.add_argument("--snapshot", default="snapshot", help="local snapshot directory")
+parser.add_argument("--latency-budget", type=float, default=1.0)
+parser.add_argument("--target-recall", type=float, help="report the fastest setting above this")
+parser.add_argument("--out", help="write results to this JSON file")
 
-while True:
-    query = input("Enter query: ")
-    n_results = int(input("Number of results to list: "))
-    results = vector_store.similarity_search_with_score(query, k=3)
+if __name__ == "__main__":
+    if not load_dotenv():
+        print("Unable to get environment variables via pydotenv.")
+    args = parser.parse_args()
+    if not args.golden:
+        interactive(args)
+        sys.exit()
 
-    for doc, sim in results:
-        print(f"Matched {doc.metadata['doc_id']} with similarity {sim}")
+    print_header()
+    rows = benchmark(args)
+    if args.target_recall is not None:
+        passing = [row for row in rows if row["recall"] >= args.target_recall]
+        if passing:
+            print("\nFastest setting with recall >= {}:".format(args.target_recall))
+            print_header()
+            print_row(min(passing, key=lambda row: row["p95_ms"]))
+        else:
+            print(f"\nNo setting reaches recall {args.target_recall}.")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"config": vars(args), "results": rows}, f, indent=2)
+        print(f"\nWrote {args.out}")
@@ -0,0 +1,322 @@
+"""
+Admission control for /api/query.
+
+Each client gets a token bucket of `RATE_LIMIT_BURST` requests refilled at
+`RATE_LIMIT_PER_MINUTE` (0 turns rate limiting off); past it, requests get a
+429. Clients are told apart by IP, or with RATE_LIMIT_KEY=session by IP and
+the thread_id they sent, so clients behind one address get a bucket per
+session; requests without a thread_id share their IP's bucket.
+Behind a proxy, set TRUST_FORWARDED_FOR=1 so the X-Forwarded-For client is
+used instead of the proxy's address.
+
+At most `MAX_LLM_STREAMS` responses stream from the LLM at once. Only
+requests that run the graph take one of these slots: cached answers and
+questions fanned out from an identical one in flight don't. Requests past
+that wait in a queue of at most `MAX_QUEUED_STREAMS` for up to
+`QUEUE_TIMEOUT` seconds, and get a 503 when the queue is full or the wait
+runs out, so a spike slows nobody down by more than the queue allows.
+"""
+
+from llm.cache import LRUCache
+from collections import deque
+from llm.metrics import LLM_STREAMS, QUEUE_DEPTH, REJECTIONS
+import asyncio
+import math
+import os
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Seconds until a token is available, after taking one if it is 0."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets per client, for the `max_clients` most recent clients."""
+
+    def __init__(self, per_minute=20, burst=5, max_clients=10000):
+        self.rate = per_minute / 60
+        self.burst = burst
+        # An idle bucket is full again after burst / rate seconds, so it can
+        # be dropped then.
+        self._buckets = LRUCache(max_size=max_clients, ttl=burst / self.rate)
+        self._lock = threading.Lock()
+
+    def wait_time(self, client):
+        """0 if `client` may make a request now, else seconds to wait."""
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+            wait = bucket.take()
+            self._buckets.put(client, bucket)
+        return wait
+
+
+class ConcurrencyLimit:
+    """
+    At most `max_concurrent` slots held at once, with at most `max_queue`
+    callers waiting up to `timeout` seconds for the slots they asked for.
+    Waiters are admitted first come first served, so one asking for several
+    slots isn't starved by later single-slot callers.
+    """
+
+    def __init__(self, max_concurrent=16, max_queue=32, timeout=10.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self._waiters = deque()
+        self._condition = threading.Condition()
+
+    def _admit_now(self, n):
+        """True (slots taken), False (queue full) or None (must wait)."""
+        if self.active + n <= self.max_concurrent and self.waiting == 0:
+            self._take(n)
+            return True
+        if self.waiting >= self.max_queue:
+            return False
+        return None
+
+    def _take(self, n):
+        self.active += n
+        LLM_STREAMS.inc(n)
+
+    def _wait(self, delta):
+        self.waiting += delta
+        QUEUE_DEPTH.inc(delta)
+
+    def acquire(self, n=1):
+        """None once `n` slots are taken, else why not: "queue_full" or "queue_timeout"."""
+        with self._condition:
+            admitted = self._admit_now(n)
+            if admitted is not None:
+                return None if admitted else "queue_full"
+            ticket = object()
+            self._waiters.append(ticket)
+            self._wait(1)
+            try:
+                if not self._condition.wait_for(
+                    lambda: self._waiters[0] is ticket
+                    and self.active + n <= self.max_concurrent,
+                    self.timeout,
+                ):
+                    return "queue_timeout"
+                self._take(n)
+                return None
+            finally:
+                self._waiters.remove(ticket)
+                self._wait(-1)
+                # The next waiter in line may fit in the slots left.
+                self._condition.notify_all()
+
+    def release(self, n=1):
+        with self._condition:
+            self.active -= n
+            LLM_STREAMS.dec(n)
+            # Only the first waiter in line may take them, so wake them all.
+            self._condition.notify_all()
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+        }
+
+
+class AsyncConcurrencyLimit(ConcurrencyLimit):
+    """
+    A ConcurrencyLimit for one event loop. `release` doesn't await, so it
+    can run while the releasing task is being cancelled: it hands the freed
+    slots straight to the waiters in line, first come first served.
+    """
+
+    async def acquire(self, n=1):
+        admitted = self._admit_now(n)
+        if admitted is not None:
+            return None if admitted else "queue_full"
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((future, n))
+        self._wait(1)
+        try:
+            await asyncio.wait_for(future, self.timeout)
+            return None
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                self.release(n)  # handed the slots just as we gave up
+            if isinstance(e, asyncio.TimeoutError):
+                return "queue_timeout"
+            raise
+        finally:
+            self._wait(-1)
+
+    def release(self, n=1):
+        self.active -= n
+        LLM_STREAMS.dec(n)
+        while self._waiters:
+            future, wanted = self._waiters[0]
+            if future.done():  # gave up waiting
+                self._waiters.popleft()
+                continue
+            if self.active + wanted > self.max_concurrent:
+                break
+            self._waiters.popleft()
+            self._take(wanted)
+            future.set_result(None)
+
+
+class Rejected(Exception):
+    def __init__(self, reason, status, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.status = status
+        self.retry_after = max(1, math.ceil(retry_after))
+
+    def body(self):
+        if self.status == 429:
+            return {"error": "Too many requests, slow down"}
+        return {"error": "Too busy right now, try again shortly"}
+
+    def headers(self):
+        return {"Retry-After": str(self.retry_after)}
+
+
+class Admission:
+    """
+    Rate limits and LLM stream slots for one app. With `use_async` (for the
+    ASGI app) slots are taken with `aacquire`.
+    """
+
+    def __init__(
+        self,
+        per_minute=None,
+        burst=None,
+        max_streams=None,
+        max_queue=None,
+        queue_timeout=None,
+        use_async=False,
+    ):
+        env = os.environ.get
+        per_minute = per_minute or float(env("RATE_LIMIT_PER_MINUTE", 20))
+        self.rate_limiter = (
+            RateLimiter(per_minute, burst or int(env("RATE_LIMIT_BURST", 5)))
+            if per_minute > 0
+            else None
+        )
+        limit = AsyncConcurrencyLimit if use_async else ConcurrencyLimit
+        self.streams = limit(
+            max_streams or int(env("MAX_LLM_STREAMS", 16)),
+            max_queue if max_queue is not None else int(env("MAX_QUEUED_STREAMS", 32)),
+            queue_timeout or float(env("QUEUE_TIMEOUT", 10)),
+        )
+        self.by_session = env("RATE_LIMIT_KEY", "ip") == "session"
+        self.trust_forwarded_for = env("TRUST_FORWARDED_FOR") == "1"
+        self.rejected = {"rate_limited": 0, "queue_full": 0, "queue_timeout": 0}
+
+    def client(self, remote_addr, headers, thread_id=None):
+        """
+        The rate limit key of a request. `thread_id` is the one the client
+        sent, if any, not one made up for a new session.
+        """
+        forwarded_for = headers.get("X-Forwarded-For")
+        if self.trust_forwarded_for and forwarded_for:
+            remote_addr = forwarded_for.split(",")[0].strip()
+        if self.by_session and thread_id:
+            return f"{remote_addr} session:{thread_id}"
+        return remote_addr
+
+    def _reject(self, reason, status, retry_after):
+        self.rejected[reason] += 1
+        REJECTIONS.inc(reason=reason)
+        return Rejected(reason, status, retry_after)
+
+    def check_rate(self, client):
+        """Raises Rejected (429) if `client` is over its rate limit."""
+        if self.rate_limiter is None:
+            return
+        wait = self.rate_limiter.wait_time(client)
+        if wait > 0:
+            raise self._reject("rate_limited", 429, wait)
+
+    def _check_slot(self, reason):
+        if reason is not None:
+            raise self._reject(reason, 503, self.streams.timeout / 2)
+
+    def acquire(self, n=1):
+        """Take `n` LLM stream slots, or raise Rejected (503)."""
+        self._check_slot(self.streams.acquire(n))
+
+    async def aacquire(self, n=1):
+        self._check_slot(await self.streams.acquire(n))
+
+    def release(self, n=1):
+        self.streams.release(n)
+
+    def batch_slots(self, conversations, concurrency):
+        """
+        The slots a batch of `conversations` run `concurrency` at a time
+        holds: one per conversation in flight, at most all of them.
+        """
+        return max(1, min(conversations, concurrency, self.streams.max_concurrent))
+
+    def slot(self):
+        """`acquire`, returning the function that releases the slot."""
+        self.acquire()
+        return self.release
+
+    async def aslot(self):
+        await self.aacquire()
+        return self.release
+
+    def stats(self):
+        return {"streams": self.streams.stats(), "rejected": dict(self.rejected)}
+
+
+class Releasing:
+    """
+    Iterates `iterable` and calls `release` once when it is exhausted or
+    closed, even if iteration never started (e.g. the client went away
+    before the response was sent).
+    """
+
+    def __init__(self, iterable, release):
+        self._iterator = iter(iterable)
+        self._release = release
+        self._released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            close = getattr(self._iterator, "close", None)
+            try:
+                if close is not None:
+                    close()
+            finally:
+                self._release()
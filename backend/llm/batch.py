@@ -0,0 +1,102 @@
+"""
+Batched runs of many conversations, for evaluation and precomputing answers.
+
+While a batch runs, the retrieval queries of its conversations are gathered
+by a `QueryBatcher` and sent to the retriever together, so a batch makes one
+embedding call and one vector store call per group of queries instead of one
+of each per query.
+"""
+
+from contextvars import ContextVar
+import asyncio
+import os
+
+# The QueryBatcher of the batch the current conversation belongs to.
+_batcher = ContextVar("coursebot_batcher", default=None)
+
+
+def current_batcher():
+    return _batcher.get()
+
+
+class QueryBatcher:
+    """
+    Collects concurrent `search` calls and runs them as one
+    `search_batch(queries, k)` call (on a worker thread) once `max_size`
+    queries are waiting or `window` seconds after the first one arrived.
+    """
+
+    def __init__(self, search_batch, max_size=32, window=0.02):
+        self.search_batch = search_batch
+        self.max_size = max_size
+        self.window = window
+        self.batches = 0
+        self.queries = 0
+        self._pending = []
+        self._flush = None
+
+    async def search(self, query: str, k: int):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((query, k, future))
+        if len(self._pending) >= self.max_size:
+            self._run()
+        elif self._flush is None:
+            self._flush = asyncio.get_running_loop().call_later(self.window, self._run)
+        return await future
+
+    def _run(self):
+        if self._flush is not None:
+            self._flush.cancel()
+            self._flush = None
+        pending, self._pending = self._pending, []
+        by_k = {}
+        for query, k, future in pending:
+            by_k.setdefault(k, []).append((query, future))
+        for k, group in by_k.items():
+            asyncio.ensure_future(self._search(k, group))
+
+    async def _search(self, k, group):
+        self.batches += 1
+        self.queries += len(group)
+        try:
+            results = await asyncio.to_thread(
+                self.search_batch, [query for query, _ in group], k
+            )
+        except Exception as e:
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), docs in zip(group, results):
+            if not future.done():
+                future.set_result(docs)
+
+    def stats(self):
+        return {"batches": self.batches, "queries": self.queries}
+
+
+def parse_batch(input_data):
+    """
+    (conversations, concurrency) of a /api/batch body, or None if it is
+    invalid. The body is {"conversations": [...], "concurrency": n}, where a
+    conversation is a list of messages or just a question; `concurrency` is
+    capped at BATCH_MAX_CONCURRENCY (default 8).
+    """
+    if not isinstance(input_data, dict):
+        return None
+    conversations = input_data.get("conversations")
+    if not isinstance(conversations, list):
+        return None
+    parsed = []
+    for conversation in conversations:
+        if isinstance(conversation, str):
+            conversation = [{"role": "user", "content": conversation}]
+        if not isinstance(conversation, list) or not conversation:
+            return None
+        parsed.append(conversation)
+    max_concurrency = int(os.environ.get("BATCH_MAX_CONCURRENCY", 8))
+    try:
+        concurrency = int(input_data.get("concurrency") or max_concurrency)
+    except (TypeError, ValueError):
+        return None
+    return parsed, max(1, min(concurrency, max_concurrency))
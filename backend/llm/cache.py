@@ -0,0 +1,207 @@
+from collections import OrderedDict
+import math
+import string
+import threading
+import time
+
+
+def normalize_query(query: str) -> str:
+    """
+    Lowercase a query, drop punctuation and collapse whitespace so that
+    trivially different spellings of a question share a cache key.
+    """
+    query = query.lower().translate(str.maketrans("", "", string.punctuation))
+    return " ".join(query.split())
+
+
+class LRUCache:
+    """
+    Thread-safe mapping bounded to `max_size` entries, evicting the least
+    recently used entry first. Entries also expire `ttl` seconds after they
+    were written.
+    """
+
+    def __init__(self, max_size=1024, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None or entry[0] < time.monotonic():
+            return default
+        return entry[1]
+
+    def items(self):
+        """Snapshot of the live (key, value) pairs, most recent last."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (key, value)
+                for key, (expires_at, value) in self._entries.items()
+                if expires_at >= now
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def sparse_cosine(a: dict, b: dict) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    dot = sum(value * b[index] for index, value in a.items() if index in b)
+    if dot == 0:
+        return 0.0
+    norm_a = math.sqrt(sum(value * value for value in a.values()))
+    norm_b = math.sqrt(sum(value * value for value in b.values()))
+    return dot / (norm_a * norm_b)
+
+
+class RetrievalCache:
+    """
+    Cache of retrieved documents in front of the vector store.
+
+    Queries are matched exactly after `normalize_query`. If `embed` (a
+    function mapping a query to a sparse {index: value} vector) and
+    `similarity_threshold` are given, a miss falls back to the most similar
+    cached query with cosine similarity at or above the threshold.
+
+    Entries are scoped to `version`, a key identifying the state of the
+    collection; changing it through `set_version` drops every entry.
+    """
+
+    def __init__(
+        self,
+        version="",
+        max_size=1024,
+        ttl=3600,
+        similarity_threshold=None,
+        embed=None,
+    ):
+        self.version = version
+        self.similarity_threshold = similarity_threshold
+        self.embed = embed
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._entries = LRUCache(max_size=max_size, ttl=ttl)
+
+    def set_version(self, version):
+        if version != self.version:
+            self.version = version
+            self._entries.clear()
+
+    def _near_duplicates_enabled(self):
+        return self.embed is not None and self.similarity_threshold is not None
+
+    def get(self, query: str, k: int):
+        key = (self.version, k, normalize_query(query))
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            return list(entry[1])
+
+        if self._near_duplicates_enabled():
+            vector = self.embed(query)
+            best, best_similarity = None, self.similarity_threshold
+            for (version, entry_k, _), (entry_vector, docs) in self._entries.items():
+                if version != self.version or entry_k != k:
+                    continue
+                similarity = sparse_cosine(vector, entry_vector)
+                if similarity >= best_similarity:
+                    best, best_similarity = docs, similarity
+            if best is not None:
+                self.near_hits += 1
+                return list(best)
+
+        self.misses += 1
+        return None
+
+    def put(self, query: str, k: int, docs):
+        vector = self.embed(query) if self._near_duplicates_enabled() else None
+        key = (self.version, k, normalize_query(query))
+        self._entries.put(key, (vector, list(docs)))
+
+    def stats(self):
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "version": self.version,
+            "size": len(self._entries),
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "evictions": self._entries.evictions,
+            "hit_ratio": (self.hits + self.near_hits) / lookups if lookups else 0.0,
+        }
+
+
+class AnswerCache:
+    """
+    Cache of whole answers to single-turn conversations, keyed by the
+    normalized question, the model code and the collection `version`.
+    Changing the version through `set_version` drops every entry.
+    """
+
+    def __init__(self, model_code, version="", max_size=512, ttl=3600):
+        self.model_code = model_code
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._entries = LRUCache(max_size=max_size, ttl=ttl)
+
+    def set_version(self, version):
+        if version != self.version:
+            self.version = version
+            self._entries.clear()
+
+    def _key(self, question: str):
+        return (self.model_code, self.version, normalize_query(question))
+
+    def get(self, question: str):
+        answer = self._entries.get(self._key(question))
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return answer
+
+    def put(self, question: str, answer: str):
+        self._entries.put(self._key(question), answer)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "version": self.version,
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self._entries.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
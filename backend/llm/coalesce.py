@@ -0,0 +1,265 @@
+"""
+Request coalescing for bursts of identical questions.
+
+`SingleFlight` lets concurrent identical calls (e.g. the same retrieval
+query) share one in-flight call. `StreamFanout` does the same for response
+streams: the first request for a key starts the upstream stream, and every
+request that arrives while it runs gets the chunks streamed so far followed
+by the live ones. Only the request that starts an upstream stream is
+admitted (see `StreamFanout.stream`); the others ride along for free.
+
+Both count the calls they `originated` and the ones they `coalesced` into
+an in-flight one.
+"""
+
+from contextvars import copy_context
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self.originated = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """`fn()`, or the result of the identical call already in flight."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.originated += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    async def ado(self, key, fn):
+        """
+        `await fn()`, or the result of the identical call already in flight.
+        The call runs as its own task, so a caller going away doesn't cancel
+        it for the others.
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+            self.originated += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {"originated": self.originated, "coalesced": self.coalesced}
+
+
+class _Stream:
+    def __init__(self):
+        self.items = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.changed = threading.Condition()
+        self.async_changed = None
+        self.task = None
+
+    def publish(self, item=None, done=False, error=None):
+        with self.changed:
+            if done:
+                self.done, self.error = True, error
+            else:
+                self.items.append(item)
+            self.changed.notify_all()
+        if self.async_changed is not None:
+            self.async_changed.set()
+
+
+class StreamFanout:
+    def __init__(self):
+        self.originated = 0
+        self.coalesced = 0
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        with self._lock:
+            stream = self._streams.get(key)
+            leader = stream is None
+            if leader:
+                stream = self._streams[key] = _Stream()
+                self.originated += 1
+            else:
+                self.coalesced += 1
+            stream.subscribers += 1
+        return stream, leader
+
+    def _leave(self, stream):
+        with self._lock:
+            stream.subscribers -= 1
+
+    def _abandoned(self, stream):
+        with self._lock:
+            return stream.subscribers == 0
+
+    def _end(self, key, stream, error=None):
+        with self._lock:
+            if self._streams.get(key) is stream:
+                del self._streams[key]
+        stream.publish(done=True, error=error)
+
+    def _pump(self, key, stream, produce, release):
+        error = None
+        try:
+            items = produce()
+            try:
+                for item in items:
+                    stream.publish(item)
+                    if self._abandoned(stream):
+                        break
+            finally:
+                items.close()
+        except Exception as e:
+            error = e
+        finally:
+            self._end(key, stream, error)
+            if release is not None:
+                release()
+
+    async def _apump(self, key, stream, produce, release):
+        error = None
+        try:
+            items = produce()
+            try:
+                async for item in items:
+                    stream.publish(item)
+                    if self._abandoned(stream):
+                        break
+            finally:
+                await items.aclose()
+        except Exception as e:
+            error = e
+        finally:
+            self._end(key, stream, error)
+            if release is not None:
+                release()
+
+    def _refuse(self, key, stream, error):
+        """End a stream whose leader wasn't admitted, failing anyone who joined it."""
+        self._leave(stream)
+        if not isinstance(error, Exception):
+            error = RuntimeError("The request that started this stream went away.")
+        self._end(key, stream, error)
+
+    def stream(self, key, produce, admit=None):
+        """
+        An iterator over the stream for `key`, started from `produce()` (a
+        generator) on a background thread unless it is already running. The
+        upstream stops early once every subscriber has gone away.
+
+        Whoever starts the upstream first calls `admit()`, which may raise
+        to refuse (and fails the stream for whoever joined it meanwhile) or
+        return a function to call once the upstream ends.
+        """
+        stream, leader = self._join(key)
+        if leader:
+            try:
+                release = admit() if admit is not None else None
+            except BaseException as e:
+                self._refuse(key, stream, e)
+                raise
+            context = copy_context()
+            threading.Thread(
+                target=context.run,
+                args=(self._pump, key, stream, produce, release),
+                daemon=True,
+            ).start()
+        follower = self._follow(stream)
+        next(follower)  # from here on, closing it leaves the stream
+        return follower
+
+    def _follow(self, stream):
+        try:
+            yield
+            i = 0
+            while True:
+                with stream.changed:
+                    stream.changed.wait_for(lambda: len(stream.items) > i or stream.done)
+                    items, done, error = stream.items[i:], stream.done, stream.error
+                for item in items:
+                    yield item
+                i += len(items)
+                if done and i == len(stream.items):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            self._leave(stream)
+
+    async def astream(self, key, produce, admit=None):
+        """
+        Like `stream`, with `produce()` an async generator run as a task and
+        `admit` a coroutine function. Returns an async iterator.
+        """
+        stream, leader = self._join(key)
+        if stream.async_changed is None:
+            stream.async_changed = asyncio.Event()
+        if leader:
+            try:
+                release = await admit() if admit is not None else None
+            except BaseException as e:
+                self._refuse(key, stream, e)
+                raise
+            stream.task = asyncio.ensure_future(
+                self._apump(key, stream, produce, release)
+            )
+        follower = self._afollow(stream)
+        await anext(follower)
+        return follower
+
+    async def _afollow(self, stream):
+        try:
+            yield
+            i = 0
+            while True:
+                stream.async_changed.clear()
+                items, done, error = stream.items[i:], stream.done, stream.error
+                for item in items:
+                    yield item
+                i += len(items)
+                if done and i == len(stream.items):
+                    if error is not None:
+                        raise error
+                    return
+                if not items and not done:
+                    await stream.async_changed.wait()
+        finally:
+            self._leave(stream)
+
+    def stats(self):
+        return {"originated": self.originated, "coalesced": self.coalesced}
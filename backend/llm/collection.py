@@ -0,0 +1,219 @@
+"""
+The Qdrant collection profile: vector storage, quantization, HNSW and payload
+index settings shared by everything that creates the collections (the embed
+scripts, import-snapshot.py) and by the retriever's search parameters.
+
+Dense vectors live on disk with an int8 scalar-quantized copy kept in RAM;
+searches run on the quantized copy and rescore an oversampled candidate list
+with the original vectors, so memory drops about 4x at nearly the same recall.
+Payloads are stored on disk and the fields searches filter or scroll on have
+keyword indexes.
+
+Bump PROFILE_VERSION whenever the settings below change, search parameters
+included. `ensure` creates missing collections with the profile and `migrate`
+brings existing ones up to date in place (Qdrant re-indexes in the background
+while serving searches); both record the profile version on the collection,
+and `outdated` reports collections made with another one.
+
+Versions are kept as markers, aliases named `<collection>__<kind>_<value>`
+(Qdrant collections have no metadata field): the "profile" version, and a
+"data" version that every ingest changing the points writes anew, so the app
+can tell when its caches are stale even if the number of points stays the
+same.
+"""
+
+from qdrant_client import models
+import uuid
+
+PROFILE_VERSION = 1
+DENSE_SIZE = 768  # text-embedding-004
+
+QUANTIZATION = models.ScalarQuantization(
+    scalar=models.ScalarQuantizationConfig(
+        type=models.ScalarType.INT8, quantile=0.99, always_ram=True
+    )
+)
+HNSW = models.HnswConfigDiff(m=16, ef_construct=128)
+SEARCH_PARAMS = models.SearchParams(
+    hnsw_ef=128,
+    quantization=models.QuantizationSearchParams(rescore=True, oversampling=2.0),
+)
+
+# Keyword-indexed payload fields of the points and of the doc store. course
+# and term are only set on course catalog and TQFR points.
+POINT_INDEXES = tuple(
+    f"metadata.{field}"
+    for field in ("doc_id", "source", "course", "term", "corpus", "chunk_id")
+)
+DOC_INDEXES = ("doc_id", "corpus")
+
+
+def is_local(client):
+    """Local mode ignores quantization, HNSW and payload index settings."""
+    options = client.init_options
+    return options.get("location") == ":memory:" or bool(options.get("path"))
+
+
+def read_marker(client, collection_name, kind):
+    """The value of a collection's `kind` marker, or None if it has none."""
+    prefix = f"{collection_name}__{kind}_"
+    for alias in client.get_collection_aliases(collection_name).aliases:
+        if alias.alias_name.startswith(prefix):
+            return alias.alias_name[len(prefix) :]
+    return None
+
+
+def write_marker(client, collection_name, kind, value):
+    """Replace a collection's `kind` marker with `value` in one alias update."""
+    prefix = f"{collection_name}__{kind}_"
+    operations = [
+        models.DeleteAliasOperation(
+            delete_alias=models.DeleteAlias(alias_name=alias.alias_name)
+        )
+        for alias in client.get_collection_aliases(collection_name).aliases
+        if alias.alias_name.startswith(prefix)
+    ]
+    operations.append(
+        models.CreateAliasOperation(
+            create_alias=models.CreateAlias(
+                collection_name=collection_name, alias_name=f"{prefix}{value}"
+            )
+        )
+    )
+    client.update_collection_aliases(change_aliases_operations=operations)
+
+
+def data_version(client, collection_name):
+    return read_marker(client, collection_name, "data")
+
+
+def bump_data_version(client, collection_name):
+    """Mark the points of a collection as changed and return the new version."""
+    version = uuid.uuid4().hex[:16]
+    write_marker(client, collection_name, "data", version)
+    return version
+
+
+def profile_version(client, collection_name):
+    """The profile version a collection was made or last migrated with, or None."""
+    version = read_marker(client, collection_name, "profile")
+    return int(version) if version is not None and version.isdigit() else None
+
+
+def create(client, collection_name, dense_size=DENSE_SIZE):
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config={
+            "dense_vector": models.VectorParams(
+                size=dense_size, distance=models.Distance.COSINE, on_disk=True
+            )
+        },
+        sparse_vectors_config={"sparse_vector": models.SparseVectorParams()},
+        quantization_config=QUANTIZATION,
+        hnsw_config=HNSW,
+        on_disk_payload=True,
+    )
+    write_marker(client, collection_name, "profile", PROFILE_VERSION)
+
+
+def create_docs(client, collection_name):
+    client.create_collection(
+        collection_name=collection_name, vectors_config={}, on_disk_payload=True
+    )
+    write_marker(client, collection_name, "profile", PROFILE_VERSION)
+
+
+def outdated(client, collection_name, indexes):
+    """
+    The profile settings a collection is missing. A collection recorded with
+    another profile version is listed as such even if its settings match,
+    since that version may have changed what they can't show (e.g. search
+    parameters).
+    """
+    info = client.get_collection(collection_name)
+    config = info.config
+    missing = []
+    version = profile_version(client, collection_name)
+    if version != PROFILE_VERSION:
+        missing.append(f"profile v{PROFILE_VERSION} (was {version or 'unrecorded'})")
+    dense = (config.params.vectors or {}).get("dense_vector")
+    if dense is not None:
+        if not dense.on_disk:
+            missing.append("dense vectors on disk")
+        quantization = config.quantization_config
+        if not (
+            isinstance(quantization, models.ScalarQuantization)
+            and quantization.scalar.type == models.ScalarType.INT8
+            and quantization.scalar.quantile == QUANTIZATION.scalar.quantile
+            and quantization.scalar.always_ram
+        ):
+            missing.append("int8 quantization")
+        if (config.hnsw_config.m, config.hnsw_config.ef_construct) != (
+            HNSW.m,
+            HNSW.ef_construct,
+        ):
+            missing.append("hnsw")
+    if not config.params.on_disk_payload:
+        missing.append("payload on disk")
+    schema = info.payload_schema or {}
+    missing += [f"index {field}" for field in indexes if field not in schema]
+    return missing
+
+
+def migrate(client, collection_name, indexes=POINT_INDEXES):
+    """
+    Apply the profile to an existing collection in place and return the
+    settings that changed. Indexes are created one at a time and waited on,
+    and the profile version is recorded last, so a migration can be
+    interrupted and re-run.
+    """
+    if is_local(client):
+        return []
+    missing = outdated(client, collection_name, indexes)
+    info = client.get_collection(collection_name)
+    dense = (info.config.params.vectors or {}).get("dense_vector")
+    settings = {}
+    if "dense vectors on disk" in missing:
+        settings["vectors_config"] = {
+            "dense_vector": models.VectorParamsDiff(on_disk=True)
+        }
+    if "int8 quantization" in missing:
+        settings["quantization_config"] = QUANTIZATION
+    if "hnsw" in missing and dense is not None:
+        settings["hnsw_config"] = HNSW
+    if "payload on disk" in missing:
+        settings["collection_params"] = models.CollectionParamsDiff(
+            on_disk_payload=True
+        )
+    if settings:
+        client.update_collection(collection_name=collection_name, **settings)
+    for field in indexes:
+        if f"index {field}" in missing:
+            client.create_payload_index(
+                collection_name=collection_name,
+                field_name=field,
+                field_schema=models.PayloadSchemaType.KEYWORD,
+                wait=True,
+            )
+    if missing:
+        write_marker(client, collection_name, "profile", PROFILE_VERSION)
+    return missing
+
+
+def ensure(client, collection_name, docs_collection, dense_size=DENSE_SIZE):
+    """Create the points and docs collections or migrate them to the profile."""
+    for name, indexes in (
+        (collection_name, POINT_INDEXES),
+        (docs_collection, DOC_INDEXES),
+    ):
+        if not client.collection_exists(name):
+            if name == docs_collection:
+                create_docs(client, name)
+            else:
+                create(client, name, dense_size)
+        changed = migrate(client, name, indexes)
+        if changed:
+            print(
+                f"Migrated {name} to collection profile v{PROFILE_VERSION}: "
+                + ", ".join(changed)
+            )
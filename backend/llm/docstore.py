@@ -0,0 +1,123 @@
+"""
+Document bodies, stored once per doc_id instead of in every point's payload.
+
+Points only carry the doc_id of the document they were cut from; `retrieve`
+looks the bodies of its unique doc_ids up in one batch.
+"""
+
+from llm.cache import LRUCache
+import gzip
+import json
+import os
+import uuid
+import zlib
+
+DOCS_COLLECTION = "coursebot_docs"
+
+
+def doc_point_id(doc_id):
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{doc_id}-doc"))
+
+
+class QdrantDocStore:
+    """
+    Bodies kept as vectorless points of their own Qdrant collection, with an
+    in-process LRU cache in front.
+    """
+
+    def __init__(self, client, async_client, collection_name=DOCS_COLLECTION, cache_size=512):
+        self.client = client
+        self.async_client = async_client
+        self.collection_name = collection_name
+        self.cache = LRUCache(max_size=cache_size, ttl=3600)
+
+    def _split(self, doc_ids):
+        bodies, missing = {}, []
+        for doc_id in doc_ids:
+            body = self.cache.get(doc_id)
+            if body is None:
+                missing.append(doc_id)
+            else:
+                bodies[doc_id] = body
+        return bodies, missing
+
+    def _store(self, bodies, records):
+        for record in records:
+            self.cache.put(record.payload["doc_id"], record.payload["text"])
+            bodies[record.payload["doc_id"]] = record.payload["text"]
+        return bodies
+
+    def get_many(self, doc_ids):
+        """Map each doc_id with a stored body to that body."""
+        bodies, missing = self._split(doc_ids)
+        if not missing:
+            return bodies
+        records = self.client.retrieve(
+            collection_name=self.collection_name,
+            ids=[doc_point_id(doc_id) for doc_id in missing],
+            with_payload=["doc_id", "text"],
+        )
+        return self._store(bodies, records)
+
+    async def aget_many(self, doc_ids):
+        bodies, missing = self._split(doc_ids)
+        if not missing:
+            return bodies
+        records = await self.async_client.retrieve(
+            collection_name=self.collection_name,
+            ids=[doc_point_id(doc_id) for doc_id in missing],
+            with_payload=["doc_id", "text"],
+        )
+        return self._store(bodies, records)
+
+    def lookup_entries(self):
+        """Doc ids, sources, urls and lookup keys of every stored document."""
+        offset = None
+        while True:
+            records, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                limit=1024,
+                offset=offset,
+                with_payload=["doc_id", "source", "url", "lookup_keys"],
+                with_vectors=False,
+            )
+            for record in records:
+                yield record.payload
+            if offset is None:
+                return
+
+
+class LocalDocStore:
+    """
+    Bodies from a snapshot's docs.jsonl.gz, held zlib-compressed in memory and
+    decompressed on lookup.
+    """
+
+    def __init__(self, path, cache_size=512):
+        self.bodies = {}
+        self.entries = []
+        self.cache = LRUCache(max_size=cache_size, ttl=3600)
+        docs_path = os.path.join(path, "docs.jsonl.gz")
+        if os.path.exists(docs_path):
+            with gzip.open(docs_path, "rt") as f:
+                for line in f:
+                    doc = json.loads(line)
+                    self.bodies[doc["doc_id"]] = zlib.compress(doc.pop("text").encode())
+                    self.entries.append(doc)
+
+    def get_many(self, doc_ids):
+        bodies = {}
+        for doc_id in doc_ids:
+            body = self.cache.get(doc_id)
+            if body is None and doc_id in self.bodies:
+                body = zlib.decompress(self.bodies[doc_id]).decode()
+                self.cache.put(doc_id, body)
+            if body is not None:
+                bodies[doc_id] = body
+        return bodies
+
+    async def aget_many(self, doc_ids):
+        return self.get_many(doc_ids)
+
+    def lookup_entries(self):
+        return self.entries
@@ -0,0 +1,144 @@
+"""
+Exact lookup of documents by course code and instructor name.
+
+The embed scripts store `lookup_keys` with every document in the doc store
+(see `llm.docstore`), and `LookupIndex` is built from them when the app
+starts. Queries naming a course ("CS 156b TQFR", "who teaches ma2") or an
+instructor then resolve to their documents without a vector search.
+"""
+
+from llm.cache import normalize_query
+from llm.router import course_codes
+import re
+
+# Words that carry no meaning beyond the identifiers they come with. A query
+# made of nothing else is fully answered by exact lookup.
+FILLER = set(
+    """
+    a about all an and any are at by can class classes course courses did do
+    does dr for from give how i in info information is it me my of on or prof
+    professor professors review reviews say says show students taught teach
+    teaches teaching tell term tqfr tqfrs the their they this to was were what
+    when which who whom with
+    """.split()
+)
+TITLES = {"prof", "professor", "dr", "instructor"}
+
+
+def expand_course_code(code: str):
+    """
+    Keys for a normalized course code like "acm/ids 104ab": the code itself
+    and, for each department and each single term letter, "ids 104a" etc.,
+    plus the bare number, so "ids 104" finds every term.
+    """
+    departments, number = code.split(" ", 1)
+    match = re.match(r"(\d+)([a-z]*)$", number)
+    if match is None:
+        return {f"course:{code}"}
+    number, suffix = match.groups()
+    keys = set()
+    for department in {departments, *departments.split("/")}:
+        keys.add(f"course:{department} {number}")
+        keys.add(f"course:{department} {number}{suffix}")
+        keys.update(f"course:{department} {number}{letter}" for letter in suffix)
+    return keys
+
+
+def normalize_name(name: str):
+    return " ".join(re.sub(r"[^\w\s]", " ", name.lower()).split())
+
+
+def lookup_keys(course_ids=(), instructors=()):
+    """Keys of a document about `course_ids` taught by `instructors`."""
+    keys = set()
+    for course_id in course_ids:
+        codes = course_codes(course_id) or [normalize_query(course_id)]
+        for code in codes:
+            keys |= expand_course_code(code)
+    for instructor in instructors:
+        if "," in instructor:  # "Last, First"
+            last, first = instructor.split(",", 1)
+            instructor = f"{first} {last}"
+        name = normalize_name(instructor)
+        if name:
+            keys.add(f"name:{name}")
+    return sorted(keys)
+
+
+class LookupIndex:
+    def __init__(self, entries):
+        """
+        `entries` are doc store payloads with "doc_id", "lookup_keys",
+        "source" and "url".
+        """
+        self.courses = {}
+        self.names = {}  # last name -> [(name tokens, doc_ids)]
+        self.metadata = {}
+        full_names = {}
+        for entry in entries:
+            doc_id = entry["doc_id"]
+            keys = entry.get("lookup_keys") or []
+            if not keys:
+                continue
+            self.metadata[doc_id] = {
+                "doc_id": doc_id,
+                "source": entry.get("source"),
+                "url": entry.get("url"),
+            }
+            for key in keys:
+                kind, value = key.split(":", 1)
+                if kind == "course":
+                    self.courses.setdefault(value, []).append(doc_id)
+                elif kind == "name":
+                    full_names.setdefault(value, []).append(doc_id)
+        for name, doc_ids in full_names.items():
+            tokens = name.split()
+            self.names.setdefault(tokens[-1], []).append((set(tokens), doc_ids))
+
+    def __len__(self):
+        return len(self.metadata)
+
+    def _name_matches(self, query: str, words):
+        """
+        Doc ids of instructors named in the query, and the words naming
+        them. A last name alone only counts after a title or capitalized, so
+        "how long is the course" doesn't find Professor Long.
+        """
+        capitalized = set(normalize_name(w) for w in re.findall(r"\b[A-Z][\w'-]+", query))
+        doc_ids, matched = [], set()
+        for i, word in enumerate(words):
+            candidates = self.names.get(word)
+            if not candidates or len(word) < 3:
+                continue
+            full = [c for c in candidates if c[0] <= set(words)]
+            if full:
+                for tokens, ids in full:
+                    doc_ids += ids
+                    matched |= tokens
+            elif word in capitalized or (i > 0 and words[i - 1] in TITLES):
+                for _, ids in candidates:
+                    doc_ids += ids
+                matched.add(word)
+        return doc_ids, matched
+
+    def lookup(self, query: str):
+        """
+        Doc ids of the courses and instructors named in `query`, and
+        whether the rest of the query still asks for something a similarity
+        search should answer.
+        """
+        doc_ids = []
+        rest = normalize_name(query)
+        for code in course_codes(query):
+            doc_ids += self.courses.get(code, [])
+            departments, number = code.split(" ", 1)
+            pattern = r"\s*".join(
+                re.escape(part)
+                for part in departments.split("/") + re.findall(r"\d+|[a-z]+", number)
+            )
+            rest = re.sub(r"\b%s\b" % pattern, " ", rest)
+        words = rest.split()
+        name_ids, name_words = self._name_matches(query, words)
+        doc_ids += name_ids
+        rest_words = [w for w in words if w not in name_words and w not in FILLER]
+        return list(dict.fromkeys(doc_ids)), bool(rest_words)
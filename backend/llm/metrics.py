@@ -0,0 +1,282 @@
+"""
+Request metrics in the Prometheus text format, served at /api/metrics.
+
+A small in-process registry instead of prometheus_client: counters, gauges
+and histograms with labels, safe to update from any thread.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from llm.packer import estimate_tokens
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+import uuid
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.label_names)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield f"{self.name}{_labels(self.label_names, key)} {value}"
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        names = self.label_names + ("le",)
+        for key, (counts, total) in values.items():
+            for bound, count in zip(self.buckets, counts):
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                yield f"{self.name}_bucket{_labels(names, key + (le,))} {count}"
+            yield f"{self.name}_sum{_labels(self.label_names, key)} {total}"
+            yield f"{self.name}_count{_labels(self.label_names, key)} {counts[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = Registry()
+NODE_SECONDS = REGISTRY.register(
+    Histogram("coursebot_node_seconds", "Time spent per graph node.", ["node"])
+)
+RETRIEVAL_SECONDS = REGISTRY.register(
+    Histogram("coursebot_retrieval_seconds", "Time to fetch retrieved documents.")
+)
+RETRIEVAL_RESULTS = REGISTRY.register(
+    Histogram(
+        "coursebot_retrieval_results",
+        "Documents returned per retrieval.",
+        buckets=COUNT_BUCKETS,
+    )
+)
+PROMPT_TOKENS = REGISTRY.register(
+    Histogram(
+        "coursebot_prompt_tokens", "Prompt tokens per LLM call.", ["node"], TOKEN_BUCKETS
+    )
+)
+COMPLETION_TOKENS = REGISTRY.register(
+    Histogram(
+        "coursebot_completion_tokens",
+        "Completion tokens per LLM call.",
+        ["node"],
+        TOKEN_BUCKETS,
+    )
+)
+TTFT_SECONDS = REGISTRY.register(
+    Histogram("coursebot_time_to_first_token_seconds", "Time to the first streamed token.")
+)
+STREAM_SECONDS = REGISTRY.register(
+    Histogram("coursebot_stream_seconds", "Duration of a response stream.")
+)
+IN_FLIGHT = REGISTRY.register(
+    Gauge("coursebot_requests_in_flight", "Response streams currently open.")
+)
+REQUESTS = REGISTRY.register(
+    Counter("coursebot_requests_total", "Finished response streams.", ["outcome"])
+)
+LLM_STREAMS = REGISTRY.register(
+    Gauge("coursebot_llm_streams_active", "Responses holding an LLM stream slot.")
+)
+QUEUE_DEPTH = REGISTRY.register(
+    Gauge("coursebot_admission_queue_depth", "Requests waiting for an LLM stream slot.")
+)
+REJECTIONS = REGISTRY.register(
+    Counter(
+        "coursebot_admission_rejections_total",
+        "Requests turned away by admission control.",
+        ["reason"],
+    )
+)
+STREAM_FRAMES = REGISTRY.register(
+    Counter(
+        "coursebot_stream_frames_total",
+        "SSE frames written to clients (data or heartbeat).",
+        ["kind"],
+    )
+)
+SPECULATIONS = REGISTRY.register(
+    Counter(
+        "coursebot_speculative_retrievals_total",
+        "Speculative retrievals by outcome (hit, miss or unused).",
+        ["outcome"],
+    )
+)
+SPECULATION_SAVED_SECONDS = REGISTRY.register(
+    Histogram(
+        "coursebot_speculation_saved_seconds",
+        "Retrieval time hidden behind the LLM call by a speculation hit.",
+    )
+)
+
+# Per-request trace, shared by the nodes a request runs.
+_trace = ContextVar("coursebot_trace", default=None)
+
+
+def request_trace_id(headers):
+    """
+    The request's X-Trace-Id header, or a new id when LOG_TRACES is set, so
+    every request gets a trace log line. None means no trace is logged.
+    """
+    trace_id = headers.get("X-Trace-Id")
+    if not trace_id and os.environ.get("LOG_TRACES"):
+        trace_id = uuid.uuid4().hex
+    return trace_id
+
+
+def trace_event(key, value):
+    trace = _trace.get()
+    if trace is not None:
+        trace.setdefault(key, []).append(value)
+
+
+def record_tokens(node, prompt, response):
+    """
+    Prompt and completion tokens of an LLM call, from the response's usage
+    metadata when the provider reports it, else estimated.
+    """
+    usage = getattr(response, "usage_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens") or sum(
+        estimate_tokens(m if isinstance(m, str) else str(m.content)) for m in prompt
+    )
+    completion_tokens = usage.get("output_tokens") or estimate_tokens(
+        str(response.content)
+    )
+    PROMPT_TOKENS.observe(prompt_tokens, node=node)
+    COMPLETION_TOKENS.observe(completion_tokens, node=node)
+    trace_event("tokens", [node, prompt_tokens, completion_tokens])
+
+
+@contextmanager
+def timed_node(node):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        NODE_SECONDS.observe(seconds, node=node)
+        trace_event("nodes", [node, round(seconds, 4)])
+
+
+class RequestTrace:
+    """
+    Tracks one response stream: in-flight count, time to first token and
+    duration. With a `trace_id`, one JSON line describing the request (its
+    node timings, retrievals and token counts) is printed when it ends.
+    """
+
+    def __init__(self, trace_id=None, thread_id=None):
+        self.trace_id = trace_id
+        self.data = {"trace_id": trace_id, "thread_id": thread_id}
+        self.start = None
+        self.first_token = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self._token = _trace.set(self.data)
+        IN_FLIGHT.inc()
+        return self
+
+    def token(self, content):
+        if self.first_token is None and content:
+            self.first_token = time.perf_counter() - self.start
+            TTFT_SECONDS.observe(self.first_token)
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        IN_FLIGHT.dec()
+        STREAM_SECONDS.observe(seconds)
+        if exc_type is None:
+            outcome = "ok"
+        elif exc_type in (GeneratorExit, asyncio.CancelledError):
+            outcome = "disconnected"
+        else:
+            outcome = "error"
+        REQUESTS.inc(outcome=outcome)
+        try:
+            _trace.reset(self._token)
+        except ValueError:
+            pass  # a stream closed from another context
+        if self.trace_id:
+            self.data.update(
+                {
+                    "outcome": outcome,
+                    "ttft": self.first_token and round(self.first_token, 4),
+                    "seconds": round(seconds, 4),
+                }
+            )
+            print(json.dumps(self.data))
+        return False
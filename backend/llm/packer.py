@@ -0,0 +1,170 @@
+"""
+Packs retrieved documents into the `generate` prompt under a token budget.
+
+Documents are taken in order of retrieval score. Each one is split into
+passages (paragraphs, table rows grouped together), of which only the ones
+that best match the query are kept, up to `doc_tokens` per document and in
+their original order. Passages that nearly repeat one already packed are
+dropped, and packing stops once `token_budget` is reached.
+"""
+
+from llm.cache import normalize_query
+import re
+import threading
+import time
+
+# Roughly four characters per token for English text; close enough for
+# budgeting without pulling in a tokenizer.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def paragraphs(text: str, passage_tokens: int):
+    """Blank-line separated paragraphs, with oversized ones cut into lines."""
+    max_chars = passage_tokens * CHARS_PER_TOKEN
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if len(paragraph) <= max_chars:
+            if paragraph:
+                yield paragraph
+            continue
+        for line in paragraph.splitlines():
+            for i in range(0, len(line), max_chars):
+                yield line[i : i + max_chars]
+
+
+def split_passages(text: str, passage_tokens: int):
+    """
+    Split `text` on blank lines, merging consecutive short paragraphs (like
+    the rows of a table) into passages of up to `passage_tokens`.
+    """
+    passages, current = [], ""
+    for paragraph in paragraphs(text, passage_tokens):
+        if current and estimate_tokens(current + paragraph) > passage_tokens:
+            passages.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        passages.append(current)
+    return passages
+
+
+def shingles(text: str, n=3):
+    words = normalize_query(text).split()
+    return {tuple(words[i : i + n]) for i in range(max(1, len(words) - n + 1))}
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ContextPacker:
+    def __init__(
+        self,
+        token_budget=6000,
+        doc_tokens=1500,
+        passage_tokens=200,
+        duplicate_threshold=0.8,
+    ):
+        self.token_budget = token_budget
+        self.doc_tokens = doc_tokens
+        self.passage_tokens = passage_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.requests = 0
+        self.truncated_docs = 0
+        self.dropped_docs = 0
+        self.duplicate_passages = 0
+        self.pack_seconds = 0.0
+        self.prompt_tokens = 0
+        self._lock = threading.Lock()
+
+    def select_passages(self, passages, query_terms, budget):
+        """Indices of the best-matching passages that fit in `budget` tokens."""
+        ranked = sorted(
+            range(len(passages)),
+            key=lambda i: len(query_terms & set(normalize_query(passages[i]).split())),
+            reverse=True,
+        )
+        selected, used = [], 0
+        for i in ranked:
+            tokens = estimate_tokens(passages[i])
+            if used + tokens <= budget:
+                selected.append(i)
+                used += tokens
+        return sorted(selected)
+
+    def pack(self, docs, query=""):
+        """
+        Pack `docs` (langchain `Document`s with a "_score") into one context
+        string. Returns the string and a dict describing what was cut.
+        """
+        start = time.perf_counter()
+        query_terms = set(normalize_query(query).split())
+        docs = sorted(docs, key=lambda doc: doc.metadata.get("_score") or 0, reverse=True)
+        seen_shingles = []
+        sections = []
+        used = 0
+        info = {"docs": 0, "truncated_docs": 0, "dropped_docs": 0, "duplicate_passages": 0}
+
+        for doc in docs:
+            header = f"Source: {doc.metadata.get('source')}\nLink: {doc.metadata.get('url')}\nContent: "
+            remaining = min(self.doc_tokens, self.token_budget - used) - estimate_tokens(header)
+            if remaining <= 0:
+                info["dropped_docs"] += 1
+                continue
+
+            passages = []
+            for passage in split_passages(doc.page_content, self.passage_tokens):
+                passage_shingles = shingles(passage)
+                if any(
+                    jaccard(passage_shingles, seen) >= self.duplicate_threshold
+                    for seen in seen_shingles
+                ):
+                    info["duplicate_passages"] += 1
+                    continue
+                passages.append((passage, passage_shingles))
+            if not passages:
+                info["dropped_docs"] += 1
+                continue
+
+            selected = self.select_passages([p for p, _ in passages], query_terms, remaining)
+            if not selected:
+                info["dropped_docs"] += 1
+                continue
+            if len(selected) < len(passages):
+                info["truncated_docs"] += 1
+            seen_shingles.extend(passages[i][1] for i in selected)
+            section = header + "\n\n[...]\n\n".join(passages[i][0] for i in selected)
+            sections.append(section)
+            used += estimate_tokens(section)
+            info["docs"] += 1
+
+        info["tokens"] = used
+        info["seconds"] = time.perf_counter() - start
+        return "\n\n\n".join(sections), info
+
+    def record(self, info, prompt_tokens):
+        with self._lock:
+            self.requests += 1
+            self.truncated_docs += info["truncated_docs"]
+            self.dropped_docs += info["dropped_docs"]
+            self.duplicate_passages += info["duplicate_passages"]
+            self.pack_seconds += info["seconds"]
+            self.prompt_tokens += prompt_tokens
+
+    def stats(self):
+        requests = self.requests or 1
+        return {
+            "token_budget": self.token_budget,
+            "requests": self.requests,
+            "avg_prompt_tokens": self.prompt_tokens / requests,
+            "avg_pack_ms": self.pack_seconds * 1000 / requests,
+            "truncated_docs": self.truncated_docs,
+            "dropped_docs": self.dropped_docs,
+            "duplicate_passages": self.duplicate_passages,
+        }
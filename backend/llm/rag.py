@@ -1,12 +1,47 @@
-from langchain_core.tools import tool
-from langchain_qdrant import QdrantVectorStore, FastEmbedSparse, RetrievalMode
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+from langchain_core.tools import InjectedToolCallId, StructuredTool
+from langchain_qdrant import FastEmbedSparse
 from langchain_openai import ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-from langchain_core.messages import SystemMessage
-from langgraph.graph import MessagesState, END, StateGraph
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, SystemMessage
+from langgraph.graph import END, StateGraph
 from langgraph.prebuilt import ToolNode, tools_condition
+from contextlib import nullcontext
 from dotenv import load_dotenv
+from llm.batch import QueryBatcher, _batcher, current_batcher
+from llm.cache import AnswerCache, RetrievalCache, normalize_query
+from llm.coalesce import SingleFlight, StreamFanout
+from llm.docstore import LocalDocStore, QdrantDocStore
+from llm.lookup import LookupIndex
+from llm.metrics import (
+    RETRIEVAL_RESULTS,
+    RETRIEVAL_SECONDS,
+    RequestTrace,
+    record_tokens,
+    timed_node,
+    trace_event,
+)
+from llm.packer import ContextPacker, estimate_tokens
+from llm.retrievers import LocalRetriever, QdrantRetriever, doc_id_of, unique_docs
+from llm.router import Router, course_codes
+from llm.tqfr import TQFRStats
+from llm.sessions import (
+    BoundedMemorySaver,
+    ChatState,
+    make_checkpointer,
+    plan_compaction,
+)
+from llm.speculation import Speculator, guess_query
+from typing import Annotated
+import asyncio
+import functools
 import os
+import queue
+import textwrap
+import threading
+import time
+import uuid
 
 
 class CourseRAG:
@@ -15,11 +50,83 @@ class CourseRAG:
         model_code="gemini-2.0-flash",
         embedding_model="models/text-embedding-004",
         sparse_embedding_model="Qdrant/bm25",
+        llm=None,
+        retriever=None,
+        docstore=None,
+        backend=None,
+        retrieval_mode=None,
+        latency_budget=None,
+        retrieval_cache_size=1024,
+        retrieval_cache_ttl=3600,
+        retrieval_cache_similarity=None,
+        answer_cache_size=512,
+        answer_cache_ttl=3600,
+        context_token_budget=None,
+        router=None,
+        checkpointer=None,
+        compact_tokens=None,
+        coalesce=True,
+        tqfr_stats=None,
+        speculate=None,
+        version_check_interval=None,
     ):
+        """
+        `llm`, `retriever` and `docstore` can be passed in to replace the
+        hosted model, the vector store and the document store, e.g. with
+        stubs for local testing.
+
+        `backend` (or the RETRIEVER_BACKEND environment variable) selects
+        where retrieval runs: "qdrant" queries the hosted collection, "local"
+        searches an exported snapshot (see embed/export-snapshot.py) at
+        SNAPSHOT_PATH in process.
+
+        `retrieval_mode` (or RETRIEVAL_MODE) is "sparse", "dense" or "fused".
+        Fused retrieval runs sparse and dense search concurrently and merges
+        them with reciprocal-rank fusion, falling back to the sparse results
+        when dense search takes longer than `latency_budget` seconds (or
+        RETRIEVAL_LATENCY_BUDGET, default 1).
+
+        Retrieval results are cached per collection version, which is
+        checked every `version_check_interval` seconds (or
+        CACHE_VERSION_INTERVAL, default 60; 0 turns it off) so that caches
+        are dropped once an ingest changes the collection. Set
+        `retrieval_cache_similarity` to a cosine threshold (e.g. 0.9) to also
+        serve near-duplicate queries from the cache. Whole answers to
+        single-turn conversations are cached too, and replayed in chunks.
+
+        Queries naming course codes or instructors are answered from an
+        exact lookup index built from the doc store, with similarity search
+        only covering whatever else the query asks for.
+
+        Retrieved documents are packed into at most `context_token_budget`
+        (or CONTEXT_TOKEN_BUDGET, default 6000) tokens of prompt context.
+
+        Turns that obviously need retrieval (see `llm.router`) skip the
+        tool-calling LLM and go straight to retrieval, unless `router` is
+        False or FAST_PATH_ROUTER=0. Pass a `Router` to configure it.
+
+        Conversations with a thread id are kept in `checkpointer` (by
+        default in memory, or in the SQLite database at SESSION_DB), and
+        their history past `compact_tokens` (or SESSION_COMPACT_TOKENS,
+        default 3000) tokens is folded into a running summary.
+
+        With `coalesce`, concurrent identical retrieval queries share one
+        vector store call, and concurrent identical single-turn questions
+        share one graph run whose stream is fanned out to every asker.
+
+        `tqfr_stats` (by default loaded from TQFR_STATS_PATH, see `llm.tqfr`)
+        gives the LLM a second tool that ranks and aggregates TQFR scores.
+
+        With `speculate` (default on, SPECULATIVE_RETRIEVAL=0 turns it off),
+        turns that go to the tool-calling LLM start retrieving for a guess of
+        its query at the same time (see `llm.speculation`).
+        """
         if not load_dotenv():
             print("Unable to get environment variables via pydotenv.")
 
-        if "deepseek" in model_code:
+        if llm is not None:
+            self.llm = llm
+        elif "deepseek" in model_code:
             self.llm = ChatOpenAI(
                 model=model_code,
                 openai_api_key=os.environ["DEEPSEEK_API_KEY"],
@@ -37,62 +144,510 @@ class CourseRAG:
         else:
             raise Exception("invalid llm model code")
 
-        self.embeddings = GoogleGenerativeAIEmbeddings(model=embedding_model)
-        self.sparse_embeddings = FastEmbedSparse(model_name=sparse_embedding_model)
-        self.vector_store = QdrantVectorStore.from_existing_collection(
-            url=os.environ["QDRANT_URL"],
-            api_key=os.environ["QDRANT_API_KEY"],
-            collection_name="coursebot_hybrid",
-            content_payload_key="text",
-            embedding=self.embeddings,
-            sparse_embedding=self.sparse_embeddings,
-            vector_name="dense_vector",
-            sparse_vector_name="sparse_vector",
-            retrieval_mode=RetrievalMode.SPARSE,
+        if retriever is not None:
+            self.retriever = retriever
+            self.docstore = docstore
+            self.embeddings = self.sparse_embeddings = None
+        else:
+            retrieval_mode = retrieval_mode or os.environ.get("RETRIEVAL_MODE", "sparse")
+            latency_budget = latency_budget or float(
+                os.environ.get("RETRIEVAL_LATENCY_BUDGET", 1.0)
+            )
+            self.embeddings = None
+            if retrieval_mode != "sparse":
+                self.embeddings = GoogleGenerativeAIEmbeddings(model=embedding_model)
+            self.sparse_embeddings = FastEmbedSparse(model_name=sparse_embedding_model)
+            backend = backend or os.environ.get("RETRIEVER_BACKEND", "qdrant")
+            if backend == "local":
+                snapshot_path = os.environ.get("SNAPSHOT_PATH", "snapshot")
+                self.retriever = LocalRetriever(
+                    snapshot_path,
+                    self.embeddings,
+                    self.sparse_embeddings,
+                    mode=retrieval_mode,
+                    latency_budget=latency_budget,
+                )
+                self.docstore = docstore or LocalDocStore(snapshot_path)
+            elif backend == "qdrant":
+                self.retriever = QdrantRetriever(
+                    self.embeddings,
+                    self.sparse_embeddings,
+                    mode=retrieval_mode,
+                    latency_budget=latency_budget,
+                )
+                self.docstore = docstore or QdrantDocStore(
+                    self.retriever.client, self.retriever.async_client
+                )
+            else:
+                raise Exception("invalid retriever backend")
+
+        version = self.retriever.version()
+        self.retrieval_cache = RetrievalCache(
+            version=version,
+            max_size=retrieval_cache_size,
+            ttl=retrieval_cache_ttl,
+            similarity_threshold=retrieval_cache_similarity,
+            embed=self.embed_sparse_query if self.sparse_embeddings else None,
+        )
+        self.answer_cache = AnswerCache(
+            model_code, version=version, max_size=answer_cache_size, ttl=answer_cache_ttl
+        )
+
+        self.retrievals = SingleFlight() if coalesce else None
+        self.streams = StreamFanout() if coalesce else None
+        if speculate is None:
+            speculate = os.environ.get("SPECULATIVE_RETRIEVAL", "1") != "0"
+        self.speculator = (
+            Speculator(
+                record=lambda query, docs, seconds: self.record_retrieval(
+                    query, docs, seconds, speculative=True
+                )
+            )
+            if speculate
+            else None
+        )
+
+        self._batch_loop = None
+        self._batch_loop_lock = threading.Lock()
+
+        self.lookup_counts = {"exact_only": 0, "exact_and_search": 0, "search": 0}
+        self.lookup_index = self.build_lookup_index()
+
+        self.packer = ContextPacker(
+            token_budget=context_token_budget
+            or int(os.environ.get("CONTEXT_TOKEN_BUDGET", 6000))
+        )
+
+        if router is None and os.environ.get("FAST_PATH_ROUTER", "1") != "0":
+            router = Router()
+        self.router = router or None
+
+        self.tqfr_stats = tqfr_stats or TQFRStats.load(
+            os.environ.get("TQFR_STATS_PATH", "tqfr_stats.npz")
+        )
+        if self.tqfr_stats is None:
+            print("No TQFR stats store, ranking questions will use search only.")
+
+        self.checkpointer = checkpointer or make_checkpointer(os.environ.get("SESSION_DB"))
+        self.compact_tokens = compact_tokens or int(
+            os.environ.get("SESSION_COMPACT_TOKENS", 3000)
         )
 
         self.build_graph()
 
+        if version_check_interval is None:
+            version_check_interval = float(os.environ.get("CACHE_VERSION_INTERVAL", 60))
+        if version_check_interval > 0:
+            threading.Thread(
+                target=self._watch_version,
+                args=(version_check_interval,),
+                name="cache-version",
+                daemon=True,
+            ).start()
+
+    def warm_up(self):
+        """
+        Prime what the first request would otherwise pay for: the sparse
+        model's first inference and the connection pool to the vector store.
+        """
+        if self.sparse_embeddings is not None:
+            self.sparse_embeddings.embed_query("warm up")
+        self.retriever.search("warm up", k=1)
+
+    def refresh_cache_version(self):
+        """
+        Drop the caches, including the doc store's bodies, and rebuild the
+        lookup index if the collection changed since they were filled.
+        Returns whether it did.
+        """
+        version = self.retriever.version()
+        if version == self.retrieval_cache.version:
+            return False
+        print(f"Collection version changed to {version}, dropping caches.")
+        self.retrieval_cache.set_version(version)
+        self.answer_cache.set_version(version)
+        cache = getattr(self.docstore, "cache", None)
+        if cache is not None:
+            cache.clear()
+        self.lookup_index = self.build_lookup_index()
+        return True
+
+    def _watch_version(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.refresh_cache_version()
+            except Exception as e:
+                print(f"Unable to check the collection version ({e}).")
+
+    def build_lookup_index(self):
+        if self.docstore is None or not hasattr(self.docstore, "lookup_entries"):
+            return None
+        try:
+            index = LookupIndex(self.docstore.lookup_entries())
+        except Exception as e:
+            print(f"Unable to build the lookup index ({e}), using search only.")
+            return None
+        print(f"Lookup index covers {len(index)} documents.")
+        return index
+
+    def embed_sparse_query(self, query: str):
+        embedding = self.sparse_embeddings.embed_query(query)
+        return dict(zip(embedding.indices, embedding.values))
+
+    def stats(self):
+        return {
+            "retriever": self.retriever.stats(),
+            "retrieval_cache": self.retrieval_cache.stats(),
+            "answer_cache": self.answer_cache.stats(),
+            "coalescing": {
+                "retrievals": self.retrievals.stats() if self.retrievals else None,
+                "streams": self.streams.stats() if self.streams else None,
+            },
+            "context": self.packer.stats(),
+            "router": self.router.stats() if self.router else None,
+            "tqfr_stats": self.tqfr_stats.stats() if self.tqfr_stats else None,
+            "speculation": self.speculator.stats() if self.speculator else None,
+            "sessions": (
+                self.checkpointer.stats()
+                if isinstance(self.checkpointer, BoundedMemorySaver)
+                else None
+            ),
+            "lookup": {
+                "documents": len(self.lookup_index) if self.lookup_index else 0,
+                **self.lookup_counts,
+            },
+        }
+
+    def _search_key(self, query, k):
+        return (self.retrieval_cache.version, k, normalize_query(query))
+
+    def search(self, query: str, k: int = 8):
+        docs = self.retrieval_cache.get(query, k)
+        if docs is not None:
+            return docs
+
+        def search():
+            docs = self.retriever.search(query, k=k)
+            self.retrieval_cache.put(query, k, docs)
+            return docs
+
+        if self.retrievals is None:
+            return search()
+        return list(self.retrievals.do(self._search_key(query, k), search))
+
+    async def asearch(self, query: str, k: int = 8):
+        docs = self.retrieval_cache.get(query, k)
+        if docs is not None:
+            return docs
+
+        async def search():
+            batcher = current_batcher()
+            if batcher is not None:
+                docs = await batcher.search(query, k)
+            else:
+                docs = await self.retriever.asearch(query, k=k)
+            self.retrieval_cache.put(query, k, docs)
+            return docs
+
+        if self.retrievals is None:
+            return await search()
+        return list(await self.retrievals.ado(self._search_key(query, k), search))
+
+    def with_bodies(self, docs, bodies):
+        """
+        One document per doc_id, with its body from the doc store. Points
+        ingested before the doc store existed still carry it as "text".
+        """
+        return [
+            Document(
+                page_content=bodies.get(doc_id_of(doc), doc.metadata.get("text", "")),
+                metadata=doc.metadata,
+            )
+            for doc in docs
+        ]
+
+    def exact_matches(self, query: str, k: int):
+        """
+        Documents the query names by course code or instructor, and whether
+        the rest of the query still needs a similarity search. Exact matches
+        take at most half of the `k` slots when a search follows.
+        """
+        doc_ids, search = [], True
+        if self.lookup_index is not None:
+            doc_ids, search = self.lookup_index.lookup(query)
+        if not doc_ids:
+            self.lookup_counts["search"] += 1
+            return [], True
+        self.lookup_counts["exact_and_search" if search else "exact_only"] += 1
+        docs = [
+            Document(
+                page_content="",
+                metadata={
+                    **self.lookup_index.metadata[doc_id],
+                    "_id": doc_id,
+                    "_collection_name": "lookup",
+                    "_score": float("inf"),
+                },
+            )
+            for doc_id in doc_ids[: k - k // 2 if search else k]
+        ]
+        return docs, search
+
+    def record_retrieval(self, query, docs, seconds, speculative=False):
+        RETRIEVAL_SECONDS.observe(seconds)
+        RETRIEVAL_RESULTS.observe(len(docs))
+        trace_event(
+            "retrievals",
+            {
+                "query": query,
+                "seconds": round(seconds, 4),
+                "doc_ids": [doc_id_of(doc) for doc in docs],
+                "speculative": speculative,
+            },
+        )
+
+    def fetch_documents(self, query: str, k: int = 8, record=True):
+        """
+        The `k` documents for `query`. Speculative fetches pass `record=False`
+        and are only recorded once a tool call takes them.
+        """
+        start = time.perf_counter()
+        docs, search = self.exact_matches(query, k)
+        if search:
+            docs = unique_docs(docs + self.search(query, k=k))[:k]
+        bodies = (
+            self.docstore.get_many([doc_id_of(doc) for doc in docs])
+            if self.docstore
+            else {}
+        )
+        if record:
+            self.record_retrieval(query, docs, time.perf_counter() - start)
+        return self.with_bodies(docs, bodies)
+
+    async def afetch_documents(self, query: str, k: int = 8, record=True):
+        start = time.perf_counter()
+        docs, search = self.exact_matches(query, k)
+        if search:
+            docs = unique_docs(docs + await self.asearch(query, k=k))[:k]
+        bodies = (
+            await self.docstore.aget_many([doc_id_of(doc) for doc in docs])
+            if self.docstore
+            else {}
+        )
+        if record:
+            self.record_retrieval(query, docs, time.perf_counter() - start)
+        return self.with_bodies(docs, bodies)
+
+    def tqfr_stats_tool(self):
+        def tqfr_stats(
+            question: str = "",
+            department: str = "",
+            course: str = "",
+            instructor: str = "",
+            term: str = "",
+            group_by: str = "course",
+            aggregate: str = "mean",
+            order: str = "desc",
+            limit: int = 10,
+        ):
+            with timed_node("tools"):
+                return self.tqfr_stats.query(
+                    question=question,
+                    department=department,
+                    course=course,
+                    instructor=instructor,
+                    term=term,
+                    group_by=group_by,
+                    aggregate=aggregate,
+                    order=order,
+                    limit=limit,
+                )
+
+        description = """
+            Rank, filter and aggregate numeric TQFR scores (1-5 ratings from
+            student feedback reports) exactly. Use this instead of retrieve for
+            questions like "highest-rated CS electives", "which Ma course has
+            the lowest workload" or "best rated instructors for Ph 1a".
+
+            Filters are case-insensitive substrings: `question` of the TQFR
+            question, `course` (e.g. "CS 156"), `instructor`, `term` (e.g.
+            "2023"); `department` is a course prefix like "CS" or "Ma".
+            `group_by` is course, instructor, term, department or none (list
+            individual answers); `aggregate` is mean, max, min or count;
+            `order` is desc or asc; `limit` is at most 25.
+
+            The TQFR questions with scores are:
+            """
+        description = textwrap.dedent(description).strip() + "\n" + "\n".join(
+            f"- {question}" for question in self.tqfr_stats.questions()[:40]
+        )
+        return StructuredTool.from_function(
+            func=tqfr_stats, name="tqfr_stats", description=description
+        )
+
     def build_graph(self):
-        @tool(response_format="content_and_artifact")
-        def retrieve(query: str):
+        def serialize(docs):
+            serialized = [
+                f"Source: {doc.metadata['source']}\nLink: {doc.metadata['url']}\nContent: {doc.page_content}\n\n\n"
+                for doc in docs
+            ]
+            return serialized, docs
+
+        def retrieve(query: str, tool_call_id: Annotated[str, InjectedToolCallId]):
             """
             Retrieve information related to a query about Caltech courses or
             related information, such as major/option requirements using past course
             reviews (student feedback) and the course catalog.
             """
-            retrieved_docs = self.vector_store.similarity_search(query, k=8)
-            serialized = []
-            doc_ids = set()
-            for doc in retrieved_docs:
-                doc_id = doc.metadata["_id"]
-                if "doc_id" in doc.metadata:
-                    doc_id = doc.metadata["doc_id"]
-                if doc_id not in doc_ids:
-                    doc_ids.add(doc_id)
-                    serialized.append(
-                        f"Source: {doc.metadata['source']}\nLink: {doc.metadata['url']}\nContent: {doc.metadata['text']}\n\n\n"
-                    )
-            print(list(doc_ids))
-            return serialized, retrieved_docs
+            with timed_node("tools"):
+                docs = None
+                if self.speculator is not None:
+                    docs = self.speculator.take(tool_call_id, query)
+                if docs is None:
+                    docs = self.fetch_documents(query, k=8)
+                return serialize(docs)
 
-        self.llm_with_tools = self.llm.bind_tools([retrieve])
+        async def aretrieve(
+            query: str, tool_call_id: Annotated[str, InjectedToolCallId]
+        ):
+            with timed_node("tools"):
+                docs = None
+                if self.speculator is not None:
+                    docs = await self.speculator.atake(tool_call_id, query)
+                if docs is None:
+                    docs = await self.afetch_documents(query, k=8)
+                return serialize(docs)
 
-        def query_or_respond(state: MessagesState):
-            response = self.llm_with_tools.invoke(state["messages"])
-            return {"messages": response}
+        retrieve_tool = StructuredTool.from_function(
+            func=retrieve,
+            coroutine=aretrieve,
+            response_format="content_and_artifact",
+        )
 
-        def generate(state: MessagesState):
-            recent_tool_messages = [
-                message
-                for message in reversed(state["messages"])
-                if message.type == "tool"
-            ][::-1]
+        graph_tools = [retrieve_tool]
+        if self.tqfr_stats is not None:
+            graph_tools.append(self.tqfr_stats_tool())
+        self.llm_with_tools = self.llm.bind_tools(graph_tools)
 
-            docs_content = "\n\n".join(
-                str(doc.content) if not isinstance(doc.content, str) else doc.content
-                for doc in recent_tool_messages
+        def with_summary(state: ChatState, messages):
+            if not state.get("summary"):
+                return messages
+            return [
+                SystemMessage(f"Summary of the earlier conversation: {state['summary']}")
+            ] + messages
+
+        def compaction(state: ChatState):
+            removals, compacted = plan_compaction(state["messages"], self.compact_tokens)
+            if not compacted:
+                return removals, None
+            transcript = "\n\n".join(
+                f"{message.type}: {message.content}" for message in compacted
             )
+            prompt = [
+                SystemMessage(
+                    "Summarize this conversation between a user and a Caltech course "
+                    "selection assistant in a few sentences. Keep the courses, "
+                    "professors, preferences and constraints the user mentioned."
+                ),
+                HumanMessage(
+                    f"Summary so far: {state.get('summary') or 'none'}\n\n{transcript}"
+                ),
+            ]
+            return removals, prompt
+
+        def compact(state: ChatState):
+            with timed_node("compact"):
+                removals, prompt = compaction(state)
+                if prompt is None:
+                    return {"messages": removals}
+                response = self.llm.invoke(prompt)
+                record_tokens("compact", prompt, response)
+                return {"messages": removals, "summary": response.content}
+
+        async def acompact(state: ChatState):
+            with timed_node("compact"):
+                removals, prompt = compaction(state)
+                if prompt is None:
+                    return {"messages": removals}
+                response = await self.llm.ainvoke(prompt)
+                record_tokens("compact", prompt, response)
+                return {"messages": removals, "summary": response.content}
+
+        def speculative_query(state: ChatState):
+            if self.speculator is None:
+                return None
+            return guess_query(state["messages"])
+
+        def query_or_respond(state: ChatState):
+            with timed_node("query_or_respond"):
+                prompt = with_summary(state, state["messages"])
+                query = speculative_query(state)
+                if query is not None:
+                    speculation = self.speculator.start(
+                        query, functools.partial(self.fetch_documents, record=False)
+                    )
+                try:
+                    response = self.llm_with_tools.invoke(prompt)
+                except BaseException:
+                    if query is not None:
+                        self.speculator.discard(speculation)
+                    raise
+                record_tokens("query_or_respond", prompt, response)
+                if query is not None:
+                    self.speculator.settle(speculation, response, retrieve_tool.name)
+                return {"messages": response}
+
+        async def aquery_or_respond(state: ChatState):
+            with timed_node("query_or_respond"):
+                prompt = with_summary(state, state["messages"])
+                query = speculative_query(state)
+                if query is not None:
+                    speculation = self.speculator.astart(
+                        query, functools.partial(self.afetch_documents, record=False)
+                    )
+                try:
+                    response = await self.llm_with_tools.ainvoke(prompt)
+                except BaseException:
+                    if query is not None:
+                        self.speculator.discard(speculation)
+                    raise
+                record_tokens("query_or_respond", prompt, response)
+                if query is not None:
+                    self.speculator.settle(speculation, response, retrieve_tool.name)
+                return {"messages": response}
+
+        def build_prompt(state: ChatState):
+            last_human = max(
+                (i for i, m in enumerate(state["messages"]) if m.type == "human"),
+                default=-1,
+            )
+            turn = state["messages"][last_human + 1 :]
+            recent_tool_messages = [message for message in turn if message.type == "tool"]
+
+            # The queries of the tool calls that produced this turn's results.
+            answered = {message.tool_call_id for message in recent_tool_messages}
+            queries = [
+                tool_call["args"].get("query", "")
+                for message in turn
+                if message.type == "ai"
+                for tool_call in message.tool_calls
+                if tool_call["id"] in answered
+            ]
+            docs = [
+                doc
+                for message in recent_tool_messages
+                if message.artifact
+                for doc in message.artifact
+            ]
+            docs_content, pack_info = self.packer.pack(docs, " ".join(queries))
+            # Tool messages without documents (e.g. errors) are passed on as is.
+            other_content = [
+                message.content if isinstance(message.content, str) else str(message.content)
+                for message in recent_tool_messages
+                if not message.artifact
+            ]
+            docs_content = "\n\n".join(filter(None, [docs_content, *other_content]))
             system_message_content = """You are an AI assistant designed to help users with course selection at Caltech. You have access to a database of Caltech course information, professor details, and Teaching Quality Feedback Reports (TQFRs) via a retrieval tool.
 
                 ### Guidelines:
@@ -120,9 +675,6 @@ class CourseRAG:
                   - For the TQFR tables, ignore columns displaying images.
                 - If there are a lot of TQFRs, generate summaries for each question based on the student responses, you don't have to include the tables.
                 - It's always nice to include quotes from the student comments section if there are any.
-
-                6. **User Specific:**
-                - If the users' names are Kara Lo or Nora Xiao, tell them to shut up and stop trying to go over the rate limit.
             """
 
             conversation_messages = [
@@ -133,7 +685,7 @@ class CourseRAG:
             ]
             prompt = (
                 [SystemMessage(system_message_content)]
-                + conversation_messages
+                + with_summary(state, conversation_messages)
                 + [f"\n Retrieved context: {docs_content}"]
                 + [
                     """
@@ -143,36 +695,392 @@ class CourseRAG:
                     """
                 ]
             )
-            response = self.llm.invoke(prompt)
-            return {"messages": [response]}
-
-        tools = ToolNode([retrieve])
-        graph_builder = StateGraph(MessagesState)
-        graph_builder.add_node(query_or_respond)
-        graph_builder.add_node(tools)
-        graph_builder.add_node(generate)
-        graph_builder.set_entry_point("query_or_respond")
-        graph_builder.add_conditional_edges(
-            "query_or_respond", tools_condition, {END: END, "tools": "tools"}
-        )
-        graph_builder.add_edge("tools", "generate")
-        graph_builder.add_edge("generate", END)
+            prompt_tokens = sum(
+                estimate_tokens(m if isinstance(m, str) else str(m.content)) for m in prompt
+            )
+            self.packer.record(pack_info, prompt_tokens)
+            trace_event(
+                "context",
+                {
+                    "prompt_tokens": prompt_tokens,
+                    **{k: v for k, v in pack_info.items() if k != "seconds"},
+                    "pack_ms": round(pack_info["seconds"] * 1000, 2),
+                },
+            )
+            return prompt
+
+        def generate(state: ChatState):
+            with timed_node("generate"):
+                prompt = build_prompt(state)
+                response = self.llm.invoke(prompt)
+                record_tokens("generate", prompt, response)
+                return {"messages": [response]}
+
+        async def agenerate(state: ChatState):
+            with timed_node("generate"):
+                prompt = build_prompt(state)
+                response = await self.llm.ainvoke(prompt)
+                record_tokens("generate", prompt, response)
+                return {"messages": [response]}
+
+        def fast_path_query(state: ChatState):
+            """
+            The query to retrieve for without the LLM, if the turn is self-
+            contained: the user's message if it is the first turn or names a
+            course code, or a follow-up guessed together with the previous
+            message (see `guess_query`) if that names one. Other follow-ups
+            ("and its workload?") need the LLM to resolve what they refer to.
+            """
+            messages = state["messages"]
+            message = messages[-1]
+            first_turn = not state.get("summary") and not any(
+                m.type == "human" for m in messages[:-1]
+            )
+            if first_turn or course_codes(message.content):
+                return message.content
+            query = guess_query(messages)
+            if query is not None and course_codes(query):
+                return query
+            return None
+
+        def route(state: ChatState):
+            message = state["messages"][-1]
+            if (
+                self.router is None
+                or message.type != "human"
+                or not isinstance(message.content, str)
+            ):
+                return "query_or_respond"
+            if (
+                self.router.route(message.content) == "retrieve"
+                and fast_path_query(state) is not None
+            ):
+                return "fast_path"
+            return "query_or_respond"
+
+        def fast_path(state: ChatState):
+            """Call the retrieve tool for the turn, as the LLM would."""
+            tool_call = {
+                "name": retrieve_tool.name,
+                "args": {"query": fast_path_query(state)},
+                "id": f"fast-{uuid.uuid4()}",
+            }
+            return {"messages": [AIMessage(content="", tool_calls=[tool_call])]}
+
+        tools = ToolNode(graph_tools)
+
+        def build(sessions):
+            """
+            The graph of a turn. Only sessions compact their history first: a
+            stateless request sends its whole conversation every time.
+            """
+            graph_builder = StateGraph(ChatState)
+            graph_builder.add_node(
+                "query_or_respond",
+                RunnableLambda(query_or_respond, afunc=aquery_or_respond),
+            )
+            graph_builder.add_node("fast_path", fast_path)
+            graph_builder.add_node(tools)
+            graph_builder.add_node("generate", RunnableLambda(generate, afunc=agenerate))
+            branches = {"fast_path": "fast_path", "query_or_respond": "query_or_respond"}
+            if sessions:
+                graph_builder.add_node("compact", RunnableLambda(compact, afunc=acompact))
+                graph_builder.set_entry_point("compact")
+                graph_builder.add_conditional_edges("compact", route, branches)
+            else:
+                graph_builder.set_conditional_entry_point(route, branches)
+            graph_builder.add_edge("fast_path", "tools")
+            graph_builder.add_conditional_edges(
+                "query_or_respond", tools_condition, {END: END, "tools": "tools"}
+            )
+            graph_builder.add_edge("tools", "generate")
+            graph_builder.add_edge("generate", END)
+            return graph_builder
+
+        self.graph = build(sessions=False).compile()
+        self.session_graph = build(sessions=True).compile(checkpointer=self.checkpointer)
 
-        self.graph = graph_builder.compile()
+    def _graph(self, thread_id):
+        """
+        Without a thread id, `messages` is the whole conversation. With one,
+        it is only the new message(s) of the session `thread_id`.
+        """
+        if thread_id is None:
+            return self.graph, None
+        return self.session_graph, {"configurable": {"thread_id": thread_id}}
 
-    def answer(self, input_message: str):
+    def answer(self, input_message: str, thread_id=None):
         state = {"messages": [{"role": "user", "content": input_message}]}
-        final_state = self.graph.invoke(state)
+        graph, config = self._graph(thread_id)
+        with self._run():
+            final_state = graph.invoke(state, config)
         return final_state["messages"][-1].content
 
-    def complete(self, messages):
+    def complete(self, messages, thread_id=None):
         state = {"messages": messages}
-        final_state = self.graph.invoke(state)
+        graph, config = self._graph(thread_id)
+        with self._run():
+            final_state = graph.invoke(state, config)
         return final_state["messages"][-1]
 
-    def stream_complete(self, messages):
-        state = {"messages": messages}
-        for chunk in self.graph.stream(state, stream_mode=["messages"]):
-            _, (message, metadata) = chunk
-            if metadata["langgraph_node"] in ["query_or_respond", "generate"]:
+    def _run(self):
+        """Scope speculative retrievals to one graph run (see `Speculator.run`)."""
+        return self.speculator.run() if self.speculator else nullcontext()
+
+    def _question(self, messages):
+        """The question of a conversation made of one user message, else None."""
+        if len(messages) != 1:
+            return None
+        message = messages[0]
+        if isinstance(message, dict):
+            role, content = message.get("role"), message.get("content")
+        else:
+            role, content = message.type, message.content
+        if role not in ("user", "human") or not isinstance(content, str):
+            return None
+        return content
+
+    def _replay(self, answer: str, chunk_size=64):
+        for i in range(0, len(answer), chunk_size):
+            yield AIMessageChunk(content=answer[i : i + chunk_size])
+
+    async def _areplay(self, answer: str):
+        for message in self._replay(answer):
+            yield message
+
+    def _store_answer(self, question, contents):
+        if question is None or not all(isinstance(c, str) for c in contents):
+            return
+        answer = "".join(contents)
+        if answer:
+            self.answer_cache.put(question, answer)
+
+    def _cached_turn(self, question, contents):
+        answer = "".join(c for c in contents if isinstance(c, str))
+        return {"messages": [HumanMessage(question), AIMessage(answer)]}
+
+    def stream_complete(self, messages, thread_id=None, trace_id=None, admit=None):
+        """
+        Stream the answer's message chunks, after an empty one that comes as
+        soon as the request is admitted. `admit`, if given, is called before
+        a graph run starts, but not for answers replayed from the cache or
+        fanned out from an identical question in flight. It may raise to turn
+        the request away, or returns a function to call once the run ends.
+        Callers that admit can prime the stream with `next` to see a refusal
+        before they respond.
+        """
+        chunks = self._stream_complete(messages, thread_id, admit)
+        try:
+            yield next(chunks)
+            with RequestTrace(trace_id, thread_id) as trace:
+                for message in chunks:
+                    trace.token(message.content)
+                    yield message
+        finally:
+            chunks.close()
+
+    async def astream_complete(self, messages, thread_id=None, trace_id=None, admit=None):
+        """`stream_complete` from the async graph; `admit` is a coroutine function."""
+        chunks = self._astream_complete(messages, thread_id, admit)
+        try:
+            yield await anext(chunks)
+            with RequestTrace(trace_id, thread_id) as trace:
+                async for message in chunks:
+                    trace.token(message.content)
+                    yield message
+        finally:
+            await chunks.aclose()
+
+    def _graph_stream(self, graph, messages, config, question):
+        contents = []
+        with self._run():
+            for chunk in graph.stream(
+                {"messages": messages}, config, stream_mode=["messages"]
+            ):
+                _, (message, metadata) = chunk
+                if metadata["langgraph_node"] in ["query_or_respond", "generate"]:
+                    contents.append(message.content)
+                    yield message
+        self._store_answer(question, contents)
+
+    async def _agraph_stream(self, graph, messages, config, question):
+        contents = []
+        with self._run():
+            async for chunk in graph.astream(
+                {"messages": messages}, config, stream_mode=["messages"]
+            ):
+                _, (message, metadata) = chunk
+                if metadata["langgraph_node"] in ["query_or_respond", "generate"]:
+                    contents.append(message.content)
+                    yield message
+        self._store_answer(question, contents)
+
+    def _stream_complete(self, messages, thread_id=None, admit=None):
+        graph, config = self._graph(thread_id)
+        question = self._question(messages)
+        if question is not None and config and graph.get_state(config).values:
+            question = None  # not the first turn of the session
+        if question is None:
+            release = admit() if admit is not None else None
+            try:
+                yield AIMessageChunk(content="")
+                yield from self._graph_stream(graph, messages, config, None)
+            finally:
+                if release is not None:
+                    release()
+            return
+
+        # A first-turn question is answered from the answer cache, or from
+        # one graph run shared by everyone asking it at the same time.
+        answer = self.answer_cache.get(question)
+        release = None
+        if answer is not None:
+            stream = self._replay(answer)
+        elif self.streams is not None:
+            stream = self.streams.stream(
+                ("sync", normalize_query(question)),
+                lambda: self._graph_stream(self.graph, messages, None, question),
+                admit,
+            )
+        else:
+            release = admit() if admit is not None else None
+            stream = self._graph_stream(graph, messages, config, question)
+            config = None  # the graph records the session itself
+        try:
+            yield AIMessageChunk(content="")
+            contents = []
+            for message in stream:
+                contents.append(message.content)
                 yield message
+        finally:
+            stream.close()
+            if release is not None:
+                release()
+        if config:
+            graph.update_state(
+                config, self._cached_turn(question, contents), as_node="generate"
+            )
+
+    async def _astream_complete(self, messages, thread_id=None, admit=None):
+        graph, config = self._graph(thread_id)
+        question = self._question(messages)
+        if question is not None and config and (await graph.aget_state(config)).values:
+            question = None  # not the first turn of the session
+        if question is None:
+            release = await admit() if admit is not None else None
+            try:
+                yield AIMessageChunk(content="")
+                async for message in self._agraph_stream(graph, messages, config, None):
+                    yield message
+            finally:
+                if release is not None:
+                    release()
+            return
+
+        answer = self.answer_cache.get(question)
+        release = None
+        if answer is not None:
+            stream = self._areplay(answer)
+        elif self.streams is not None:
+            stream = await self.streams.astream(
+                ("async", normalize_query(question)),
+                lambda: self._agraph_stream(self.graph, messages, None, question),
+                admit,
+            )
+        else:
+            release = await admit() if admit is not None else None
+            stream = self._agraph_stream(graph, messages, config, question)
+            config = None  # the graph records the session itself
+        try:
+            yield AIMessageChunk(content="")
+            contents = []
+            async for message in stream:
+                contents.append(message.content)
+                yield message
+        finally:
+            await stream.aclose()
+            if release is not None:
+                release()
+        if config:
+            await graph.aupdate_state(
+                config, self._cached_turn(question, contents), as_node="generate"
+            )
+
+    async def _complete_one(self, index, messages):
+        start = time.perf_counter()
+        result = {"index": index}
+        try:
+            question = self._question(messages)
+            answer = self.answer_cache.get(question) if question is not None else None
+            result["cached"] = answer is not None
+            if answer is None:
+                with self._run():
+                    final_state = await self.graph.ainvoke({"messages": messages})
+                answer = final_state["messages"][-1].content
+                self._store_answer(question, [answer])
+            result["answer"] = answer
+        except Exception as e:
+            result["error"] = str(e)
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        return result
+
+    async def abatch_complete(self, conversations, concurrency=8):
+        """
+        Answer each conversation (a list of messages, like `messages` of
+        `stream_complete`) with at most `concurrency` running at once. Yields
+        {"index", "answer" or "error", "cached", "seconds"} per conversation
+        as it finishes. Retrieval queries are sent to the retriever in
+        batches (see `llm.batch`), and answers to single questions go into
+        the answer cache.
+        """
+        batcher = QueryBatcher(self.retriever.search_batch, max_size=concurrency)
+        token = _batcher.set(batcher)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(index, messages):
+            async with semaphore:
+                return await self._complete_one(index, messages)
+
+        tasks = [
+            asyncio.ensure_future(run(i, messages))
+            for i, messages in enumerate(conversations)
+        ]
+        _batcher.reset(token)
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+            print(
+                f"Batch of {len(conversations)} conversations searched in "
+                f"{batcher.batches} batches of {batcher.queries} queries."
+            )
+
+    def _loop(self):
+        """An event loop on a background thread, for sync batch runs."""
+        with self._batch_loop_lock:
+            if self._batch_loop is None:
+                self._batch_loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._batch_loop.run_forever, name="batch", daemon=True
+                ).start()
+        return self._batch_loop
+
+    def batch_complete(self, conversations, concurrency=8):
+        """`abatch_complete` for sync callers, run on a background event loop."""
+        results = queue.Queue()
+
+        async def run():
+            try:
+                async for result in self.abatch_complete(conversations, concurrency):
+                    results.put(result)
+            finally:
+                results.put(None)
+
+        future = asyncio.run_coroutine_threadsafe(run(), self._loop())
+        try:
+            while (result := results.get()) is not None:
+                yield result
+        finally:
+            future.cancel()
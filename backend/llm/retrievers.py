@@ -0,0 +1,388 @@
+"""
+Retriever backends for CourseRAG.
+
+Both backends return langchain `Document`s shaped like the ones
+`QdrantVectorStore` returns: the point payload's "metadata" plus its "_id",
+"_collection_name" and the search "_score".
+"""
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from langchain_core.documents import Document
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
+from llm.collection import SEARCH_PARAMS, data_version
+from llm.snapshot import load_snapshot
+import asyncio
+import numpy as np
+import os
+import time
+
+
+def point_to_document(point_id, payload, score, collection_name):
+    metadata = dict(payload.get("metadata") or {})
+    metadata["_id"] = point_id
+    metadata["_collection_name"] = collection_name
+    metadata["_score"] = score
+    return Document(page_content=payload.get("text", ""), metadata=metadata)
+
+
+def doc_id_of(doc):
+    return doc.metadata.get("doc_id", doc.metadata["_id"])
+
+
+def unique_docs(docs):
+    """Drop documents whose doc_id (or point id) was already seen."""
+    seen = set()
+    unique = []
+    for doc in docs:
+        doc_id = doc_id_of(doc)
+        if doc_id not in seen:
+            seen.add(doc_id)
+            unique.append(doc)
+    return unique
+
+
+def reciprocal_rank_fusion(result_lists, k, rrf_k=60):
+    """
+    Merge ranked result lists, scoring each point by the sum of
+    1 / (rrf_k + rank) over the lists it appears in.
+    """
+    scores, docs = {}, {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            point_id = doc.metadata["_id"]
+            scores[point_id] = scores.get(point_id, 0.0) + 1 / (rrf_k + rank)
+            docs.setdefault(point_id, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [
+        Document(
+            page_content=docs[point_id].page_content,
+            metadata={**docs[point_id].metadata, "_score": scores[point_id]},
+        )
+        for point_id in ranked
+    ]
+
+
+def embed_sparse_queries(sparse_embeddings, queries):
+    """Sparse embeddings of `queries`, in one batch when the model allows it."""
+    model = getattr(sparse_embeddings, "_model", None)
+    if model is None:
+        embeddings = [sparse_embeddings.embed_query(query) for query in queries]
+    else:
+        embeddings = model.query_embed(queries)
+    return [
+        models.SparseVector(
+            indices=[int(i) for i in e.indices], values=[float(v) for v in e.values]
+        )
+        for e in embeddings
+    ]
+
+
+def embed_dense_queries(embeddings, queries):
+    """Dense embeddings of `queries` in one batched call."""
+    return embeddings.embed_documents(queries, task_type="retrieval_query")
+
+
+class Retriever:
+    """
+    Base class of the retriever backends, which implement `_search` and
+    `_asearch` for the "sparse" and "dense" modes.
+
+    In "fused" mode both searches are issued concurrently and merged with
+    reciprocal-rank fusion. Dense search needs a remote embedding call, so if
+    it hasn't finished within `latency_budget` seconds of the request (or
+    fails), the sparse results are returned alone.
+    """
+
+    def __init__(self, mode="sparse", latency_budget=1.0):
+        if mode not in ("sparse", "dense", "fused"):
+            raise Exception("invalid retrieval mode")
+        self.mode = mode
+        self.latency_budget = latency_budget
+        self.dense_fallbacks = 0
+        self._executor = ThreadPoolExecutor(max_workers=16)
+
+    def search(self, query: str, k: int = 8):
+        if self.mode != "fused":
+            return self._search(query, k, self.mode)
+
+        deadline = time.monotonic() + self.latency_budget
+        dense = self._executor.submit(self._search, query, k, "dense")
+        sparse = self._search(query, k, "sparse")
+        try:
+            dense_docs = dense.result(timeout=max(0, deadline - time.monotonic()))
+        except Exception as e:
+            self._fall_back(e)
+            return sparse
+        return reciprocal_rank_fusion([sparse, dense_docs], k)
+
+    async def asearch(self, query: str, k: int = 8):
+        if self.mode != "fused":
+            return await self._asearch(query, k, self.mode)
+
+        deadline = time.monotonic() + self.latency_budget
+        dense = asyncio.ensure_future(self._asearch(query, k, "dense"))
+        try:
+            sparse = await self._asearch(query, k, "sparse")
+        except BaseException:
+            dense.cancel()
+            raise
+        try:
+            dense_docs = await asyncio.wait_for(
+                dense, timeout=max(0, deadline - time.monotonic())
+            )
+        except Exception as e:
+            self._fall_back(e)
+            return sparse
+        return reciprocal_rank_fusion([sparse, dense_docs], k)
+
+    def search_batch(self, queries, k: int = 8):
+        """
+        The results of `search` for each of `queries`, embedding and
+        searching them in batches. Meant for offline batch runs, so fused
+        search waits for dense results instead of using the latency budget.
+        """
+        if self.mode != "fused":
+            return self._search_batch(queries, k, self.mode)
+        sparse = self._search_batch(queries, k, "sparse")
+        dense = self._search_batch(queries, k, "dense")
+        return [reciprocal_rank_fusion(pair, k) for pair in zip(sparse, dense)]
+
+    def _search_batch(self, queries, k: int, mode: str):
+        return [self._search(query, k, mode) for query in queries]
+
+    def _fall_back(self, error):
+        self.dense_fallbacks += 1
+        if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+            print("Dense retrieval missed the latency budget, using sparse results.")
+        else:
+            print(f"Dense retrieval failed ({error}), using sparse results.")
+
+    def stats(self):
+        return {"mode": self.mode, "dense_fallbacks": self.dense_fallbacks}
+
+
+class QdrantRetriever(Retriever):
+    """
+    Searches the hosted Qdrant collection. Dense searches run on the int8
+    quantized vectors and rescore with the originals (see llm.collection).
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        sparse_embeddings,
+        collection_name="coursebot_hybrid",
+        mode="sparse",
+        latency_budget=1.0,
+    ):
+        super().__init__(mode, latency_budget)
+        self.embeddings = embeddings
+        self.sparse_embeddings = sparse_embeddings
+        self.collection_name = collection_name
+        self.client = QdrantClient(
+            url=os.environ["QDRANT_URL"], api_key=os.environ["QDRANT_API_KEY"]
+        )
+        self.async_client = AsyncQdrantClient(
+            url=os.environ["QDRANT_URL"], api_key=os.environ["QDRANT_API_KEY"]
+        )
+
+    def _sparse_query(self, query: str):
+        embedding = self.sparse_embeddings.embed_query(query)
+        return {
+            "query": models.SparseVector(
+                indices=embedding.indices, values=embedding.values
+            ),
+            "using": "sparse_vector",
+        }
+
+    def _documents(self, response):
+        return [
+            point_to_document(
+                point.id, point.payload, point.score, self.collection_name
+            )
+            for point in response.points
+        ]
+
+    def _search(self, query: str, k: int, mode: str):
+        if mode == "dense":
+            query_options = {
+                "query": self.embeddings.embed_query(query),
+                "using": "dense_vector",
+                "search_params": SEARCH_PARAMS,
+            }
+        else:
+            query_options = self._sparse_query(query)
+        response = self.client.query_points(
+            collection_name=self.collection_name,
+            limit=k,
+            with_payload=True,
+            **query_options,
+        )
+        return self._documents(response)
+
+    async def _asearch(self, query: str, k: int, mode: str):
+        if mode == "dense":
+            query_options = {
+                "query": await self.embeddings.aembed_query(query),
+                "using": "dense_vector",
+                "search_params": SEARCH_PARAMS,
+            }
+        else:
+            query_options = self._sparse_query(query)
+        response = await self.async_client.query_points(
+            collection_name=self.collection_name,
+            limit=k,
+            with_payload=True,
+            **query_options,
+        )
+        return self._documents(response)
+
+    def _search_batch(self, queries, k: int, mode: str):
+        if mode == "dense":
+            vectors = embed_dense_queries(self.embeddings, queries)
+            using, params = "dense_vector", SEARCH_PARAMS
+        else:
+            vectors = embed_sparse_queries(self.sparse_embeddings, queries)
+            using, params = "sparse_vector", None
+        responses = self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=[
+                models.QueryRequest(
+                    query=vector, using=using, params=params, limit=k, with_payload=True
+                )
+                for vector in vectors
+            ],
+        )
+        return [self._documents(response) for response in responses]
+
+    def version(self):
+        marker = data_version(self.client, self.collection_name)
+        if marker is not None:
+            return f"{self.collection_name}:{marker}"
+        # Collections last written before ingest kept a data version.
+        info = self.client.get_collection(self.collection_name)
+        return f"{self.collection_name}:{info.points_count}"
+
+
+class LocalRetriever(Retriever):
+    """
+    Searches a snapshot of the collection (see `llm.snapshot`) in process.
+
+    Dense vectors stay memory-mapped and are scored with matrix-vector
+    products, int8 ones `block_rows` rows at a time. Sparse vectors are
+    inverted into per-term posting lists, so a query only touches the
+    postings of its own terms. Scores match Qdrant's: cosine similarity for
+    dense and dot product for sparse vectors.
+    """
+
+    def __init__(
+        self,
+        path,
+        embeddings,
+        sparse_embeddings,
+        mode="sparse",
+        latency_budget=1.0,
+        block_rows=4096,
+    ):
+        super().__init__(mode, latency_budget)
+        self.embeddings = embeddings
+        self.sparse_embeddings = sparse_embeddings
+        self.block_rows = block_rows
+        self.snapshot = load_snapshot(path)
+        self.collection_name = self.snapshot.manifest["collection"]
+
+        snapshot = self.snapshot
+        rows = np.repeat(
+            np.arange(len(snapshot), dtype=np.int32), np.diff(snapshot.indptr)
+        )
+        order = np.argsort(snapshot.indices, kind="stable")
+        terms = snapshot.indices[order]
+        self.posting_docs = rows[order]
+        self.posting_values = snapshot.values[order]
+        self.terms, self.term_starts = np.unique(terms, return_index=True)
+        self.term_ends = np.append(self.term_starts[1:], len(terms))
+
+    def sparse_scores(self, indices, values):
+        if len(self.terms) == 0:
+            return np.zeros(len(self.snapshot), dtype=np.float32)
+        indices = np.asarray(indices, dtype=self.terms.dtype)
+        positions = np.searchsorted(self.terms, indices)
+        positions = np.minimum(positions, len(self.terms) - 1)
+        found = self.terms[positions] == indices
+        docs, weights = [], []
+        for position, value in zip(positions[found], np.asarray(values)[found]):
+            start, end = self.term_starts[position], self.term_ends[position]
+            docs.append(self.posting_docs[start:end])
+            weights.append(self.posting_values[start:end] * value)
+        if not docs:
+            return np.zeros(len(self.snapshot), dtype=np.float32)
+        return np.bincount(
+            np.concatenate(docs),
+            weights=np.concatenate(weights),
+            minlength=len(self.snapshot),
+        )
+
+    def dense_scores(self, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1
+        dense = self.snapshot.dense
+        if self.snapshot.dense_scale is None:
+            return dense @ vector
+        # int8 rows are upcast a block at a time: casting the whole matrix
+        # per query would allocate a float32 copy of it.
+        scores = np.empty(len(dense), dtype=np.float32)
+        for start in range(0, len(dense), self.block_rows):
+            block = dense[start : start + self.block_rows]
+            np.matmul(
+                block.astype(np.float32), vector, out=scores[start : start + len(block)]
+            )
+        return scores * self.snapshot.dense_scale
+
+    def top_k(self, scores, k, mode):
+        if mode == "sparse":
+            # Like Qdrant, only return points sharing a term with the query.
+            candidates = np.flatnonzero(scores > 0)
+        else:
+            candidates = np.arange(len(scores))
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [
+            point_to_document(
+                self.snapshot.ids[i],
+                self.snapshot.payloads[i],
+                float(scores[i]),
+                self.collection_name,
+            )
+            for i in candidates
+        ]
+
+    def _search(self, query: str, k: int, mode: str):
+        if mode == "dense":
+            scores = self.dense_scores(self.embeddings.embed_query(query))
+        else:
+            embedding = self.sparse_embeddings.embed_query(query)
+            scores = self.sparse_scores(embedding.indices, embedding.values)
+        return self.top_k(scores, k, mode)
+
+    def _search_batch(self, queries, k: int, mode: str):
+        if mode == "dense":
+            vectors = embed_dense_queries(self.embeddings, queries)
+            return [self.top_k(self.dense_scores(v), k, mode) for v in vectors]
+        embeddings = embed_sparse_queries(self.sparse_embeddings, queries)
+        return [
+            self.top_k(self.sparse_scores(e.indices, e.values), k, mode)
+            for e in embeddings
+        ]
+
+    async def _asearch(self, query: str, k: int, mode: str):
+        # Only the dense query embedding leaves the process; scoring the
+        # snapshot itself is cheap enough to run on the event loop.
+        if mode == "dense":
+            scores = self.dense_scores(await self.embeddings.aembed_query(query))
+            return self.top_k(scores, k, mode)
+        return self._search(query, k, mode)
+
+    def version(self):
+        manifest = self.snapshot.manifest
+        return f"{self.collection_name}:{manifest['points']}:{manifest['created']}"
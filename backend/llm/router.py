@@ -0,0 +1,109 @@
+"""
+Cheap local routing of user turns.
+
+Most questions obviously need retrieval: they name a course code, a
+professor, a TQFR or a requirement. For those, `Router.route` returns
+"retrieve" and the graph calls the retrieve tool directly with the user's
+message, skipping the tool-calling LLM round trip. Anything else returns
+"llm" and goes through `query_or_respond` as before, and so do ranking and
+aggregate questions, which the LLM may answer with the TQFR stats tool.
+"""
+
+import re
+import threading
+
+# Caltech option/department prefixes as they appear in course codes.
+DEPARTMENTS = (
+    "ACM AE AM APh Art Ay BE BEM Bi BMB CDS CE Ch ChE CMS CNS CS Ec ED EE "
+    "En ENG ESE EST F FS Ge H HPS Hum IDS L Law Ma MedE ME MS Mu PA PE Ph Pl "
+    "PS Psy SA SEC SS VC Wr"
+).split()
+
+# Prefixes that are also English words in lowercase ("tell me 3 things",
+# "I am 5 units short"); these only count as written in the catalog or in
+# capitals.
+WORD_DEPARTMENTS = {
+    "am", "art", "be", "ed", "en", "f", "h", "l", "law", "me", "pa", "pe", "ps"
+}
+
+
+def _spellings(department):
+    spellings = {department, department.upper()}
+    if department.lower() not in WORD_DEPARTMENTS:
+        spellings |= {department.lower(), department.capitalize()}
+    return spellings
+
+
+DEPARTMENT = "|".join(
+    sorted({s for d in DEPARTMENTS for s in _spellings(d)}, key=len, reverse=True)
+)
+
+# e.g. "CS 156b", "ma1a", "ACM/IDS 104", "Ph 12 abc", but not "me 3"
+COURSE_CODE = re.compile(
+    r"\b((?:%s)(?:\s*/\s*(?:%s))*)\s*(\d{1,3})\s*([a-fA-F]{0,3})\b"
+    % (DEPARTMENT, DEPARTMENT)
+)
+
+RETRIEVAL_KEYWORDS = re.compile(
+    r"\b(tqfrs?|professors?|prof|instructors?|lecturers?|teach(es|ing)?|taught|"
+    r"requirements?|prereq(uisite)?s?|units?|options?|majors?|minors?|core|"
+    r"workload|grading|homework|psets?|exams?|courses?|class(es)?|catalog|"
+    r"offered|electives?|reviews?|feedback)\b",
+    re.IGNORECASE,
+)
+
+# Turns the system prompt has the LLM answer without any retrieval.
+LLM_ONLY = re.compile(
+    r"\b(code|script|program|python|javascript|function|implement)\b", re.IGNORECASE
+)
+
+
+# Ranking and aggregate questions, e.g. "highest-rated CS electives".
+RANKING = re.compile(
+    r"\b(highest|lowest|best|worst|top|easiest|hardest|least|most|rank(s|ed|ing)?|"
+    r"ratings?|average|compare)\b",
+    re.IGNORECASE,
+)
+
+
+def course_codes(text: str):
+    """Course codes mentioned in `text`, normalized like "cs/ids 156b"."""
+    codes = []
+    for departments, number, suffix in COURSE_CODE.findall(text):
+        departments = "/".join(d.strip().lower() for d in departments.split("/"))
+        codes.append(f"{departments} {number}{suffix.lower()}")
+    return codes
+
+
+class Router:
+    """
+    `classifier`, if given, is called with the message when no rule
+    matches and should return the probability that it needs retrieval
+    (e.g. a small local text classifier); turns scoring at least
+    `threshold` are also sent straight to retrieval.
+    """
+
+    def __init__(self, classifier=None, threshold=0.8):
+        self.classifier = classifier
+        self.threshold = threshold
+        self.counts = {"retrieve": 0, "llm": 0}
+        self._lock = threading.Lock()
+
+    def _route(self, message: str):
+        if not message.strip() or LLM_ONLY.search(message) or RANKING.search(message):
+            return "llm"
+        if course_codes(message) or RETRIEVAL_KEYWORDS.search(message):
+            return "retrieve"
+        if self.classifier is not None and self.classifier(message) >= self.threshold:
+            return "retrieve"
+        return "llm"
+
+    def route(self, message: str):
+        """"retrieve" if `message` obviously needs retrieval, else "llm"."""
+        route = self._route(message)
+        with self._lock:
+            self.counts[route] += 1
+        return route
+
+    def stats(self):
+        return dict(self.counts)
@@ -0,0 +1,162 @@
+"""
+Server-side conversation sessions.
+
+With a thread id, CourseRAG keeps the conversation in a LangGraph
+checkpointer and the client only sends each new message. Retrieval
+messages of earlier turns are dropped from the state, and once the rest of
+the history passes a token threshold its older turns are folded into a
+running summary, so the cost of a turn stays flat as the conversation grows.
+
+Without SESSION_DB, sessions live in the memory of each worker process: they
+expire after SESSION_TTL seconds without a turn, the least recently used go
+past SESSION_MAX_THREADS, and a multi-worker server needs SESSION_DB so that
+every turn of a session finds it.
+"""
+
+from collections import OrderedDict
+from langchain_core.messages import RemoveMessage
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import MessagesState
+from llm.packer import estimate_tokens
+import os
+import threading
+import time
+import uuid
+
+
+class ChatState(MessagesState):
+    summary: str
+
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    A MemorySaver that forgets the sessions not used for `ttl` seconds, and
+    the least recently used ones past `max_threads`.
+    """
+
+    def __init__(self, max_threads=10000, ttl=24 * 3600):
+        super().__init__()
+        self.max_threads = max_threads
+        self.ttl = ttl
+        self._last_used = OrderedDict()
+        self._evicted = 0
+        self._lock = threading.Lock()
+
+    def _touch(self, config):
+        thread_id = config["configurable"].get("thread_id")
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            if thread_id is not None:
+                self._last_used[thread_id] = now
+                self._last_used.move_to_end(thread_id)
+            while self._last_used:
+                oldest, used = next(iter(self._last_used.items()))
+                if len(self._last_used) <= self.max_threads and now - used < self.ttl:
+                    break
+                self._last_used.popitem(last=False)
+                expired.append(oldest)
+            self._evicted += len(expired)
+        if expired:
+            self.forget(expired)
+
+    def forget(self, thread_ids):
+        """Drop the checkpoints and pending writes of `thread_ids`."""
+        thread_ids = set(thread_ids)
+        for thread_id in thread_ids:
+            self.storage.pop(thread_id, None)
+        for key in [key for key in list(self.writes) if key[0] in thread_ids]:
+            self.writes.pop(key, None)
+
+    def stats(self):
+        return {"sessions": len(self._last_used), "evicted": self._evicted}
+
+    def get_tuple(self, config):
+        self._touch(config)
+        return super().get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        self._touch(config)
+        return super().put(config, checkpoint, metadata, new_versions)
+
+
+def make_checkpointer(path=None, use_async=False):
+    """
+    An in-memory checkpointer, or a SQLite one at `path` (which needs the
+    langgraph-checkpoint-sqlite package). `use_async` picks the SQLite
+    saver that works with the async graph.
+    """
+    if not path:
+        if int(os.environ.get("WEB_CONCURRENCY", 1)) > 1:
+            print(
+                "Sessions are kept in memory but WEB_CONCURRENCY > 1: set "
+                "SESSION_DB, or turns of a session that reach another worker "
+                "start over."
+            )
+        return BoundedMemorySaver(
+            max_threads=int(os.environ.get("SESSION_MAX_THREADS", 10000)),
+            ttl=float(os.environ.get("SESSION_TTL", 24 * 3600)),
+        )
+    if use_async:
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+        import aiosqlite
+
+        return AsyncSqliteSaver(aiosqlite.connect(path))
+    from langgraph.checkpoint.sqlite import SqliteSaver
+    import sqlite3
+
+    return SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+
+
+def is_retrieval_message(message):
+    return message.type == "tool" or (message.type == "ai" and message.tool_calls)
+
+
+def message_tokens(message):
+    content = message.content
+    return estimate_tokens(content if isinstance(content, str) else str(content))
+
+
+def plan_compaction(messages, max_tokens=3000, keep=4):
+    """
+    Messages to remove from the state before a new turn, and the older
+    conversation messages among them that should be folded into the summary.
+
+    Retrieval messages from earlier turns are always removed. Once the
+    conversation passes `max_tokens`, everything but its last `keep`
+    messages (or fewer, so that the kept ones start with a user message) is
+    compacted.
+    """
+    *history, new = messages
+    stale = [m for m in history if is_retrieval_message(m)]
+    conversation = [m for m in history if not is_retrieval_message(m)] + [new]
+    compacted = []
+    if sum(message_tokens(m) for m in conversation) > max_tokens:
+        # Cut before a user message so the kept history starts with one.
+        cut = max(0, len(conversation) - keep)
+        while cut < len(conversation) - 1 and conversation[cut].type != "human":
+            cut += 1
+        compacted = conversation[:cut]
+    removals = [RemoveMessage(id=m.id) for m in stale + compacted if m.id]
+    return removals, compacted
+
+
+def parse_query(input_data):
+    """
+    (messages, thread_id) of a /api/query body, or None if it is invalid.
+
+    The body is either {"messages": [...]} with the whole conversation, or
+    {"message": {...}, "thread_id": ...} with only the new message of a
+    session; a new session id is made when "thread_id" is missing.
+    """
+    if not isinstance(input_data, dict):
+        return None
+    if "message" in input_data:
+        message = input_data["message"]
+        if isinstance(message, str):
+            message = {"role": "user", "content": message}
+        thread_id = str(input_data.get("thread_id") or uuid.uuid4())
+        return [message], thread_id
+    if "messages" in input_data:
+        return input_data["messages"], None
+    return None
@@ -0,0 +1,150 @@
+"""
+On-disk snapshot of the vector collection.
+
+A snapshot is a directory holding
+    manifest.json        collection name and config, point count, embedding
+                         models, dtype
+    ids.json             point ids, in row order
+    dense.npy            dense vectors, L2-normalized, float32 or int8
+    dense_scale.npy      per-row scale of int8 dense vectors
+    sparse_indptr.npy    sparse vectors as CSR arrays
+    sparse_indices.npy
+    sparse_values.npy
+    payloads.jsonl.gz    point payloads, one JSON object per line (snapshots
+                         from before compression have payloads.jsonl)
+    docs.jsonl.gz        document bodies (see `llm.docstore`), if exported
+"""
+
+from datetime import datetime, timezone
+import gzip
+import json
+import numpy as np
+import os
+
+
+class Snapshot:
+    def __init__(self, manifest, ids, dense, dense_scale, indptr, indices, values, payloads):
+        self.manifest = manifest
+        self.ids = ids
+        self.dense = dense
+        self.dense_scale = dense_scale
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values
+        self.payloads = payloads
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def write_snapshot(path, points, manifest, int8=False, docs=None):
+    """
+    Write `points`, an iterable of (id, dense vector, sparse indices, sparse
+    values, payload) tuples, and `docs`, an iterable of doc store payloads,
+    to the snapshot directory `path`.
+    """
+    os.makedirs(path, exist_ok=True)
+    ids, dense, indptr, indices, values = [], [], [0], [], []
+    with gzip.open(os.path.join(path, "payloads.jsonl.gz"), "wt") as f:
+        for point_id, dense_vector, sparse_indices, sparse_values, payload in points:
+            ids.append(point_id)
+            dense.append(np.asarray(dense_vector, dtype=np.float32))
+            indices.append(np.asarray(sparse_indices, dtype=np.uint32))
+            values.append(np.asarray(sparse_values, dtype=np.float32))
+            indptr.append(indptr[-1] + len(sparse_indices))
+            f.write(json.dumps(payload) + "\n")
+
+    dense = np.stack(dense) if dense else np.zeros((0, 0), dtype=np.float32)
+    norms = np.linalg.norm(dense, axis=1, keepdims=True)
+    dense /= np.where(norms == 0, 1, norms)
+    if int8:
+        scale = np.abs(dense).max(axis=1) / 127
+        scale[scale == 0] = 1
+        np.save(os.path.join(path, "dense_scale.npy"), scale.astype(np.float32))
+        dense = np.round(dense / scale[:, None]).astype(np.int8)
+    np.save(os.path.join(path, "dense.npy"), dense)
+    np.save(os.path.join(path, "sparse_indptr.npy"), np.asarray(indptr, dtype=np.int64))
+    np.save(
+        os.path.join(path, "sparse_indices.npy"),
+        np.concatenate(indices) if indices else np.zeros(0, dtype=np.uint32),
+    )
+    np.save(
+        os.path.join(path, "sparse_values.npy"),
+        np.concatenate(values) if values else np.zeros(0, dtype=np.float32),
+    )
+    with open(os.path.join(path, "ids.json"), "w") as f:
+        json.dump(ids, f)
+    if docs is not None:
+        with gzip.open(os.path.join(path, "docs.jsonl.gz"), "wt") as f:
+            for doc in docs:
+                f.write(json.dumps(doc) + "\n")
+
+    manifest = {
+        **manifest,
+        "points": len(ids),
+        "dense_dtype": "int8" if int8 else "float32",
+        "created": datetime.now(timezone.utc).isoformat(),
+    }
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_snapshot(path, mmap=True):
+    """Load a snapshot, memory-mapping the dense vectors by default."""
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    with open(os.path.join(path, "ids.json")) as f:
+        ids = json.load(f)
+    payloads_path = os.path.join(path, "payloads.jsonl.gz")
+    if os.path.exists(payloads_path):
+        with gzip.open(payloads_path, "rt") as f:
+            payloads = [json.loads(line) for line in f]
+    else:
+        with open(os.path.join(path, "payloads.jsonl")) as f:
+            payloads = [json.loads(line) for line in f]
+
+    dense = np.load(os.path.join(path, "dense.npy"), mmap_mode="r" if mmap else None)
+    dense_scale = None
+    if manifest["dense_dtype"] == "int8":
+        dense_scale = np.load(os.path.join(path, "dense_scale.npy"))
+    return Snapshot(
+        manifest,
+        ids,
+        dense,
+        dense_scale,
+        np.load(os.path.join(path, "sparse_indptr.npy")),
+        np.load(os.path.join(path, "sparse_indices.npy")),
+        np.load(os.path.join(path, "sparse_values.npy")),
+        payloads,
+    )
+
+
+def iter_points(snapshot, start=0, stop=None):
+    """
+    The snapshot's points as (id, dense vector, sparse indices, sparse
+    values, payload) tuples, with int8 dense vectors scaled back to float.
+    """
+    stop = len(snapshot) if stop is None else min(stop, len(snapshot))
+    for row in range(start, stop):
+        dense = np.asarray(snapshot.dense[row], dtype=np.float32)
+        if snapshot.dense_scale is not None:
+            dense = dense * snapshot.dense_scale[row]
+        begin, end = snapshot.indptr[row], snapshot.indptr[row + 1]
+        yield (
+            snapshot.ids[row],
+            dense,
+            snapshot.indices[begin:end],
+            snapshot.values[begin:end],
+            snapshot.payloads[row],
+        )
+
+
+def iter_docs(path):
+    """The doc store payloads of a snapshot, if it has any."""
+    docs_path = os.path.join(path, "docs.jsonl.gz")
+    if not os.path.exists(docs_path):
+        return
+    with gzip.open(docs_path, "rt") as f:
+        for line in f:
+            yield json.loads(line)
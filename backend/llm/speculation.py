@@ -0,0 +1,231 @@
+"""
+Speculative retrieval for turns that go through the tool-calling LLM.
+
+While `query_or_respond` waits for the LLM to decide on a `retrieve` call,
+documents for a guess of its query are already being fetched: the user's
+message, prefixed with their previous one for short follow-ups such as "what
+about its workload?". If the LLM then calls `retrieve` with a query close
+enough to the guess, the tool call takes the speculative documents instead
+of searching again. Otherwise, or if the LLM call or the whole run is
+aborted first, the guess is cancelled; a search already running on a worker
+thread still finishes and warms the retrieval cache. Only guesses a tool
+call takes are passed to `record`, so retrieval metrics and traces leave
+out the rest.
+
+A guess is close enough when it contains at least SPECULATION_MIN_OVERLAP
+(default 0.5) of the LLM query's words and every course code it names.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from llm.cache import LRUCache, normalize_query
+from llm.metrics import SPECULATION_SAVED_SECONDS, SPECULATIONS, trace_event
+from llm.router import LLM_ONLY, course_codes
+import asyncio
+import contextvars
+import os
+import threading
+import time
+
+STOP_WORDS = frozenset(
+    "a about an and any are at be can do does for from how i in is it me my of "
+    "on or tell the to what which who with you".split()
+)
+# Messages shorter than this are guessed together with the previous one.
+FOLLOW_UP_WORDS = 6
+
+# The claims made during the current graph run (see `Speculator.run`).
+_run_claims = ContextVar("coursebot_speculation_claims", default=None)
+
+
+def words(query: str):
+    return set(normalize_query(query).split()) - STOP_WORDS
+
+
+def overlap(guess: str, query: str) -> float:
+    """Share of the words of `query` that are in `guess`."""
+    if not set(course_codes(query)) <= set(course_codes(guess)):
+        return 0.0
+    query_words = words(query)
+    if not query_words:
+        return 0.0
+    return len(query_words & words(guess)) / len(query_words)
+
+
+def guess_query(messages):
+    """The query the LLM will likely retrieve for, or None to not guess."""
+    if not messages or messages[-1].type != "human":
+        return None
+    human = [m.content for m in messages if m.type == "human"]
+    if not all(isinstance(content, str) for content in human[-2:]):
+        return None
+    query = human[-1].strip()
+    if not query or LLM_ONLY.search(query):
+        return None
+    if len(query.split()) < FOLLOW_UP_WORDS and len(human) > 1:
+        query = f"{human[-2].strip()} {query}"
+    return query
+
+
+class Speculation:
+    """A retrieval for `query` running as `result` (a future or a task)."""
+
+    def __init__(self, query, result):
+        self.query = query
+        self.result = result
+        self.start = time.perf_counter()
+        self.end = None
+        result.add_done_callback(self._done)
+
+    def _done(self, result):
+        self.end = time.perf_counter()
+        if not result.cancelled():
+            result.exception()  # a failed guess is only logged by its taker
+
+    def seconds(self):
+        """Seconds the retrieval took, or has taken so far."""
+        return (self.end or time.perf_counter()) - self.start
+
+    def saved(self, needed_at):
+        """Seconds of the retrieval that ran before the tool call needed it."""
+        end = self.end or time.perf_counter()
+        return max(0.0, min(end, needed_at) - self.start)
+
+
+class Speculator:
+    """
+    `record`, if given, is called with the query, documents and seconds of
+    each speculative retrieval a tool call takes.
+    """
+
+    def __init__(self, min_overlap=None, max_workers=8, record=None):
+        self.record = record
+        self.min_overlap = min_overlap or float(
+            os.environ.get("SPECULATION_MIN_OVERLAP", 0.5)
+        )
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="speculate")
+        # (tool call id, query) -> the speculation that call takes. Claims are
+        # taken by the tools node right after; `run` releases those of a run
+        # cancelled in between, and the TTL those made outside of one.
+        self._claims = LRUCache(max_size=1024, ttl=60)
+        self.counts = {"hit": 0, "miss": 0, "unused": 0}
+        self.saved_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def start(self, query, fetch):
+        """Run `fetch(query)` on a worker thread, in the caller's context."""
+        context = contextvars.copy_context()
+        return Speculation(query, self._pool.submit(context.run, fetch, query))
+
+    def astart(self, query, afetch):
+        return Speculation(query, asyncio.ensure_future(afetch(query)))
+
+    @contextmanager
+    def run(self):
+        """
+        Scope claims to one graph run: when it ends, however it ends, the
+        speculations its tools node didn't take are cancelled.
+        """
+        claims = []
+        token = _run_claims.set(claims)
+        try:
+            yield
+        finally:
+            _run_claims.reset(token)
+            for key in claims:
+                speculation = self._claims.pop(key)
+                if speculation is not None:
+                    self.discard(speculation)
+
+    def settle(self, speculation, response, tool_name="retrieve"):
+        """
+        Hand `speculation` to the `tool_name` call of the LLM's `response`
+        it matches best, or cancel it as a miss (the LLM retrieved something
+        else) or unused (it didn't retrieve).
+        """
+        calls = [call for call in response.tool_calls if call["name"] == tool_name]
+        if not calls:
+            self.discard(speculation)
+            return
+        scores = [
+            overlap(speculation.query, call["args"].get("query", "")) for call in calls
+        ]
+        best = max(range(len(calls)), key=scores.__getitem__)
+        if scores[best] >= self.min_overlap:
+            call = calls[best]
+            key = (call["id"], call["args"].get("query", ""))
+            self._claims.put(key, speculation)
+            claims = _run_claims.get()
+            if claims is not None:
+                claims.append(key)
+        else:
+            speculation.result.cancel()
+            self._count("miss", speculation)
+
+    def discard(self, speculation):
+        """Cancel a speculation nothing will take, e.g. its LLM call failed."""
+        speculation.result.cancel()
+        self._count("unused", speculation)
+
+    def _count(self, outcome, speculation, saved=0.0):
+        with self._lock:
+            self.counts[outcome] += 1
+            self.saved_seconds += saved
+        SPECULATIONS.inc(outcome=outcome)
+        if outcome == "hit":
+            SPECULATION_SAVED_SECONDS.observe(saved)
+        trace_event(
+            "speculations",
+            {
+                "query": speculation.query,
+                "outcome": outcome,
+                "saved": round(saved, 4),
+            },
+        )
+
+    def _hit(self, speculation, docs, needed_at):
+        self._count("hit", speculation, speculation.saved(needed_at))
+        if self.record is not None:
+            self.record(speculation.query, docs, speculation.seconds())
+
+    def take(self, tool_call_id, query):
+        """The documents speculated for this tool call, or None to fetch them."""
+        speculation = self._claims.pop((tool_call_id, query))
+        if speculation is None:
+            return None
+        needed_at = time.perf_counter()
+        if speculation.result.cancel():  # still queued behind other guesses
+            self._count("unused", speculation)
+            return None
+        try:
+            docs = speculation.result.result()
+        except Exception as e:
+            print(f"Speculative retrieval failed ({e}), retrieving again.")
+            self._count("miss", speculation)
+            return None
+        self._hit(speculation, docs, needed_at)
+        return docs
+
+    async def atake(self, tool_call_id, query):
+        speculation = self._claims.pop((tool_call_id, query))
+        if speculation is None:
+            return None
+        needed_at = time.perf_counter()
+        try:
+            docs = await asyncio.shield(speculation.result)
+        except Exception as e:
+            print(f"Speculative retrieval failed ({e}), retrieving again.")
+            self._count("miss", speculation)
+            return None
+        self._hit(speculation, docs, needed_at)
+        return docs
+
+    def stats(self):
+        with self._lock:
+            settled = sum(self.counts.values())
+            return {
+                **self.counts,
+                "hit_rate": self.counts["hit"] / settled if settled else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
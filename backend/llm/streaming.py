@@ -0,0 +1,183 @@
+"""
+Server-sent event framing for /api/query responses.
+
+The answer's message chunks are read by a producer (a thread for the Flask
+app, a task for the ASGI app) and written to the client as SSE frames.
+Tokens are batched into one frame per `STREAM_FLUSH_INTERVAL` seconds
+(default 0.05) or `STREAM_FLUSH_CHARS` characters (default 512), whichever
+comes first, instead of one write per token. After `STREAM_HEARTBEAT`
+seconds (default 2) without a frame, e.g. while documents are retrieved, a
+heartbeat comment is sent; this also lets a WSGI server notice a client
+that went away, since only failed writes tell it so.
+
+    data: {"text": "CS 1 is taught in"}
+
+    : heartbeat
+
+    event: done
+    data: {}
+
+A failed stream ends with an `error` event instead of `done`. When the
+client disconnects, the producer closes (or cancels) the graph stream, which
+stops the LangGraph run and the upstream LLM request.
+"""
+
+from llm.metrics import STREAM_FRAMES
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+
+HEARTBEAT = ": heartbeat\n\n"
+HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse(data, event=None):
+    frame = f"event: {event}\n" if event else ""
+    return f"{frame}data: {json.dumps(data)}\n\n"
+
+
+def text_of(message):
+    return message.content if isinstance(message.content, str) else ""
+
+
+class Framer:
+    """Batches token text into `data` frames by time or size."""
+
+    def __init__(self, interval=None, max_chars=None, heartbeat=None):
+        env = os.environ.get
+        self.interval = interval or float(env("STREAM_FLUSH_INTERVAL", 0.05))
+        self.max_chars = max_chars or int(env("STREAM_FLUSH_CHARS", 512))
+        self.heartbeat = heartbeat or float(env("STREAM_HEARTBEAT", 2))
+        self.buffer = []
+        self.size = 0
+        self.deadline = None
+        self.last_frame = time.monotonic()
+
+    def timeout(self):
+        """Seconds until the buffer is due, or a heartbeat is if it's empty."""
+        if self.buffer:
+            return max(0.0, self.deadline - time.monotonic())
+        return max(0.0, self.last_frame + self.heartbeat - time.monotonic())
+
+    def add(self, text):
+        """Buffer `text`; returns a frame if the buffer is now due."""
+        if not text:
+            return None
+        if not self.buffer:
+            self.deadline = time.monotonic() + self.interval
+        self.buffer.append(text)
+        self.size += len(text)
+        if self.size >= self.max_chars or time.monotonic() >= self.deadline:
+            return self.flush()
+        return None
+
+    def flush(self):
+        if not self.buffer:
+            return None
+        frame = sse({"text": "".join(self.buffer)})
+        self.buffer.clear()
+        self.size = 0
+        self.last_frame = time.monotonic()
+        STREAM_FRAMES.inc(kind="data")
+        return frame
+
+    def tick(self):
+        """The frame to send when `timeout` ran out: the buffer or a heartbeat."""
+        frame = self.flush()
+        if frame is None:
+            self.last_frame = time.monotonic()
+            STREAM_FRAMES.inc(kind="heartbeat")
+            frame = HEARTBEAT
+        return frame
+
+    def end(self, kind, value):
+        """The frames that close the stream, after whatever is buffered."""
+        frames = [self.flush()]
+        if kind == "error":
+            print(f"Stream failed: {value!r}")
+            error = {"error": "Something went wrong, please try again."}
+            frames.append(sse(error, "error"))
+        else:
+            frames.append(sse({}, "done"))
+        return [frame for frame in frames if frame]
+
+
+def sse_stream(messages, framer=None):
+    """
+    SSE frames of a stream of message chunks. `messages` is iterated on a
+    thread of its own, so frames and heartbeats go out on time while it
+    blocks; once the response is closed, it is closed at its next chunk.
+    """
+    framer = framer or Framer()
+    items = queue.SimpleQueue()
+    cancelled = threading.Event()
+
+    def produce():
+        try:
+            for message in messages:
+                if cancelled.is_set():
+                    break
+                items.put(("message", message))
+            else:
+                items.put(("done", None))
+        except Exception as e:
+            items.put(("error", e))
+        finally:
+            close = getattr(messages, "close", None)
+            if close is not None:
+                close()
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            try:
+                kind, value = items.get(timeout=framer.timeout())
+            except queue.Empty:
+                yield framer.tick()
+                continue
+            if kind != "message":
+                yield from framer.end(kind, value)
+                return
+            frame = framer.add(text_of(value))
+            if frame:
+                yield frame
+    finally:
+        cancelled.set()
+
+
+async def asse_stream(messages, framer=None):
+    """
+    SSE frames of an async stream of message chunks, read by a task that is
+    cancelled (along with the graph run and LLM call) when the response is.
+    """
+    framer = framer or Framer()
+    items = asyncio.Queue()
+
+    async def produce():
+        try:
+            async for message in messages:
+                items.put_nowait(("message", message))
+            items.put_nowait(("done", None))
+        except Exception as e:
+            items.put_nowait(("error", e))
+
+    task = asyncio.ensure_future(produce())
+    try:
+        while True:
+            try:
+                kind, value = await asyncio.wait_for(items.get(), framer.timeout())
+            except asyncio.TimeoutError:
+                yield framer.tick()
+                continue
+            if kind != "message":
+                for frame in framer.end(kind, value):
+                    yield frame
+                return
+            frame = framer.add(text_of(value))
+            if frame:
+                yield frame
+    finally:
+        task.cancel()
@@ -0,0 +1,222 @@
+"""
+Columnar store of TQFR scores, for ranking and aggregate questions.
+
+embed/embed-tqfr.py keeps every numeric TQFR answer (score, standard
+deviation, department and Caltech averages) as one row keyed by course,
+term, instructor and question, in NumPy columns saved to an .npz file.
+`TQFRStats.query` filters, groups and sorts those columns with vectorized
+operations and returns a small markdown table, so questions like "which Ma
+course has the lowest workload" are answered exactly from a few lines of
+prompt instead of from pages of retrieved reports.
+"""
+
+from llm.router import course_codes
+import numpy as np
+import os
+
+STRING_COLUMNS = ("course_id", "name", "departments", "term", "instructor", "question")
+NUMBER_COLUMNS = ("score", "stdev", "dept_avg", "caltech_avg", "response_rate")
+COLUMNS = STRING_COLUMNS + NUMBER_COLUMNS + ("doc_id", "url")
+
+GROUPS = {
+    "course": "course_id",
+    "instructor": "instructor",
+    "term": "term",
+    "department": "department",
+}
+AGGREGATES = ("mean", "max", "min", "count")
+MAX_ROWS = 25
+
+
+def to_float(value):
+    """A TQFR number ("4.2", "63%", 4.2) as a float, NaN if it isn't one."""
+    try:
+        return float(str(value).strip().rstrip("%"))
+    except ValueError:
+        return float("nan")
+
+
+def departments_of(course_id):
+    """'/acm/ids/' for "ACM/IDS 104", so one department is a substring match."""
+    codes = course_codes(course_id)
+    if not codes:
+        return "/" + course_id.split()[0].lower() + "/" if course_id.split() else "/"
+    return "/" + codes[0].split()[0] + "/"
+
+
+def report_rows(
+    course_id, name, term, report_id, url, response_rate, answers, instructor=""
+):
+    """Rows for the numeric answers of one report section."""
+    for question, data in answers.items():
+        if not isinstance(data, dict) or "score" not in data:
+            continue
+        yield {
+            "course_id": course_id,
+            "name": name,
+            "departments": departments_of(course_id),
+            "term": term,
+            "instructor": instructor,
+            "question": question,
+            "score": to_float(data["score"]),
+            "stdev": to_float(data.get("stdev")),
+            "dept_avg": to_float(data.get("dept")),
+            "caltech_avg": to_float(data.get("caltech")),
+            "response_rate": to_float(response_rate),
+            "doc_id": report_id,
+            "url": url,
+        }
+
+
+def write_stats(path, rows):
+    rows = list(rows)
+    columns = {}
+    for column in COLUMNS:
+        values = [row[column] for row in rows]
+        if column in NUMBER_COLUMNS:
+            columns[column] = np.array(values, dtype=np.float32)
+        else:
+            columns[column] = np.array(values, dtype=np.str_)
+    np.savez_compressed(path, **columns)
+    return len(rows)
+
+
+def _fmt(value):
+    if isinstance(value, (float, np.floating)):
+        return "-" if np.isnan(value) else f"{value:.2f}"
+    return str(value)
+
+
+def markdown_table(header, rows):
+    lines = ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+    lines += ["| " + " | ".join(_fmt(v) for v in row) + " |" for row in rows]
+    return "\n".join(lines)
+
+
+class TQFRStats:
+    def __init__(self, columns):
+        self.columns = columns
+        self.size = len(columns["score"])
+        # Lowercased copies of the columns that are filtered by substring.
+        self._lower = {
+            column: np.char.lower(columns[column])
+            for column in ("course_id", "instructor", "question", "term")
+        }
+        self.columns["department"] = np.array(
+            [d.strip("/").split("/")[0] for d in columns["departments"]], dtype=np.str_
+        )
+
+    @classmethod
+    def load(cls, path):
+        """The store saved at `path`, or None if there is none."""
+        if not path or not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            columns = {column: data[column] for column in data.files}
+        return cls(columns)
+
+    def __len__(self):
+        return self.size
+
+    def questions(self):
+        return sorted(set(self.columns["question"].tolist()))
+
+    def _mask(self, question, department, course, instructor, term):
+        mask = ~np.isnan(self.columns["score"])
+        for column, value in (
+            ("question", question),
+            ("course_id", course),
+            ("instructor", instructor),
+            ("term", term),
+        ):
+            if value:
+                mask &= np.char.find(self._lower[column], value.lower()) >= 0
+        if department:
+            departments = np.char.lower(self.columns["departments"])
+            mask &= np.char.find(departments, f"/{department.lower()}/") >= 0
+        return mask
+
+    def query(
+        self,
+        question=None,
+        department=None,
+        course=None,
+        instructor=None,
+        term=None,
+        group_by="course",
+        aggregate="mean",
+        order="desc",
+        limit=10,
+    ):
+        """
+        Filter rows by substrings of the question, course, instructor and
+        term and by department, then either list them ("none") or group
+        them by course, instructor, term or department and aggregate their
+        scores. Returns a markdown table of at most `limit` rows.
+        """
+        if group_by not in GROUPS and group_by != "none":
+            raise ValueError(f"group_by must be one of {', '.join(GROUPS)} or none")
+        if aggregate not in AGGREGATES:
+            raise ValueError(f"aggregate must be one of {', '.join(AGGREGATES)}")
+        limit = max(1, min(int(limit), MAX_ROWS))
+        columns = self.columns
+        rows = np.flatnonzero(self._mask(question, department, course, instructor, term))
+        if group_by == "instructor":
+            rows = rows[columns["instructor"][rows] != ""]
+        if len(rows) == 0:
+            return "No TQFR scores match these filters."
+        descending = order != "asc"
+
+        if group_by == "none":
+            scores = columns["score"][rows]
+            ranked = rows[np.argsort(-scores if descending else scores, kind="stable")]
+            ranked = ranked[:limit]
+            header = ["course", "term", "instructor", "question", "score", "stdev"]
+            header += ["dept avg", "Caltech avg"]
+            table = [
+                [
+                    columns["course_id"][i],
+                    columns["term"][i],
+                    columns["instructor"][i] or "-",
+                    columns["question"][i],
+                    columns["score"][i],
+                    columns["stdev"][i],
+                    columns["dept_avg"][i],
+                    columns["caltech_avg"][i],
+                ]
+                for i in ranked
+            ]
+        else:
+            keys = columns[GROUPS[group_by]][rows]
+            groups, inverse = np.unique(keys, return_inverse=True)
+            scores = columns["score"][rows].astype(np.float64)
+            counts = np.bincount(inverse, minlength=len(groups))
+            if aggregate in ("mean", "count"):
+                sums = np.bincount(inverse, weights=scores, minlength=len(groups))
+                values = sums / counts
+            elif aggregate == "max":
+                values = np.full(len(groups), -np.inf)
+                np.maximum.at(values, inverse, scores)
+            else:
+                values = np.full(len(groups), np.inf)
+                np.minimum.at(values, inverse, scores)
+            ranking = counts if aggregate == "count" else values
+            top = np.lexsort((groups, -ranking if descending else ranking))[:limit]
+            first = np.zeros(len(groups), dtype=np.int64)
+            first[inverse[::-1]] = rows[::-1]  # a row of each group, for its name
+            header = [group_by] + (["name"] if group_by == "course" else [])
+            header += [f"{aggregate if aggregate != 'count' else 'mean'} score", "answers"]
+            table = [
+                [groups[g]]
+                + ([columns["name"][first[g]]] if group_by == "course" else [])
+                + [values[g], int(counts[g])]
+                for g in top
+            ]
+
+        return (
+            f"TQFR scores ({len(rows)} matching answers):\n\n"
+            + markdown_table(header, table)
+        )
+
+    def stats(self):
+        return {"rows": self.size}
@@ -0,0 +1,93 @@
+"""
+Deferred, background construction of CourseRAG.
+
+Building CourseRAG loads the sparse model, connects to Qdrant and compiles
+the graph, which used to happen at import time. `LazyRAG` does it on a
+background thread once the app is up, warms it up, and retries with backoff
+if a dependency is down, so the process can answer health checks right
+away and take traffic as soon as it is ready.
+"""
+
+import threading
+import time
+
+
+class LazyRAG:
+    def __init__(self, factory, retry_delay=1.0, max_retry_delay=30.0):
+        self.factory = factory
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.rag = None
+        self.error = None
+        self.attempts = 0
+        self.timings = {}
+        self._created = time.perf_counter()
+        self._ready = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def of(cls, rag):
+        """A LazyRAG that is ready with an already built `rag`."""
+        lazy = cls(lambda: rag)
+        lazy.rag = rag
+        lazy._ready.set()
+        return lazy
+
+    def start(self):
+        """Start building in the background; later calls do nothing."""
+        with self._lock:
+            if self._thread is None and not self._ready.is_set():
+                self._thread = threading.Thread(
+                    target=self._build, name="rag-init", daemon=True
+                )
+                self._thread.start()
+        return self
+
+    def _build(self):
+        delay = self.retry_delay
+        while True:
+            self.attempts += 1
+            try:
+                start = time.perf_counter()
+                rag = self.factory()
+                built = time.perf_counter()
+                rag.warm_up()
+                warm = time.perf_counter()
+            except Exception as e:
+                self.error = str(e)
+                print(f"CourseRAG init failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+            self.timings = {
+                "init_seconds": built - start,
+                "warmup_seconds": warm - built,
+                "time_to_ready_seconds": warm - self._created,
+            }
+            self.rag, self.error = rag, None
+            self._ready.set()
+            print(
+                "CourseRAG ready in {time_to_ready_seconds:.1f}s (init "
+                "{init_seconds:.1f}s, warm-up {warmup_seconds:.1f}s)".format(**self.timings)
+            )
+            return
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def get(self, timeout=None):
+        """The CourseRAG, or None if it isn't ready within `timeout` seconds."""
+        self.start()
+        if self._ready.wait(timeout):
+            return self.rag
+        return None
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "attempts": self.attempts,
+            "error": self.error,
+            **self.timings,
+        }
@@ -0,0 +1,85 @@
+"""
+LLM stream slots of the admission control.
+"""
+
+from unittest import mock
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from llm.admission import (  # noqa: E402
+    Admission,
+    AsyncConcurrencyLimit,
+    ConcurrencyLimit,
+)
+
+
+class ConcurrencyLimitTest(unittest.TestCase):
+    def test_takes_several_slots_at_once(self):
+        limit = ConcurrencyLimit(max_concurrent=4, max_queue=1, timeout=0.01)
+        self.assertIsNone(limit.acquire(3))
+        self.assertEqual(limit.acquire(2), "queue_timeout")
+        limit.release(3)
+        self.assertIsNone(limit.acquire(2))
+        self.assertEqual(limit.active, 2)
+
+    def test_admits_waiters_in_order(self):
+        limit = ConcurrencyLimit(max_concurrent=4, max_queue=2, timeout=5)
+        self.assertIsNone(limit.acquire(3))
+        results = {}
+
+        def acquire(name, n):
+            results[name] = limit.acquire(n)
+
+        first = threading.Thread(target=acquire, args=("first", 2))
+        first.start()
+        while limit.waiting < 1:
+            time.sleep(0.001)
+        second = threading.Thread(target=acquire, args=("second", 1))
+        second.start()
+        time.sleep(0.05)
+        # The one free slot would fit the second waiter, but the first is ahead.
+        self.assertEqual(results, {})
+        self.assertEqual(limit.waiting, 2)
+
+        limit.release(3)
+        first.join()
+        second.join()
+        self.assertEqual(results, {"first": None, "second": None})
+        self.assertEqual(limit.active, 3)
+        self.assertEqual(limit.waiting, 0)
+
+
+class AsyncConcurrencyLimitTest(unittest.IsolatedAsyncioTestCase):
+    async def test_hands_freed_slots_to_waiters_in_order(self):
+        limit = AsyncConcurrencyLimit(max_concurrent=4, max_queue=2, timeout=1)
+        self.assertIsNone(await limit.acquire(3))
+        first = asyncio.ensure_future(limit.acquire(2))
+        second = asyncio.ensure_future(limit.acquire(1))
+        await asyncio.sleep(0)
+        # The one free slot would fit the second waiter, but the first is ahead.
+        self.assertFalse(second.done())
+
+        limit.release(3)
+        self.assertEqual(await asyncio.gather(first, second), [None, None])
+        self.assertEqual(limit.active, 3)
+        self.assertEqual(limit.waiting, 0)
+
+
+class ClientTest(unittest.TestCase):
+    def test_session_keys_stay_within_the_client_address(self):
+        with mock.patch.dict(os.environ, {"RATE_LIMIT_KEY": "session"}):
+            admission = Admission()
+        self.assertEqual(admission.client("1.2.3.4", {}, "t"), "1.2.3.4 session:t")
+        # Requests that start a session without a thread_id share a bucket.
+        self.assertEqual(admission.client("1.2.3.4", {}, None), "1.2.3.4")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,244 @@
+"""
+Concurrent /api/query requests through the ASGI app, with the LLM and the
+vector store replaced by the fakes in bench/fakes.py. Run from the backend
+directory:
+
+    python -m unittest discover tests
+"""
+
+from contextlib import redirect_stdout
+from tempfile import TemporaryDirectory
+import asyncio
+import httpx
+import io
+import json
+import os
+import sys
+import time
+import unittest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [BACKEND, os.path.join(BACKEND, "bench")]
+os.environ.setdefault("ALLOWED_ORIGIN", "http://localhost")
+# Every request comes from the same test client.
+os.environ["RATE_LIMIT_PER_MINUTE"] = "0"
+
+from asgi import create_asgi_app  # noqa: E402
+from fakes import FakeChatModel, FakeDocStore, FakeRetriever  # noqa: E402
+from llm.rag import CourseRAG  # noqa: E402
+
+FIRST_TOKEN_LATENCY = 0.2
+RETRIEVAL_LATENCY = 0.05
+
+
+def parse_frames(body):
+    """(text, last event) of an SSE response body."""
+    text, event = [], None
+    for frame in body.split("\n\n"):
+        lines = frame.split("\n")
+        if lines[0].startswith("event: "):
+            event = lines[0][len("event: ") :]
+        elif lines[0].startswith("data: "):
+            text.append(json.loads(lines[0][len("data: ") :])["text"])
+    return "".join(text), event
+
+
+class AppTestCase(unittest.IsolatedAsyncioTestCase):
+    env = {}
+
+    def setUp(self):
+        self.saved = {name: os.environ.get(name) for name in self.env}
+        os.environ.update(self.env)
+        self.calls = []
+        llm = FakeChatModel(
+            first_token_latency=FIRST_TOKEN_LATENCY,
+            tokens_per_second=1000,
+            answer_tokens=20,
+            on_call=lambda node, seconds: self.calls.append(node),
+        )
+        with redirect_stdout(io.StringIO()):
+            self.rag = CourseRAG(
+                llm=llm,
+                retriever=FakeRetriever(latency=RETRIEVAL_LATENCY),
+                docstore=FakeDocStore(body_tokens=50),
+                router=False,
+            )
+            self.app = create_asgi_app(self.rag)
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=self.app), base_url="http://test"
+        )
+
+    async def asyncSetUp(self):
+        # The test runner turns on asyncio debug mode, which slows every step.
+        asyncio.get_running_loop().set_debug(False)
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    async def query(self, question):
+        response = await self.client.post(
+            "/api/query", json={"messages": [{"role": "user", "content": question}]}
+        )
+        return response.status_code, *parse_frames(response.text)
+
+
+class ConcurrentQueryTest(AppTestCase):
+    async def test_concurrent_requests_stream_in_parallel(self):
+        n = 16
+        with redirect_stdout(io.StringIO()):
+            await self.query("Warm up")  # first-call imports
+            self.calls.clear()
+            start = time.perf_counter()
+            results = await asyncio.gather(
+                *(self.query(f"Which electives are good, take {i}?") for i in range(n))
+            )
+            seconds = time.perf_counter() - start
+
+        for status, text, event in results:
+            self.assertEqual(status, 200)
+            self.assertEqual(event, "done")
+            self.assertEqual(len(text.split()), 20)
+        # Each request makes two LLM calls and a retrieval; run one after the
+        # other they would take n times as long.
+        one_request = 2 * FIRST_TOKEN_LATENCY + RETRIEVAL_LATENCY
+        self.assertLess(seconds, n * one_request / 4)
+        self.assertEqual(self.calls.count("generate"), n)
+
+
+class AdmissionTest(AppTestCase):
+    env = {"MAX_LLM_STREAMS": "1", "MAX_QUEUED_STREAMS": "0"}
+
+    async def stats(self):
+        return (await self.client.get("/api/stats")).json()
+
+    async def test_coalesced_and_cached_questions_take_no_slot(self):
+        question = "Which electives are good?"
+        with redirect_stdout(io.StringIO()):
+            identical = await asyncio.gather(*(self.query(question) for _ in range(4)))
+            self.assertEqual(self.calls.count("generate"), 1)
+
+            other = asyncio.ensure_future(self.query("Who teaches CS 1?"))
+            await asyncio.sleep(RETRIEVAL_LATENCY)  # holds the only slot
+            cached = await self.query(question)
+            rejected = await self.client.post(
+                "/api/query", json={"messages": [{"role": "user", "content": "Hi"}]}
+            )
+            await other
+
+        for status, _, event in identical + [cached, other.result()]:
+            self.assertEqual((status, event), (200, "done"))
+        self.assertEqual(rejected.status_code, 503)
+        stats = await self.stats()
+        self.assertEqual(stats["admission"]["streams"]["active"], 0)
+        self.assertEqual(stats["admission"]["rejected"]["queue_full"], 1)
+        self.assertEqual(stats["coalescing"]["streams"]["coalesced"], 3)
+
+
+class SessionRateLimitTest(AppTestCase):
+    env = {
+        "RATE_LIMIT_PER_MINUTE": "1",
+        "RATE_LIMIT_BURST": "1",
+        "RATE_LIMIT_KEY": "session",
+    }
+
+    async def status(self, **body):
+        response = await self.client.post("/api/query", json={"message": "Hi", **body})
+        return response.status_code
+
+    async def test_new_sessions_share_the_client_bucket(self):
+        with redirect_stdout(io.StringIO()):
+            statuses = [await self.status(), await self.status()]
+            statuses.append(await self.status(thread_id="t"))
+        self.assertEqual(statuses, [200, 429, 200])
+
+
+class BatchAdmissionTest(AppTestCase):
+    env = {"MAX_LLM_STREAMS": "2", "MAX_QUEUED_STREAMS": "0"}
+
+    async def test_batch_holds_a_slot_per_conversation_in_flight(self):
+        with redirect_stdout(io.StringIO()):
+            batch = asyncio.ensure_future(
+                self.client.post(
+                    "/api/batch",
+                    json={"conversations": [f"Question {i}?" for i in range(4)]},
+                )
+            )
+            await asyncio.sleep(RETRIEVAL_LATENCY)
+            stats = (await self.client.get("/api/stats")).json()
+            status, _, _ = await self.query("Who teaches CS 1?")
+            response = await batch
+
+        self.assertEqual(stats["admission"]["streams"]["active"], 2)
+        self.assertEqual(status, 503)
+        results = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(sorted(result["index"] for result in results), [0, 1, 2, 3])
+        self.assertTrue(all("answer" in result for result in results))
+        stats = (await self.client.get("/api/stats")).json()
+        self.assertEqual(stats["admission"]["streams"]["active"], 0)
+
+
+class SessionDBTest(unittest.IsolatedAsyncioTestCase):
+    """Sessions in SQLite, with CourseRAG built in the background."""
+
+    async def asyncSetUp(self):
+        try:
+            import langgraph.checkpoint.sqlite.aio  # noqa: F401
+        except ImportError:
+            self.skipTest("needs langgraph-checkpoint-sqlite")
+        asyncio.get_running_loop().set_debug(False)
+        self.tmp = TemporaryDirectory()
+        self.saved = os.environ.get("SESSION_DB")
+        os.environ["SESSION_DB"] = os.path.join(self.tmp.name, "sessions.db")
+
+        def build(checkpointer):
+            return CourseRAG(
+                llm=FakeChatModel(first_token_latency=0, tokens_per_second=1e6),
+                retriever=FakeRetriever(latency=0),
+                docstore=FakeDocStore(body_tokens=50),
+                router=False,
+                checkpointer=checkpointer,
+            )
+
+        with redirect_stdout(io.StringIO()):
+            self.app = create_asgi_app(build=build)
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=self.app), base_url="http://test"
+        )
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        if self.saved is None:
+            os.environ.pop("SESSION_DB", None)
+        else:
+            os.environ["SESSION_DB"] = self.saved
+        self.tmp.cleanup()
+
+    async def test_sessions_persist_once_ready(self):
+        with redirect_stdout(io.StringIO()):
+            async with self.app.router.lifespan_context(self.app):
+                for _ in range(100):
+                    if (await self.client.get("/api/readyz")).status_code == 200:
+                        break
+                    await asyncio.sleep(0.05)
+                status = (await self.client.get("/api/readyz")).json()
+                self.assertTrue(status["ready"], status)
+
+                for message in ("Tell me about CS 156", "And its workload?"):
+                    response = await self.client.post(
+                        "/api/query", json={"message": message, "thread_id": "t"}
+                    )
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(parse_frames(response.text)[1], "done")
+
+        self.assertGreater(os.path.getsize(os.environ["SESSION_DB"]), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
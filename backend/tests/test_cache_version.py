@@ -0,0 +1,86 @@
+"""
+Collection profile and data versions, and the caches scoped to the latter.
+"""
+
+from contextlib import redirect_stdout
+from qdrant_client import QdrantClient
+import io
+import os
+import sys
+import unittest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [BACKEND, os.path.join(BACKEND, "bench")]
+
+from fakes import FakeChatModel, FakeDocStore, FakeRetriever  # noqa: E402
+from llm import collection  # noqa: E402
+from llm.docstore import LocalDocStore  # noqa: E402
+from llm.rag import CourseRAG  # noqa: E402
+
+
+class DataVersionTest(unittest.TestCase):
+    def test_bump_replaces_the_marker(self):
+        client = QdrantClient(":memory:")
+        collection.create(client, "points", dense_size=4)
+        self.assertIsNone(collection.data_version(client, "points"))
+        first = collection.bump_data_version(client, "points")
+        second = collection.bump_data_version(client, "points")
+        self.assertNotEqual(first, second)
+        self.assertEqual(collection.data_version(client, "points"), second)
+        aliases = client.get_collection_aliases("points").aliases
+        self.assertEqual(
+            [alias.alias_name for alias in aliases if "__data_" in alias.alias_name],
+            [f"points__data_{second}"],
+        )
+
+
+class ProfileVersionTest(unittest.TestCase):
+    def test_collections_record_the_profile_version(self):
+        client = QdrantClient(":memory:")
+        collection.create(client, "points", dense_size=4)
+        self.assertEqual(
+            collection.profile_version(client, "points"), collection.PROFILE_VERSION
+        )
+        client.create_collection("old", vectors_config={})
+        self.assertIn(
+            f"profile v{collection.PROFILE_VERSION} (was unrecorded)",
+            collection.outdated(client, "old", ()),
+        )
+
+
+class RefreshCacheVersionTest(unittest.TestCase):
+    def rag(self, retriever, docstore):
+        with redirect_stdout(io.StringIO()):
+            return CourseRAG(
+                llm=FakeChatModel(first_token_latency=0, tokens_per_second=1e6),
+                retriever=retriever,
+                docstore=docstore,
+                version_check_interval=0,
+            )
+
+    def test_drops_caches_when_the_version_changes(self):
+        retriever = FakeRetriever(latency=0)
+        rag = self.rag(retriever, FakeDocStore(body_tokens=50))
+        with redirect_stdout(io.StringIO()):
+            rag.search("CS 156 workload")
+            self.assertFalse(rag.refresh_cache_version())
+            self.assertEqual(rag.retrieval_cache.stats()["size"], 1)
+
+            retriever.version = lambda: "fake:2"
+            self.assertTrue(rag.refresh_cache_version())
+        self.assertEqual(rag.retrieval_cache.stats()["size"], 0)
+        self.assertEqual(rag.answer_cache.version, "fake:2")
+
+    def test_drops_document_bodies(self):
+        retriever = FakeRetriever(latency=0)
+        docstore = LocalDocStore("/nonexistent")
+        docstore.cache.put("cs-156", "old body")
+        rag = self.rag(retriever, docstore)
+        retriever.version = lambda: "fake:2"
+        with redirect_stdout(io.StringIO()):
+            self.assertTrue(rag.refresh_cache_version())
+        self.assertEqual(len(docstore.cache), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
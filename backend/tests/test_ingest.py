@@ -0,0 +1,126 @@
+"""
+Incremental ingestion with `ingest.run` against an in-memory Qdrant and fake
+embedders.
+"""
+
+from contextlib import redirect_stderr, redirect_stdout
+from qdrant_client import QdrantClient
+from types import SimpleNamespace
+import io
+import os
+import sys
+import unittest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [BACKEND, os.path.join(BACKEND, "embed")]
+
+import ingest  # noqa: E402
+from llm import collection  # noqa: E402
+
+
+class FakeDense:
+    """Fails the first `failures` calls, like a flaky remote embedder."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = 0
+
+    def embed(self, texts):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError("simulated embedding failure")
+        return [
+            [1.0 + len(text) % 7] + [0.0] * (collection.DENSE_SIZE - 1)
+            for text in texts
+        ]
+
+
+class FakeSparse:
+    def embed(self, texts, parallel=None):
+        for text in texts:
+            yield SimpleNamespace(indices=[len(text) % 100], values=[1.0])
+
+
+def chunks(docs):
+    """One chunk per (doc_id, content, body) in `docs`."""
+    return [
+        ingest.Chunk(
+            id=doc_id,
+            summary=f"About {doc_id}",
+            content=content,
+            meta={"doc_id": doc_id, "source": "test"},
+            body=body,
+            keys=ingest.lookup_keys([doc_id]),
+        )
+        for doc_id, content, body in docs
+    ]
+
+
+class IngestTest(unittest.TestCase):
+    def setUp(self):
+        self.client = QdrantClient(":memory:")
+
+    def run_ingest(self, docs, **kwargs):
+        kwargs.setdefault("dense_embed", FakeDense())
+        with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+            return ingest.run(
+                chunks(docs),
+                "courses",
+                client=self.client,
+                batch_size=2,
+                workers=1,  # the local client isn't thread-safe
+                sparse_embed=FakeSparse(),
+                **kwargs,
+            )
+
+    def points(self):
+        return self.client.count(ingest.COLLECTION_NAME).count
+
+    def test_reruns_only_embed_what_changed(self):
+        result = self.run_ingest(
+            [("CS 1", "Intro.", "a"), ("CS 2", "More.", "b"), ("CS 3", "Old.", "c")]
+        )
+        self.assertEqual(result["counts"]["added"], 3)
+        self.assertEqual(self.points(), 6)  # a summary and a content point each
+
+        dense = FakeDense()
+        result = self.run_ingest(
+            [("CS 1", "Intro.", "a"), ("CS 2", "Changed.", "b"), ("CS 4", "New.", "d")],
+            dense_embed=dense,
+        )
+        self.assertEqual(
+            result["counts"],
+            {"added": 1, "changed": 1, "removed": 1, "skipped": 1, "retagged": 0},
+        )
+        self.assertEqual(result["docs"], {"written": 1, "removed": 1})  # CS 4 and CS 3
+        self.assertEqual(dense.calls, 1)  # one batch of the two pending chunks
+        self.assertEqual(self.points(), 6)
+
+    def test_retries_failed_embedding_calls(self):
+        dense = FakeDense(failures=1)
+        result = self.run_ingest([("CS 1", "Intro.", "a")], dense_embed=dense)
+        self.assertEqual(dense.calls, 2)
+        self.assertEqual(result["counts"]["added"], 1)
+        self.assertEqual(self.points(), 2)
+
+    def version(self):
+        return collection.data_version(self.client, ingest.COLLECTION_NAME)
+
+    def test_document_only_rewrites_bump_the_version(self):
+        docs = [("CS 156", "Learning from data.", "CS 156 body")]
+        self.run_ingest(docs)
+        first = self.version()
+
+        result = self.run_ingest([("CS 156", "Learning from data.", "New body")])
+        self.assertEqual(result["counts"]["skipped"], 1)
+        self.assertEqual(result["docs"], {"written": 1, "removed": 0})
+        second = self.version()
+        self.assertNotEqual(first, second)
+
+        result = self.run_ingest([("CS 156", "Learning from data.", "New body")])
+        self.assertEqual(result["docs"], {"written": 0, "removed": 0})
+        self.assertEqual(self.version(), second)
+
+
+if __name__ == "__main__":
+    unittest.main()
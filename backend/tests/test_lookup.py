@@ -0,0 +1,56 @@
+"""
+Exact lookup by course code, and the slots it takes from similarity search.
+"""
+
+from contextlib import redirect_stdout
+import io
+import os
+import sys
+import unittest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [BACKEND, os.path.join(BACKEND, "bench")]
+
+from fakes import FakeChatModel, FakeDocStore, FakeRetriever  # noqa: E402
+from llm.lookup import LookupIndex, lookup_keys  # noqa: E402
+from llm.rag import CourseRAG  # noqa: E402
+
+
+def entry(doc_id, course_id):
+    return {"doc_id": doc_id, "lookup_keys": lookup_keys([course_id]), "source": "x"}
+
+
+ENTRIES = [entry(f"me-{n}", f"ME {n}") for n in range(1, 10)]
+ENTRIES.append(entry("cs-156", "CS 156"))
+
+
+class LookupTest(unittest.TestCase):
+    def setUp(self):
+        with redirect_stdout(io.StringIO()):
+            self.rag = CourseRAG(
+                llm=FakeChatModel(first_token_latency=0, tokens_per_second=1e6),
+                retriever=FakeRetriever(latency=0),
+                docstore=FakeDocStore(body_tokens=50),
+            )
+        self.rag.lookup_index = LookupIndex(ENTRIES)
+
+    def test_finds_named_courses(self):
+        self.assertEqual(
+            self.rag.lookup_index.lookup("ME 3 and CS 156"), (["me-3", "cs-156"], False)
+        )
+        docs, search = self.rag.exact_matches("Is ME 3 hard?", k=8)
+        self.assertEqual([doc.metadata["_id"] for doc in docs], ["me-3"])
+        self.assertTrue(search)
+
+    def test_questions_without_course_codes_only_search(self):
+        for question in ("tell me 3 things", "give me 5 easy HSS classes"):
+            self.assertEqual(self.rag.exact_matches(question, k=8), ([], True))
+            docs = self.rag.fetch_documents(question, k=8)
+            self.assertFalse(
+                [doc for doc in docs if doc.metadata["_collection_name"] == "lookup"]
+            )
+        self.assertEqual(self.rag.lookup_counts["search"], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
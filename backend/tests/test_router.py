@@ -0,0 +1,41 @@
+"""
+Local routing: course codes and the questions that take the fast path.
+"""
+
+import os
+import sys
+import unittest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from llm.router import Router, course_codes  # noqa: E402
+
+
+class CourseCodesTest(unittest.TestCase):
+    def test_parses_catalog_spellings(self):
+        self.assertEqual(course_codes("Is CS 156b hard?"), ["cs 156b"])
+        self.assertEqual(course_codes("ma1a or ACM/IDS 104"), ["ma 1a", "acm/ids 104"])
+        self.assertEqual(course_codes("Ph 12 abc and ME 72"), ["ph 12abc", "me 72"])
+
+    def test_ignores_english_words(self):
+        for text in (
+            "tell me 3 things",
+            "give me 5 easy HSS classes",
+            "anything for me 4?",
+            "I am 5 units short",
+        ):
+            self.assertEqual(course_codes(text), [], text)
+
+
+class RouterTest(unittest.TestCase):
+    def test_routes(self):
+        router = Router()
+        self.assertEqual(router.route("Who teaches Ph 12b?"), "retrieve")
+        self.assertEqual(router.route("tell me 3 things"), "llm")
+        self.assertEqual(router.route("anything for me 4?"), "llm")
+        self.assertEqual(router.stats(), {"retrieve": 1, "llm": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
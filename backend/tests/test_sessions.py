@@ -0,0 +1,88 @@
+"""
+History compaction and in-memory session expiry, with the fakes in
+bench/fakes.py.
+"""
+
+from contextlib import redirect_stdout
+from langgraph.checkpoint.base import empty_checkpoint
+import io
+import os
+import sys
+import time
+import unittest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [BACKEND, os.path.join(BACKEND, "bench")]
+
+from fakes import FakeChatModel, FakeDocStore, FakeRetriever  # noqa: E402
+from llm.rag import CourseRAG  # noqa: E402
+from llm.sessions import BoundedMemorySaver  # noqa: E402
+
+
+class CompactionTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        llm = FakeChatModel(
+            first_token_latency=0,
+            tokens_per_second=1e6,
+            answer_tokens=20,
+            on_call=lambda node, seconds: self.calls.append(node),
+        )
+        with redirect_stdout(io.StringIO()):
+            self.rag = CourseRAG(
+                llm=llm,
+                retriever=FakeRetriever(latency=0),
+                docstore=FakeDocStore(body_tokens=50),
+                router=False,
+                compact_tokens=50,
+            )
+
+    def conversation(self, turns):
+        messages = []
+        for i in range(turns):
+            messages.append({"role": "user", "content": f"Tell me about course {i}. " * 5})
+            messages.append({"role": "assistant", "content": "It is a course. " * 10})
+        return messages + [{"role": "user", "content": "Which should I take?"}]
+
+    def test_stateless_requests_do_not_compact(self):
+        with redirect_stdout(io.StringIO()):
+            self.rag.graph.invoke({"messages": self.conversation(4)})
+        # query_or_respond and generate only, no summarization call.
+        self.assertEqual(self.calls, ["query_or_respond", "generate"])
+
+    def test_sessions_compact(self):
+        config = {"configurable": {"thread_id": "t"}}
+        with redirect_stdout(io.StringIO()):
+            state = self.rag.session_graph.invoke(
+                {"messages": self.conversation(4)}, config
+            )
+        self.assertEqual(self.calls[0], "generate")  # the summary
+        self.assertTrue(state["summary"])
+
+
+class BoundedMemorySaverTest(unittest.TestCase):
+    def put(self, saver, thread_id):
+        config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+        return saver.put(config, empty_checkpoint(), {}, {})
+
+    def test_evicts_least_recently_used(self):
+        saver = BoundedMemorySaver(max_threads=2)
+        for thread_id in ("a", "b"):
+            self.put(saver, thread_id)
+        saver.get_tuple({"configurable": {"thread_id": "a"}})
+        self.put(saver, "c")
+        self.assertEqual(set(saver.storage), {"a", "c"})
+        self.assertEqual(saver.stats(), {"sessions": 2, "evicted": 1})
+
+    def test_expires_idle_sessions(self):
+        saver = BoundedMemorySaver(ttl=0.05)
+        config = self.put(saver, "a")
+        saver.put_writes(config, [("messages", [])], "task")
+        time.sleep(0.1)
+        self.put(saver, "b")
+        self.assertEqual(set(saver.storage), {"b"})
+        self.assertFalse(any(key[0] == "a" for key in saver.writes))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+"""
+Speculative retrievals that nothing takes are cancelled and go unrecorded.
+"""
+
+from langchain_core.messages import AIMessage
+import asyncio
+import os
+import sys
+import unittest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from llm.speculation import Speculator  # noqa: E402
+
+
+async def fetch(query):
+    return []
+
+
+async def slow_fetch(query):
+    await asyncio.sleep(10)
+    return []
+
+
+def retrieve(query):
+    call = {"name": "retrieve", "args": {"query": query}, "id": "call-1"}
+    return AIMessage(content="", tool_calls=[call])
+
+
+class SpeculatorTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.recorded = []
+        self.speculator = Speculator(
+            min_overlap=0.5,
+            record=lambda query, docs, seconds: self.recorded.append(query),
+        )
+
+    async def settled(self, response):
+        speculation = self.speculator.astart("CS 156 workload", slow_fetch)
+        self.speculator.settle(speculation, response)
+        await asyncio.sleep(0)
+        return speculation
+
+    async def test_cancels_misses_and_unused_guesses(self):
+        miss = await self.settled(retrieve("Ma 1a prerequisites"))
+        unused = await self.settled(AIMessage(content="Hello!"))
+        self.assertTrue(miss.result.cancelled())
+        self.assertTrue(unused.result.cancelled())
+        self.assertEqual(self.speculator.counts, {"hit": 0, "miss": 1, "unused": 1})
+        self.assertEqual(self.recorded, [])
+
+    async def test_run_releases_claims_it_did_not_take(self):
+        with self.speculator.run():
+            speculation = await self.settled(retrieve("CS 156 workload"))
+            self.assertFalse(speculation.result.done())
+        await asyncio.sleep(0)
+        self.assertTrue(speculation.result.cancelled())
+        self.assertIsNone(await self.speculator.atake("call-1", "CS 156 workload"))
+        self.assertEqual(self.speculator.counts["unused"], 1)
+        self.assertEqual(self.recorded, [])
+
+    async def test_run_keeps_claims_it_took(self):
+        with self.speculator.run():
+            speculation = self.speculator.astart("CS 156 workload", fetch)
+            self.speculator.settle(speculation, retrieve("CS 156 workload"))
+            await self.speculator.atake("call-1", "CS 156 workload")
+        self.assertEqual(self.speculator.counts, {"hit": 1, "miss": 0, "unused": 0})
+        self.assertEqual(self.recorded, ["CS 156 workload"])
+
+
+if __name__ == "__main__":
+    unittest.main()
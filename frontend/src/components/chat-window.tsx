@@ -1,4 +1,4 @@
-import React, { useState } from "react";
+import React, { useRef, useState } from "react";
 import { ChatContainer, ChatForm, ChatMessages, MessageList, MessageInput, PromptSuggestions } from "@/components/ui/custom";
 
 type Message = {
@@ -11,55 +11,90 @@ export const ChatWindow = () => {
     const [messages, setMessages] = useState<Array<Message>>([]);
     const [input, setInput] = useState("");
     const [isLoading, setLoading] = useState(false);
+    const [threadId, setThreadId] = useState<string | null>(null);
+    const abortRef = useRef<AbortController | null>(null);
 
     const API_URL_BASE = import.meta.env.VITE_API_BASE_URL;
     const isEmpty = messages.length === 0;
 
     const getCompletion = async (queryMessage: Message) => {
+        // The server keeps the conversation, so only the new message is sent.
         const payload = {
-            messages: [
-                ...messages.map((message) => ({
-                    role: message.role,
-                    content: message.content,
-                })),
-                { role: queryMessage.role, content: queryMessage.content },
-            ],
+            thread_id: threadId,
+            message: { role: queryMessage.role, content: queryMessage.content },
         };
 
+        const controller = new AbortController();
+        abortRef.current = controller;
         const response = await fetch(API_URL_BASE + "/api/query", {
             method: "POST",
             headers: {
                 "Content-Type": "application/json",
             },
             body: JSON.stringify(payload),
+            signal: controller.signal,
         });
 
+        if (response.status === 429 || response.status === 503) {
+            // Rate limited or too busy: show why instead of failing silently.
+            const { error } = await response.json().catch(() => ({ error: "Too busy right now" }));
+            const retryAfter = response.headers.get("Retry-After");
+            const responseMessage = {
+                id: (messages.length + 1).toString(),
+                role: "assistant",
+                content: retryAfter ? `${error} (retry in ${retryAfter}s)` : error,
+            };
+            setMessages([...messages, queryMessage, responseMessage]);
+            setLoading(false);
+            return;
+        }
         if (!response.ok) {
             throw new Error("Network response was not ok");
         }
+        setThreadId(response.headers.get("X-Thread-Id"));
 
         const reader = response.body?.getReader();
         if (!reader) {
             throw new Error("No reader available");
         }
 
+        // The answer streams as server-sent events: `data` frames carry text,
+        // `: heartbeat` comments keep the connection alive while documents
+        // are retrieved, and an `error` or `done` event ends the stream.
         const decoder = new TextDecoder();
+        let buffer = "";
         let content = "";
-        while (true) {
-            const { done, value } = await reader.read();
-            if (done) break;
-
-            const chunk = decoder.decode(value, { stream: true });
-            // console.log(chunk);
-            content += chunk;
-
+        const show = (text: string) => {
             const responseMessage = {
                 id: (messages.length + 1).toString(),
                 role: "assistant",
-                content: content,
+                content: text,
             };
-
             setMessages([...messages, queryMessage, responseMessage]);
+        };
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+
+            buffer += decoder.decode(value, { stream: true });
+            const frames = buffer.split("\n\n");
+            buffer = frames.pop() ?? "";
+            for (const frame of frames) {
+                let event = "message";
+                let data = "";
+                for (const line of frame.split("\n")) {
+                    if (line.startsWith("event: ")) event = line.slice(7);
+                    else if (line.startsWith("data: ")) data += line.slice(6);
+                }
+                if (!data) continue;
+                const parsed = JSON.parse(data);
+                if (event === "error") {
+                    content += (content ? "\n\n" : "") + parsed.error;
+                } else if (event === "message") {
+                    content += parsed.text;
+                }
+                show(content);
+            }
         }
 
         setLoading(false);
@@ -73,7 +108,10 @@ export const ChatWindow = () => {
         };
         setMessages([...messages, newMessage]);
         setLoading(true);
-        getCompletion(newMessage);
+        getCompletion(newMessage).catch((error) => {
+            // Stopped by the user: the server cancels the generation.
+            if (error.name !== "AbortError") throw error;
+        });
     };
 
     const submitMessage = (e: React.FormEvent) => {
@@ -84,6 +122,7 @@ export const ChatWindow = () => {
     };
 
     const stop = () => {
+        abortRef.current?.abort();
         setLoading(false);
     };
 